@@ -0,0 +1,341 @@
+import os
+import json
+import sqlite3
+import zipfile
+import hashlib
+import datetime
+
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from DataMallParallel import print_progress
+
+
+# the layer metadata table of the GeoPackage, next to "gpkg_contents"
+META_TABLE = 'geostore_layers'
+
+META_COLS = {'layer'         : 'TEXT',
+             'source'        : 'TEXT',      # the zip file
+             'sha256'        : 'TEXT',      # the checksum of the zip file
+             'features'      : 'INTEGER',
+             'geometry_type' : 'TEXT',
+             'crs'           : 'TEXT',
+             'min_x'         : 'REAL',
+             'min_y'         : 'REAL',
+             'max_x'         : 'REAL',
+             'max_y'         : 'REAL',
+             'updated'       : 'TEXT'}
+
+
+def file_sha256(path, chunk_size=1024*1024):
+    '''
+    the sha256 checksum of a file, as in the download manifest (the
+    "file_sha256" of request_codes, which is not on the path of process_codes)
+    '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+# ----------------------------------------------------------------------------
+def list_zip_layers(zip_path):
+    '''
+    the shapefiles of a zip file, as GDAL virtual paths
+
+    Returns:
+        layers (list): [(shapefile name, "/vsizip/..." path), ...]
+
+    '''
+    with zipfile.ZipFile(zip_path) as zf:
+        shp_li = sorted(n for n in zf.namelist() if n.lower().endswith('.shp'))
+
+    return [(os.path.splitext(os.path.basename(n))[0], '/vsizip/{0}/{1}'.format(zip_path, n))
+            for n in shp_li]
+# ============================================================================
+
+
+
+
+class GeoStore():
+    '''
+    One GeoPackage of the "GeospatialWholeIsland" layers
+
+    Every layer is a table of the GeoPackage with its R-tree spatial index,
+    written by GDAL (through "pyogrio"). The bounding box, CRS, number of
+    features and sha256 of the source zip of each layer are kept in the
+    table "geostore_layers", so an unchanged zip is not converted again.
+
+    The queries ("query_bbox", "query_within", "query_nearest") only read
+    the features whose bounding box matches, through the R-tree.
+
+    Example
+    -------
+    store = GeoStore('data/geospatial.gpkg')
+    store.ingest_folder('data/2_23_GEOSPATIAL/2022-06')
+    store.query_within('ArrowMarking', subzone_polygon)
+    '''
+    def __init__(self, path):
+        '''
+
+        Args:
+            path (str): the GeoPackage (.gpkg), created by the first ingestion.
+
+        Returns:
+            None.
+
+        '''
+        self.path = path
+        return None
+    # ----------------------------------------------------------------------
+    def _connect(self):
+
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE IF NOT EXISTS {0} ({1}, PRIMARY KEY (layer))'.format(
+                     META_TABLE, ', '.join('{0} {1}'.format(c, t) for c, t in META_COLS.items())))
+        return conn
+    # ----------------------------------------------------------------------
+    def layers(self):
+        '''
+        the metadata of the layers, one row per layer
+
+        Returns:
+            meta_df (pandas.DataFrame): the columns of "META_COLS", indexed by 'layer'.
+
+        '''
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=list(META_COLS.keys())).set_index('layer')
+
+        with closing(self._connect()) as conn:
+            meta_df = pd.read_sql('SELECT * FROM {0} ORDER BY layer'.format(META_TABLE), conn)
+
+        return meta_df.set_index('layer')
+    # ----------------------------------------------------------------------
+    def bounds(self, layer):
+        '''
+        the bounding box (min_x, min_y, max_x, max_y) of a layer
+        '''
+        return tuple(self.layers().loc[layer, ['min_x', 'min_y', 'max_x', 'max_y']].tolist())
+    # ----------------------------------------------------------------------
+    def crs(self, layer):
+        return self.layers().loc[layer, 'crs']
+    # ----------------------------------------------------------------------
+    def ingest_zip(self, zip_path, layer=None, sha256=None, force=False):
+        '''
+        convert the shapefile(s) of a downloaded zip into layer(s) of the
+        GeoPackage, replacing the former version of the layer(s)
+
+        Args:
+            zip_path (str): e.g. '2_23_GEOSPATIAL/2022-06/ArrowMarking.zip'.
+            layer (str, optional): the layer name. Defaults to None, the
+                name of the zip file. A zip of several shapefiles gives the
+                layers "<layer>_<shapefile>".
+            sha256 (str, optional): the checksum of the zip, e.g. from the
+                download manifest. Defaults to None, computed.
+            force (bool, optional): convert an unchanged zip. Defaults to False.
+
+        Returns:
+            layers (list): the converted layers, empty if unchanged.
+
+        '''
+        import pyogrio
+
+        layer = os.path.splitext(os.path.basename(zip_path))[0] if layer is None else layer
+        sha256 = file_sha256(zip_path) if sha256 is None else sha256
+
+        shp_li = list_zip_layers(zip_path)
+
+        if len(shp_li) == 1:
+            names = [layer]
+        else:
+            names = ['{0}_{1}'.format(layer, shp_name) for shp_name, _ in shp_li]
+
+        meta_df = self.layers()
+
+        if not force and all(n in meta_df.index and meta_df.loc[n, 'sha256'] == sha256 for n in names):
+            return []
+
+        folder_path = os.path.dirname(self.path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        records = []
+        for name, (_, vsi_path) in zip(names, shp_li):
+            data = pyogrio.read_dataframe(vsi_path)
+
+            # one layer per table, with the GeoPackage R-tree index
+            pyogrio.write_dataframe(data, self.path, layer=name, driver='GPKG',
+                                    layer_options={'SPATIAL_INDEX': 'YES'})
+
+            min_x, min_y, max_x, max_y = data.total_bounds if len(data) > 0 else [np.nan] * 4
+
+            records.append({'layer'         : name,
+                            'source'        : os.path.abspath(zip_path),
+                            'sha256'        : sha256,
+                            'features'      : len(data),
+                            'geometry_type' : ','.join(sorted(data.geom_type.dropna().unique())),
+                            'crs'           : None if data.crs is None else data.crs.to_string(),
+                            'min_x'         : float(min_x),
+                            'min_y'         : float(min_y),
+                            'max_x'         : float(max_x),
+                            'max_y'         : float(max_y),
+                            'updated'       : datetime.datetime.now().isoformat(timespec='seconds')})
+
+        with closing(self._connect()) as conn, conn:
+            conn.executemany('INSERT OR REPLACE INTO {0} VALUES ({1})'.format(
+                             META_TABLE, ', '.join('?' * len(META_COLS))),
+                             [[r[c] for c in META_COLS] for r in records])
+        return names
+    # ----------------------------------------------------------------------
+    def ingest_folder(self, folder_path, progress=print_progress):
+        '''
+        convert every zip of a month folder of "save_geospatial", the
+        checksums of its "manifest.json" are used if present
+
+        Args:
+            folder_path (str): e.g. '2_23_GEOSPATIAL/2022-06'.
+            progress (callable, optional): progress(done, total, zip file),
+                called when a zip is done, None for no progress. Defaults to
+                "DataMallParallel.print_progress".
+
+        Returns:
+            layers (list): the converted layers.
+
+        '''
+        manifest_path = os.path.join(folder_path, 'manifest.json')
+
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+
+        zip_li = sorted(fn for fn in os.listdir(folder_path) if fn.lower().endswith('.zip'))
+
+        converted = []
+        for i, fn in enumerate(zip_li):
+            id_ = os.path.splitext(fn)[0]
+            entry = manifest.get(id_, {})
+
+            if entry.get('status', 'complete') == 'complete':
+                converted.extend(self.ingest_zip(os.path.join(folder_path, fn), layer=id_,
+                                                 sha256=entry.get('sha256')))
+
+            if not (progress is None):
+                progress(i + 1, len(zip_li), fn)
+        return converted
+    # ----------------------------------------------------------------------
+    def _to_layer_crs(self, geom, layer, crs):
+        '''
+        the geometry "geom" of the CRS "crs" in the CRS of the layer
+        '''
+        if crs is None:
+            return geom
+
+        import geopandas as gpd
+        return gpd.GeoSeries([geom], crs=crs).to_crs(self.crs(layer)).iloc[0]
+    # ----------------------------------------------------------------------
+    def query_bbox(self, layer, bbox, crs=None, columns=None):
+        '''
+        the features of "layer" whose bounding box intersects "bbox"
+
+        Args:
+            layer (str): DESCRIPTION.
+            bbox (tuple): (min_x, min_y, max_x, max_y).
+            crs (optional): the CRS of "bbox". Defaults to None, the CRS of the layer.
+            columns (list, optional): the columns to read. Defaults to None, all.
+
+        Returns:
+            data (geopandas.GeoDataFrame): DESCRIPTION.
+
+        '''
+        import pyogrio
+        import shapely
+
+        if not (crs is None):
+            bbox = self._to_layer_crs(shapely.box(*bbox), layer, crs).bounds
+
+        return pyogrio.read_dataframe(self.path, layer=layer, bbox=tuple(bbox), columns=columns)
+    # ----------------------------------------------------------------------
+    def query_within(self, layer, polygon, predicate='within', crs=None, columns=None):
+        '''
+        the features of "layer" within (or intersecting) "polygon", e.g.
+        the arrow markings inside a subzone
+
+        Args:
+            layer (str): DESCRIPTION.
+            polygon (shapely.Polygon or MultiPolygon): DESCRIPTION.
+            predicate (str, optional): 'within' or 'intersects'. Defaults to 'within'.
+            crs (optional): the CRS of "polygon". Defaults to None, the CRS of the layer.
+            columns (list, optional): the columns to read. Defaults to None, all.
+
+        Returns:
+            data (geopandas.GeoDataFrame): DESCRIPTION.
+
+        '''
+        import shapely
+
+        assert predicate in ['within', 'intersects'], 'Unknown predicate: {0}'.format(predicate)
+
+        polygon = self._to_layer_crs(polygon, layer, crs)
+
+        # the R-tree candidates, then the exact predicate
+        data = self.query_bbox(layer, polygon.bounds, columns=columns)
+
+        shapely.prepare(polygon)
+        if predicate == 'within':
+            mask = shapely.contains(polygon, data.geometry.values)
+        else:
+            mask = shapely.intersects(polygon, data.geometry.values)
+
+        return data[mask].reset_index(drop=True)
+    # ----------------------------------------------------------------------
+    def query_nearest(self, layer, point, k=1, max_distance=None, crs=None, columns=None):
+        '''
+        the "k" features of "layer" nearest to "point", with their distance
+        in the unit of the layer CRS (meters for SVY21)
+
+        The bounding box around "point" is doubled until it holds "k"
+        features within its half width, so only the features near the point
+        are read.
+
+        Args:
+            layer (str): DESCRIPTION.
+            point (shapely.Point): DESCRIPTION.
+            k (int, optional): Defaults to 1.
+            max_distance (float, optional): Defaults to None, no limit.
+            crs (optional): the CRS of "point". Defaults to None, the CRS of the layer.
+            columns (list, optional): the columns to read. Defaults to None, all.
+
+        Returns:
+            data (geopandas.GeoDataFrame): with the column 'distance', sorted by it.
+
+        '''
+        point = self._to_layer_crs(point, layer, crs)
+
+        min_x, min_y, max_x, max_y = self.bounds(layer)
+        # the radius covering the whole layer from "point"
+        full_radius = np.hypot(max(point.x - min_x, max_x - point.x), max(point.y - min_y, max_y - point.y))
+
+        if not (max_distance is None):
+            full_radius = min(full_radius, max_distance)
+
+        # the first radius: about "k" features if they were uniform
+        n = max(1, self.layers().loc[layer, 'features'])
+        radius = max(1e-9, np.sqrt((max_x - min_x) * (max_y - min_y) * k / n))
+        radius = min(radius, full_radius)
+
+        while True:
+            bbox = (point.x - radius, point.y - radius, point.x + radius, point.y + radius)
+            data = self.query_bbox(layer, bbox, columns=columns)
+
+            data['distance'] = data.geometry.distance(point)
+            data = data[data['distance'] <= radius]
+
+            # every feature closer than "radius" is in the bounding box
+            if len(data) >= k or radius >= full_radius:
+                break
+            radius = min(2. * radius, full_radius)
+
+        return data.sort_values('distance', kind='stable').head(k).reset_index(drop=True)
+# ============================================================================
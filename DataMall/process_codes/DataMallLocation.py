@@ -0,0 +1,408 @@
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from DataMallSnapshot import (SNAPSHOT_TIME_FMT, list_partitions, iter_snapshots,
+                              parse_carpark_loc, parse_road_loc)
+
+
+# the location feeds
+#   key_cols : the raw columns of the key, joined by '_'
+#   raw_cols : the raw columns of the location attributes
+#   parse    : parse(raw rows) -> location rows, keeping the row index
+LOCATION_FEEDS = {
+    'carpark' : {'key'     : 'id',
+                 'key_cols': ['CarParkID', 'LotType'],
+                 'raw_cols': ['CarParkID', 'Development', 'LotType', 'Agency', 'Location'],
+                 'parse'   : parse_carpark_loc},
+    'road'    : {'key'     : 'LinkID',
+                 'key_cols': ['LinkID'],
+                 'raw_cols': ['LinkID', 'RoadName', 'RoadCategory', 'Location'],
+                 'parse'   : parse_road_loc},
+    }
+
+CHANGE_COLS = ['column', 'old', 'new', 'datetime']
+
+# the hash of the locations loaded from a csv, unknown until seen again
+UNKNOWN_HASH = np.uint64(0)
+
+
+class LocationRegistry():
+    '''
+    Incremental registry of the carpark / road locations
+
+    A hash index of the seen keys ("id" or "LinkID") is kept with the hash
+    of the raw location attributes of each key. For every snapshot only the
+    new keys, and the keys whose attributes changed, are parsed; the others
+    only update their "last_seen" time. The attribute changes are recorded
+    as (key, column, old, new, datetime).
+
+    The cost of a snapshot is linear in its size, instead of the
+    concat / drop_duplicates of the whole month after every snapshot.
+    '''
+    def __init__(self, feed, path=None):
+        '''
+
+        Args:
+            feed (str): 'carpark' or 'road', see "LOCATION_FEEDS".
+            path (str, optional): a location csv saved by "save", loaded to
+                continue the registry. Defaults to None.
+
+        Returns:
+            None.
+
+        '''
+        assert feed in LOCATION_FEEDS, 'Unknown feed: {0}'.format(feed)
+
+        self.feed = feed
+        self.config = LOCATION_FEEDS[feed]
+        self.key = self.config['key']
+
+        # the location attributes, and the arrays in the same order
+        self.keys = pd.Index([], dtype=object)
+        self.attrs = None
+        self.hashes = np.zeros(0, dtype='u8')
+        self.first_seen = np.zeros(0, dtype='datetime64[s]')
+        self.last_seen = np.zeros(0, dtype='datetime64[s]')
+
+        self.change_li = []
+        # the time of the last added snapshot, "YYYY-mm-dd-HH-MM-SS"
+        self.last_snapshot = None
+
+        if not (path is None) and os.path.exists(path):
+            self.load(path)
+        return None
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.keys)
+    # ----------------------------------------------------------------------
+    def _append(self, attrs, hashes, t):
+        '''
+        register new keys
+        '''
+        self.keys = self.keys.append(pd.Index(attrs[self.key].to_numpy(), dtype=object))
+        self.attrs = attrs.reset_index(drop=True) if self.attrs is None else \
+            pd.concat([self.attrs, attrs], ignore_index=True, axis=0)
+
+        self.hashes = np.concatenate([self.hashes, hashes])
+        self.first_seen = np.concatenate([self.first_seen, np.full(len(hashes), t)])
+        self.last_seen = np.concatenate([self.last_seen, np.full(len(hashes), t)])
+        return None
+    # ----------------------------------------------------------------------
+    def _update_attrs(self, pos, attrs, t):
+        '''
+        record and apply the attribute changes of the registered keys "pos",
+        at the time "t" (one time, or one per key)
+        '''
+        old = self.attrs.iloc[pos].reset_index(drop=True)
+        new = attrs.reset_index(drop=True)
+        t = np.broadcast_to(np.asarray(t, dtype='datetime64[s]'), (new.shape[0],))
+
+        for col in old.columns:
+            diff = (old[col].fillna('') != new[col].fillna('')).to_numpy()
+            if not diff.any():
+                continue
+
+            change = pd.DataFrame({self.key  : new[self.key][diff].to_numpy(),
+                                   'column'  : col,
+                                   'old'     : old[col][diff].to_numpy(),
+                                   'new'     : new[col][diff].to_numpy(),
+                                   'datetime': pd.to_datetime(t[diff])})
+            self.change_li.append(change)
+
+        self.attrs.iloc[pos] = new[self.attrs.columns].to_numpy()
+        return None
+    # ----------------------------------------------------------------------
+    def _first_attrs(self, pos):
+        '''
+        the attributes of the keys "pos" when they were first seen, before
+        their recorded changes
+        '''
+        attrs = self.attrs.iloc[pos].reset_index(drop=True)
+
+        if len(self.change_li) == 0:
+            return attrs
+
+        # the old value of the first change of each (key, column)
+        first = self.changes().drop_duplicates(subset=[self.key, 'column'], keep='first')
+        keys = pd.Index(attrs[self.key].to_numpy(), dtype=object)
+
+        for col, change in first.groupby('column', sort=False):
+            ix = keys.get_indexer(change[self.key].to_numpy())
+            attrs.loc[ix[ix >= 0], col] = change['old'].to_numpy()[ix >= 0]
+        return attrs
+    # ----------------------------------------------------------------------
+    def add_snapshot(self, data, dt):
+        '''
+        add one raw snapshot
+
+        Args:
+            data (pandas.DataFrame): the raw snapshot, read as str.
+            dt (datetime.datetime or str): the snapshot time, or its
+                "YYYY-mm-dd-HH-MM-SS" string.
+
+        Returns:
+            n_new (int): the number of new keys.
+
+        '''
+        if isinstance(dt, str):
+            dt = pd.to_datetime(dt, format=SNAPSHOT_TIME_FMT)
+        t = np.datetime64(pd.Timestamp(dt), 's')
+
+        keys = data[self.config['key_cols'][0]]
+        for col in self.config['key_cols'][1:]:
+            keys = keys.str.cat(data[col], sep='_')
+
+        data = data[keys.notna().to_numpy()]
+        keys = keys[keys.notna()]
+
+        # the first row of each key
+        first = ~keys.duplicated().to_numpy()
+        data, keys = data[first].reset_index(drop=True), pd.Index(keys[first].to_numpy(), dtype=object)
+
+        hashes = pd.util.hash_pandas_object(data[self.config['raw_cols']], index=False).to_numpy()
+
+        pos = self.keys.get_indexer(keys)
+        is_new = pos < 0
+
+        # the registered keys
+        pos_old = pos[~is_new]
+        self.last_seen[pos_old] = np.maximum(self.last_seen[pos_old], t)
+
+        changed = self.hashes[pos_old] != hashes[~is_new]
+        if changed.any():
+            idx = np.flatnonzero(~is_new)[changed]
+            attrs = self.config['parse'](data.iloc[idx])
+
+            # the rows dropped by "parse" keep their attributes
+            keep = np.isin(idx, attrs.index.to_numpy())
+            self._update_attrs(pos_old[changed][keep], attrs, t)
+            self.hashes[pos_old[changed][keep]] = hashes[idx[keep]]
+
+        # the new keys, parsed only once
+        n_new = 0
+        if is_new.any():
+            attrs = self.config['parse'](data[is_new])
+            self._append(attrs, hashes[attrs.index.to_numpy()], t)
+            n_new = attrs.shape[0]
+
+        dt_str = pd.Timestamp(dt).strftime(SNAPSHOT_TIME_FMT)
+        if (self.last_snapshot is None) or (dt_str > self.last_snapshot):
+            self.last_snapshot = dt_str
+        return n_new
+    # ----------------------------------------------------------------------
+    def update(self, source, progress=True):
+        '''
+        add the snapshots of "source" later than the last added snapshot,
+        e.g. the new snapshots of a month folder still being collected
+
+        Args:
+            source (str): a month folder or zip file, see "list_partitions".
+            progress (bool, optional): print each day. Defaults to True.
+
+        Returns:
+            n (int): the number of added snapshots.
+
+        '''
+        n = 0
+        for day, path_li in list_partitions(source).items():
+
+            path_li = [p for p in path_li if (self.last_snapshot is None) or
+                       (os.path.basename(p).split('.')[0] > self.last_snapshot)]
+            if len(path_li) == 0:
+                continue
+
+            if progress:
+                print('Read file :', day, len(path_li))
+
+            n = n + self.add_snapshots(source, path_li)
+        return n
+    # ----------------------------------------------------------------------
+    def add_snapshots(self, source, path_li):
+        '''
+        add the snapshots "path_li" of "source", in order
+
+        Returns:
+            n (int): the number of added snapshots.
+
+        '''
+        n = 0
+        for dt_str, f in iter_snapshots(source, path_li):
+            try:
+                data = pd.read_csv(f, header=0, index_col=None, dtype=str)
+            except Exception:
+                continue
+
+            self.add_snapshot(data, dt_str)
+            n = n + 1
+        return n
+    # ----------------------------------------------------------------------
+    def merge(self, other):
+        '''
+        merge another registry of the same feed, e.g. of another month;
+        the attributes of the key seen last are kept
+
+        The keys of "other" first seen after their last time in this
+        registry record the changes of their attributes at that time, so
+        registries of consecutive periods merged in order give the registry
+        of the whole period.
+
+        Args:
+            other (LocationRegistry): DESCRIPTION.
+
+        Returns:
+            None.
+
+        '''
+        assert other.feed == self.feed, 'Different feeds: {0}, {1}'.format(self.feed, other.feed)
+
+        if len(other) == 0:
+            return None
+
+        pos = self.keys.get_indexer(other.keys)
+        is_new = pos < 0
+
+        pos_old = pos[~is_new]
+        idx = np.flatnonzero(~is_new)
+
+        # the changes between the two periods
+        after = other.first_seen[idx] > self.last_seen[pos_old]
+        if after.any():
+            self._update_attrs(pos_old[after], other._first_attrs(idx[after]), other.first_seen[idx[after]])
+
+        later = other.last_seen[idx] > self.last_seen[pos_old]
+        if later.any():
+            self.attrs.iloc[pos_old[later]] = other.attrs.iloc[idx[later]][self.attrs.columns].to_numpy()
+            self.hashes[pos_old[later]] = other.hashes[idx[later]]
+
+        self.first_seen[pos_old] = np.minimum(self.first_seen[pos_old], other.first_seen[idx])
+        self.last_seen[pos_old] = np.maximum(self.last_seen[pos_old], other.last_seen[idx])
+
+        if is_new.any():
+            n = len(self)
+            self._append(other.attrs[is_new], other.hashes[is_new], np.datetime64('NaT', 's'))
+            self.first_seen[n:] = other.first_seen[is_new]
+            self.last_seen[n:] = other.last_seen[is_new]
+
+        self.change_li.extend(other.change_li)
+
+        if (self.last_snapshot is None) or \
+                (not (other.last_snapshot is None) and other.last_snapshot > self.last_snapshot):
+            self.last_snapshot = other.last_snapshot
+        return None
+    # ----------------------------------------------------------------------
+    def to_frame(self):
+        '''
+        the locations, with the first / last seen times
+
+        Returns:
+            data (pandas.DataFrame): the columns of "parse" and
+                ['first_seen', 'last_seen'].
+
+        '''
+        if self.attrs is None:
+            return pd.DataFrame(columns=[self.key, 'first_seen', 'last_seen'])
+
+        data = self.attrs.copy()
+        data['first_seen'] = pd.to_datetime(self.first_seen)
+        data['last_seen'] = pd.to_datetime(self.last_seen)
+        return data
+    # ----------------------------------------------------------------------
+    def changes(self):
+        '''
+        the attribute changes
+
+        Returns:
+            data (pandas.DataFrame): columns [key, 'column', 'old', 'new', 'datetime'].
+
+        '''
+        if len(self.change_li) == 0:
+            return pd.DataFrame(columns=[self.key] + CHANGE_COLS)
+
+        data = pd.concat(self.change_li, ignore_index=True, axis=0)
+        return data.sort_values(by='datetime', kind='stable', ignore_index=True)
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def changes_path(path):
+        root, ext = os.path.splitext(path)
+        return '{0}_changes{1}'.format(root, ext)
+    # ----------------------------------------------------------------------
+    def save(self, path):
+        '''
+        save the locations to "path" (e.g. "carpark_location_2022-06.csv")
+        and the attribute changes to "<path>_changes.csv"
+        '''
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.to_frame().to_csv(path, index=False)
+        self.changes().to_csv(self.changes_path(path), index=False)
+        return None
+    # ----------------------------------------------------------------------
+    def load(self, path):
+        '''
+        load the locations saved by "save"; the hashes of the raw attributes
+        are unknown, so each key is parsed once more when it is seen again
+        '''
+        data = pd.read_csv(path, header=0, index_col=None, dtype=str)
+
+        first_seen = pd.to_datetime(data.pop('first_seen')).to_numpy().astype('datetime64[s]')
+        last_seen = pd.to_datetime(data.pop('last_seen')).to_numpy().astype('datetime64[s]')
+
+        self.keys = pd.Index([], dtype=object)
+        self.attrs = None
+        self.hashes = np.zeros(0, dtype='u8')
+        self.first_seen = np.zeros(0, dtype='datetime64[s]')
+        self.last_seen = np.zeros(0, dtype='datetime64[s]')
+
+        self._append(data, np.full(data.shape[0], UNKNOWN_HASH, dtype='u8'), np.datetime64('NaT', 's'))
+        self.first_seen[:] = first_seen
+        self.last_seen[:] = last_seen
+
+        if len(self) > 0:
+            self.last_snapshot = pd.Timestamp(self.last_seen.max()).strftime(SNAPSHOT_TIME_FMT)
+
+        changes_path = self.changes_path(path)
+        if os.path.exists(changes_path):
+            change = pd.read_csv(changes_path, header=0, index_col=None, dtype=str)
+            if change.shape[0] > 0:
+                change['datetime'] = pd.to_datetime(change['datetime'])
+                self.change_li = [change]
+        return None
+# ============================================================================
+
+
+
+
+def extract_locations(source, feed, save_path=None, registry_path=None):
+    '''
+    extract the locations of one month of snapshots, incrementally
+
+    Args:
+        source (str): a month folder or zip file, see "list_partitions".
+        feed (str): 'carpark' or 'road'.
+        save_path (str, optional): the location csv. Defaults to None.
+        registry_path (str, optional): a location csv to continue, e.g.
+            "save_path" itself to add the new snapshots only. Defaults to None.
+
+    Returns:
+        registry (LocationRegistry): DESCRIPTION.
+
+    Example
+    -------
+    registry = extract_locations('2022-06.zip', 'carpark',
+                                 save_path='carpark_data/carpark_location_2022-06.csv')
+    data = registry.to_frame()
+
+    '''
+    registry = LocationRegistry(feed, path=registry_path)
+    registry.update(source)
+
+    if not (save_path is None):
+        print('save: ', os.path.basename(save_path), len(registry))
+        registry.save(save_path)
+    return registry
+# ============================================================================
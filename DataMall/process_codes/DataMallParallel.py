@@ -0,0 +1,167 @@
+
+import time
+import functools
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from DataMallSnapshot import (list_partitions, snapshot_sizes, partial_aggregate,
+                              merge_partials, finalize_partial)
+from DataMallLocation import LocationRegistry
+
+
+# the memory of a parsed snapshot relative to its csv size (estimated)
+MEMORY_FACTOR = 4
+
+
+def _split_batches(path_li, sizes, memory_budget_mb):
+    '''
+    split the snapshots of a partition into batches, each parsed within
+    "memory_budget_mb"
+    '''
+    budget = memory_budget_mb * 1024 * 1024
+
+    batches, batch, batch_size = [], [], 0
+    for path in path_li:
+        size = sizes.get(path, 0) * MEMORY_FACTOR
+
+        if len(batch) > 0 and batch_size + size > budget:
+            batches.append(batch)
+            batch, batch_size = [], 0
+
+        batch.append(path)
+        batch_size = batch_size + size
+
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+# ----------------------------------------------------------------------------
+def _ingest_partition(source, path_li, map_func, reduce_func, sizes, memory_budget_mb):
+    '''
+    the worker: map the batches of one partition, reduce them to one partial
+    '''
+    partials = [map_func(source, batch)
+                for batch in _split_batches(path_li, sizes, memory_budget_mb)]
+    return reduce_func(partials)
+# ----------------------------------------------------------------------------
+def print_progress(done, total, partition):
+    print('[ {0} ] {1}/{2} : {3}'.format(time.ctime(), done, total, partition), flush=True)
+# ----------------------------------------------------------------------------
+def ingest_parallel(source, map_func, reduce_func, max_workers=None,
+                    memory_budget_mb=512, progress=None):
+    '''
+    map the day partitions of "source" (folders or zip members) to a pool
+    of processes, each producing a partial aggregate, then merge the partials
+
+    Args:
+        source (str): a month folder or zip file, see "list_partitions".
+        map_func (callable): map_func(source, path_li) -> partial, picklable
+            (a module-level function or a functools.partial of it).
+        reduce_func (callable): reduce_func([partial, ...]) -> partial.
+        max_workers (int, optional): Defaults to None, the number of CPUs.
+        memory_budget_mb (float, optional): the memory of the snapshots
+            parsed at once by a worker. Defaults to 512.
+        progress (callable, optional): progress(done, total, partition),
+            called when a partition finishes. Defaults to None.
+
+    Returns:
+        partial: the merged partial aggregate.
+
+    '''
+    partitions = list_partitions(source)
+    sizes = snapshot_sizes(source)
+
+    # partition -> partial
+    partials = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_ingest_partition, source, path_li, map_func, reduce_func,
+                                   {p: sizes.get(p, 0) for p in path_li}, memory_budget_mb): day
+                   for day, path_li in partitions.items()}
+
+        for fut in as_completed(futures):
+            partials[futures[fut]] = fut.result()
+
+            if not (progress is None):
+                progress(len(partials), len(futures), futures[fut])
+
+    # merged in the partition order, whichever worker finishes first
+    return reduce_func([partials[day] for day in sorted(partials.keys())])
+# ============================================================================
+
+
+
+
+def resample_month_parallel(source, reader, data_value_name, freq='1h', stats=('mean',),
+                            save_path=None, max_workers=None, memory_budget_mb=512,
+                            progress=print_progress):
+    '''
+    "DataMallSnapshot.resample_month" with the days aggregated in parallel
+
+    Returns:
+        data (pandas.DataFrame): columns ['id', data_value_name, 'datetime'].
+
+    Example
+    -------
+    data = resample_month_parallel('2022-06.zip', read_carpark_avali, 'lots',
+                                   save_path='carpark_data/carpark_1h_2022-06.csv')
+
+    '''
+    map_func = functools.partial(partial_aggregate, reader=reader, freq=freq)
+
+    partial = ingest_parallel(source, map_func, merge_partials, max_workers=max_workers,
+                              memory_budget_mb=memory_budget_mb, progress=progress)
+
+    data = finalize_partial(partial, data_value_name, stats=stats)
+
+    if not (save_path is None):
+        data.to_csv(save_path, index=False)
+    return data
+# ----------------------------------------------------------------------------
+def _read_locations(source, path_li, feed):
+    '''
+    the location registry of the snapshots "path_li"
+    '''
+    registry = LocationRegistry(feed)
+    registry.add_snapshots(source, path_li)
+    return registry
+# ----------------------------------------------------------------------------
+def _merge_locations(registries, feed):
+    '''
+    merge the registries of consecutive batches, in order
+    '''
+    registry = LocationRegistry(feed)
+    for other in registries:
+        registry.merge(other)
+    return registry
+# ----------------------------------------------------------------------------
+def extract_locations_parallel(source, feed, save_path=None, max_workers=None,
+                               memory_budget_mb=512, progress=print_progress):
+    '''
+    "DataMallLocation.extract_locations" with the days read in parallel,
+    the registries of the days are merged in order, see "LocationRegistry.merge"
+
+    Args:
+        source (str): a month folder or zip file.
+        feed (str): 'carpark' or 'road'.
+        save_path (str, optional): the location csv. Defaults to None.
+
+    Returns:
+        registry (LocationRegistry): DESCRIPTION.
+
+    Example
+    -------
+    registry = extract_locations_parallel('2022-06.zip', 'carpark',
+                                          save_path='carpark_data/carpark_location_2022-06.csv')
+    data = registry.to_frame()
+
+    '''
+    map_func = functools.partial(_read_locations, feed=feed)
+    reduce_func = functools.partial(_merge_locations, feed=feed)
+
+    registry = ingest_parallel(source, map_func, reduce_func, max_workers=max_workers,
+                               memory_budget_mb=memory_budget_mb, progress=progress)
+
+    if not (save_path is None):
+        registry.save(save_path)
+    return registry
+# ============================================================================
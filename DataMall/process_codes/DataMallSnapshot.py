@@ -0,0 +1,344 @@
+
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+SNAPSHOT_TIME_FMT = "%Y-%m-%d-%H-%M-%S"
+
+# the statistics of "resample_month", computed from the mergeable partials
+STATS = ['mean', 'min', 'max', 'count']
+
+
+def list_partitions(source):
+    '''
+    list the snapshots of one month by day
+
+    Args:
+        source (str): a month folder ("<day>/<timestamp>.csv") or a zip file
+            of it, e.g. '2022-06' or '2022-06.zip'.
+
+    Returns:
+        partitions (dict): {'YYYY-MM-DD': [snapshot path or zip member, ...]},
+            sorted by day and by time.
+
+    '''
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as zf:
+            path_li = [p for p in zf.namelist() if p.endswith('.csv')]
+    else:
+        path_li = [os.path.join(source, fd, fn)
+                   for fd in os.listdir(source) if os.path.isdir(os.path.join(source, fd))
+                   for fn in os.listdir(os.path.join(source, fd)) if fn.endswith('.csv')]
+
+    partitions = {}
+    for path in path_li:
+        partitions.setdefault(os.path.basename(path)[:10], []).append(path)
+
+    partitions = {day: sorted(partitions[day], key=os.path.basename) for day in sorted(partitions)}
+    return partitions
+# ----------------------------------------------------------------------------
+def snapshot_sizes(source):
+    '''
+    the (uncompressed) size of every snapshot of "source"
+
+    Returns:
+        sizes (dict): {snapshot path or zip member: bytes}
+
+    '''
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as zf:
+            return {info.filename: info.file_size for info in zf.infolist()}
+
+    return {path: os.path.getsize(path)
+            for path_li in list_partitions(source).values() for path in path_li}
+# ----------------------------------------------------------------------------
+def iter_snapshots(source, path_li):
+    '''
+    iterate the snapshots "path_li" of "source"
+
+    Yields:
+        dt_str (str): the snapshot time, "YYYY-mm-dd-HH-MM-SS".
+        f (str or io.BytesIO): the snapshot, readable by "pandas.read_csv".
+
+    '''
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as zf:
+            for path in path_li:
+                yield os.path.basename(path).split('.')[0], io.BytesIO(zf.read(path))
+    else:
+        for path in path_li:
+            yield os.path.basename(path).split('.')[0], path
+# ============================================================================
+
+
+
+
+def read_carpark_avali(path):
+    '''
+    read one snapshot of the carpark availability
+
+    Args:
+        path (str or file-like object): DESCRIPTION.
+
+    Returns:
+        data (pandas.DataFrame) or None: columns ['id', 'lots'].
+
+    '''
+    try:
+        data = pd.read_csv(path, header=0, index_col=None,
+                           usecols=['CarParkID', 'LotType', 'AvailableLots'],
+                           dtype={'CarParkID': str, 'LotType': str})
+    except Exception:
+        return None
+
+    data['id'] = data['CarParkID'].str.cat(data['LotType'], sep='_')
+    data = data.rename(columns = {'AvailableLots' : 'lots'})
+
+    data = data[['id', 'lots']].drop_duplicates(subset='id')
+    return data
+# ----------------------------------------------------------------------------
+def read_traffic_speed(path):
+    '''
+    read one snapshot of the traffic speed bands
+
+    Args:
+        path (str or file-like object): DESCRIPTION.
+
+    Returns:
+        data (pandas.DataFrame) or None: columns ['id', 'speed'].
+
+    '''
+    try:
+        data = pd.read_csv(path, header=0, index_col=None,
+                           usecols=['LinkID', 'MinimumSpeed'],
+                           dtype={'LinkID': str})
+    except Exception:
+        return None
+
+    data.dropna(axis=0, how='any', subset=['MinimumSpeed'], inplace=True)
+
+    data = data.rename(columns = {'LinkID' : 'id'})
+    data['speed'] = data['MinimumSpeed'] + 5
+
+    data = data[['id', 'speed']].drop_duplicates(subset='id')
+    return data
+# ----------------------------------------------------------------------------
+def parse_carpark_loc(data):
+    '''
+    the carpark location of the raw rows of the carpark availability
+
+    Args:
+        data (pandas.DataFrame): raw rows, read as str.
+
+    Returns:
+        data (pandas.DataFrame): columns
+            ['CarParkID', 'Development', 'LotType', 'Agency', 'id', 'lat', 'lng'].
+
+    '''
+    data = data.copy()
+    data['id'] = data['CarParkID'].str.cat(data['LotType'], sep='_')
+
+    data['lat'] = data['Location'].str.split(' ').str.get(0)
+    data['lng'] = data['Location'].str.split(' ').str.get(1)
+
+    return data[['CarParkID', 'Development', 'LotType', 'Agency', 'id', 'lat', 'lng']]
+# ----------------------------------------------------------------------------
+def parse_road_loc(data):
+    '''
+    the road location of the raw rows of the traffic speed bands
+
+    Args:
+        data (pandas.DataFrame): raw rows, read as str.
+
+    Returns:
+        data (pandas.DataFrame): columns
+            ['LinkID', 'RoadName', 'RoadCategory', 'Location'],
+            "Location" is the WKT of the link.
+
+    '''
+    from shapely.geometry import LineString
+
+    data = data[['LinkID', 'RoadName', 'RoadCategory', 'Location']].dropna(subset=['Location'])
+
+    # link location, "lat1 lng1 lat2 lng2" to "LINESTRING (lng1 lat1, lng2 lat2)"
+    coords = data['Location'].str.split(' ', expand=True).astype(float).to_numpy()
+    data = data.copy()
+    data['Location'] = [LineString([(c[1], c[0]), (c[3], c[2])]).wkt for c in coords]
+    return data
+# ----------------------------------------------------------------------------
+def read_carpark_loc(path):
+    '''
+    read the carpark location of one snapshot of the carpark availability
+
+    Returns:
+        data (pandas.DataFrame) or None: see "parse_carpark_loc".
+
+    '''
+    try:
+        data = pd.read_csv(path, header=0, index_col=None, dtype=str)
+    except Exception:
+        return None
+
+    return parse_carpark_loc(data).drop_duplicates(subset='id')
+# ----------------------------------------------------------------------------
+def read_road_loc(path):
+    '''
+    read the road location of one snapshot of the traffic speed bands
+
+    Returns:
+        data (pandas.DataFrame) or None: see "parse_road_loc".
+
+    '''
+    try:
+        data = pd.read_csv(path, header=0, index_col=None, dtype=str,
+                           usecols=['LinkID', 'RoadName', 'RoadCategory', 'Location'])
+    except Exception:
+        return None
+
+    return parse_road_loc(data.dropna(subset=['Location']).drop_duplicates(subset='LinkID'))
+# ============================================================================
+
+
+
+
+def partial_aggregate(source, path_li, reader, freq='1h'):
+    '''
+    aggregate the snapshots "path_li" into (id, bucket) partial statistics,
+    one vectorized groupby over all the snapshots
+
+    Args:
+        source (str): see "list_partitions".
+        path_li (list): the snapshots of "source".
+        reader (callable): reader(path) -> pandas.DataFrame ['id', value] or None.
+        freq (str, optional): the bucket size. Defaults to '1h'.
+
+    Returns:
+        partial (pandas.DataFrame) or None: columns
+            ['id', 'datetime', 'sum', 'count', 'min', 'max'].
+
+    '''
+    id_li, value_li, dt_li, n_li = [], [], [], []
+
+    for dt_str, f in iter_snapshots(source, path_li):
+        data = reader(f)
+
+        if (data is None) or (data.shape[0] == 0):
+            continue
+
+        id_li.append(data.iloc[:, 0].to_numpy())
+        value_li.append(data.iloc[:, 1].to_numpy(dtype='float64'))
+        dt_li.append(dt_str)
+        n_li.append(data.shape[0])
+
+    if len(id_li) == 0:
+        return None
+
+    # typed arrays: categorical ids, float values, datetime buckets
+    ids = pd.Categorical(np.concatenate(id_li))
+    values = np.concatenate(value_li)
+    buckets = pd.to_datetime(pd.Series(dt_li), format=SNAPSHOT_TIME_FMT).dt.floor(freq)
+    buckets = np.repeat(buckets.to_numpy(), n_li)
+
+    data = pd.DataFrame({'id': ids, 'datetime': buckets, 'value': values})
+    data = data[~np.isnan(values)]
+
+    partial = data.groupby(['id', 'datetime'], observed=True, sort=False)['value'].agg(
+        ['sum', 'count', 'min', 'max'])
+    partial = partial.reset_index()
+    partial['id'] = partial['id'].astype(str)
+    return partial
+# ----------------------------------------------------------------------------
+def merge_partials(partials):
+    '''
+    merge the partial statistics of several partitions
+
+    Args:
+        partials (list): the outputs of "partial_aggregate".
+
+    Returns:
+        partial (pandas.DataFrame) or None: DESCRIPTION.
+
+    '''
+    partials = [p for p in partials if not (p is None)]
+
+    if len(partials) == 0:
+        return None
+    if len(partials) == 1:
+        return partials[0]
+
+    partial = pd.concat(partials, ignore_index=True, axis=0)
+    partial = partial.groupby(['id', 'datetime'], sort=False).agg(
+        {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'})
+    return partial.reset_index()
+# ----------------------------------------------------------------------------
+def finalize_partial(partial, data_value_name, stats=('mean',)):
+    '''
+    the long format output "id, value, datetime" of the partial statistics
+
+    Args:
+        partial (pandas.DataFrame): DESCRIPTION.
+        data_value_name (str): the value column, e.g. 'lots' or 'speed'.
+        stats (tuple, optional): statistics of STATS. Defaults to ('mean',).
+            With one statistic the value column is "data_value_name",
+            otherwise "<data_value_name>_<stat>".
+
+    Returns:
+        data (pandas.DataFrame): DESCRIPTION.
+
+    '''
+    for stat in stats:
+        assert stat in STATS, 'Unknown statistic: {0}'.format(stat)
+
+    if partial is None:
+        cols = [data_value_name] if len(stats) == 1 else ['{0}_{1}'.format(data_value_name, s) for s in stats]
+        return pd.DataFrame(columns=['id'] + cols + ['datetime'])
+
+    data = pd.DataFrame({'id': partial['id']})
+
+    for stat in stats:
+        col = data_value_name if len(stats) == 1 else '{0}_{1}'.format(data_value_name, stat)
+
+        if stat == 'mean':
+            data[col] = partial['sum'] / partial['count']
+        else:
+            data[col] = partial[stat]
+
+    data['datetime'] = partial['datetime']
+
+    data.sort_values(by=['datetime', 'id'], ignore_index=True, inplace=True)
+    return data
+# ----------------------------------------------------------------------------
+def resample_month(source, reader, data_value_name, freq='1h', stats=('mean',), save_path=None):
+    '''
+    aggregate one month of snapshots into (id, bucket) statistics
+
+    Args:
+        source (str): a month folder or zip file, see "list_partitions".
+        reader (callable): "read_carpark_avali", "read_traffic_speed", ...
+        data_value_name (str): the value column, e.g. 'lots'.
+        freq (str, optional): the bucket size. Defaults to '1h'.
+        stats (tuple, optional): DESCRIPTION. Defaults to ('mean',).
+        save_path (str, optional): the output csv, written at once. Defaults to None.
+
+    Returns:
+        data (pandas.DataFrame): columns ['id', data_value_name, 'datetime'].
+
+    Example
+    -------
+    data = resample_month('2022-06.zip', read_carpark_avali, 'lots',
+                          save_path='carpark_data/carpark_1h_2022-06.csv')
+
+    '''
+    partials = [partial_aggregate(source, path_li, reader, freq=freq)
+                for day, path_li in list_partitions(source).items()]
+
+    data = finalize_partial(merge_partials(partials), data_value_name, stats=stats)
+
+    if not (save_path is None):
+        data.to_csv(save_path, index=False)
+    return data
+# ============================================================================
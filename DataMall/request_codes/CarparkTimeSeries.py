@@ -0,0 +1,334 @@
+
+import os
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from DataMallStorage import _path_to_dataset
+
+
+logger = logging.getLogger(__name__)
+
+# one record per (snapshot, carpark): 10 bytes
+#   t    : the snapshot time, seconds since 1970-01-01 (wall clock time)
+#   code : the integer code of the carpark id, see "carpark_static.csv"
+#   lots : the available lots, MISSING_LOTS if the carpark left the feed
+RECORD_DTYPE = np.dtype([('t', '<u4'), ('code', '<i4'), ('lots', '<i2')])
+
+# outside the stored lots, which are clipped to [LOTS_MIN, LOTS_MAX]
+MISSING_LOTS = np.iinfo('i2').min
+LOTS_MIN, LOTS_MAX = MISSING_LOTS + 1, np.iinfo('i2').max
+
+STATIC_COLS = ['CarParkID', 'Development', 'LotType', 'Agency', 'Area', 'id', 'lat', 'lng', 'code']
+
+
+def _to_seconds(dt):
+    return int(np.datetime64(dt, 's').astype('int64'))
+
+
+def _to_datetime(t):
+    return pd.to_datetime(np.asarray(t, dtype='int64'), unit='s')
+
+
+def _forward_fill(records, times):
+    '''
+    the lots of the carparks at the snapshot times "times" (sorted, unique),
+    each change holds until the next change of its carpark
+
+    Args:
+        records (numpy.ndarray): the changes, of RECORD_DTYPE.
+        times (numpy.ndarray): int64, the seconds of the snapshots.
+
+    Returns:
+        data (pandas.DataFrame): columns ['t', 'code', 'lots'], sorted by
+            't' and 'code', the missing lots excluded.
+
+    '''
+    rec = pd.DataFrame({'t': records['t'], 'code': records['code'], 'lots': records['lots']})
+    # a snapshot appended twice in the same second, e.g. a re-run: the last one is kept
+    rec = rec.drop_duplicates(subset=['t', 'code'], keep='last')
+    rec = rec.sort_values(by=['code', 't'], kind='stable')
+
+    t = rec['t'].to_numpy(dtype='i8')
+    code = rec['code'].to_numpy()
+    lots = rec['lots'].to_numpy()
+
+    # the snapshots [start, end) of each change
+    is_last = np.r_[code[1:] != code[:-1], True]
+    start = np.searchsorted(times, t, side='left')
+    end = np.where(is_last, len(times), np.searchsorted(times, np.r_[t[1:], 0], side='left'))
+
+    keep = (lots != MISSING_LOTS) & (end > start)
+    start, n, code, lots = start[keep], (end - start)[keep], code[keep], lots[keep]
+
+    ix = np.repeat(start - np.r_[0, np.cumsum(n)[:-1]], n) + np.arange(n.sum())
+
+    data = pd.DataFrame({'t'    : times[ix],
+                         'code' : np.repeat(code, n),
+                         'lots' : np.repeat(lots, n)})
+    return data.sort_values(by=['t', 'code'], ignore_index=True)
+# ============================================================================
+
+
+class CarparkStore():
+    '''
+    Append-only time-series store of the carpark availability
+
+    The static attributes are kept once in "carpark_static.csv" (the columns
+    of "carpark_location_YYYY-MM.csv" and an integer "code"). Each snapshot
+    appends (t, code, lots) records to "<YYYY-MM>.bin" and its time to
+    "<YYYY-MM>.times".
+
+    With "delta=True" only the carparks whose lots changed since the previous
+    snapshot are appended, and the first snapshot of a month is stored in
+    full, so every month file can be read on its own.
+    '''
+    def __init__(self, folder_path, delta=True, data_root_path=None):
+        '''
+
+        Args:
+            folder_path (str): the folder of the store.
+            delta (bool, optional): store the changed lots only. Defaults to True.
+            data_root_path (str, optional): the root folder of the snapshot
+                paths passed to "save", e.g. "ROOT_PATH". Defaults to None.
+
+        Returns:
+            None.
+
+        '''
+        self.folder_path = folder_path
+        self.delta = delta
+        self.data_root_path = data_root_path
+
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.static_path = os.path.join(folder_path, 'carpark_static.csv')
+        self.static = self._load_static()
+        self.code_map = dict(zip(self.static['id'], self.static['code']))
+
+        # the lots of the last stored snapshot, by code
+        self.month = None
+        self.last_lots = np.full(0, MISSING_LOTS, dtype='i2')
+
+        self.lock = threading.Lock()
+        return None
+    # ----------------------------------------------------------------------
+    def _load_static(self):
+
+        if os.path.exists(self.static_path):
+            return pd.read_csv(self.static_path, dtype=str, keep_default_na=False).astype({'code': int})
+        return pd.DataFrame(columns=STATIC_COLS)
+    # ----------------------------------------------------------------------
+    def _month_paths(self, month):
+
+        return (os.path.join(self.folder_path, '{0}.bin'.format(month)),
+                os.path.join(self.folder_path, '{0}.times'.format(month)))
+    # ----------------------------------------------------------------------
+    def _encode(self, data):
+        '''
+        the codes of the carparks in "data", new carparks are added to
+        the static table
+
+        Args:
+            data (pandas.DataFrame): a snapshot with the "id" column.
+
+        Returns:
+            codes (numpy.ndarray): int32.
+
+        '''
+        new = data[~data['id'].isin(self.code_map.keys())]
+
+        if new.shape[0] > 0:
+            new = new.copy()
+            new['lat'] = new['Location'].str.split(' ').str.get(0)
+            new['lng'] = new['Location'].str.split(' ').str.get(1)
+            new['code'] = np.arange(len(self.code_map), len(self.code_map) + new.shape[0])
+            new = new.reindex(columns=STATIC_COLS)
+
+            new.to_csv(self.static_path, index=False, mode='a',
+                       header=not os.path.exists(self.static_path))
+
+            self.static = pd.concat([self.static, new], ignore_index=True, axis=0)
+            self.code_map.update(zip(new['id'], new['code']))
+
+        return data['id'].map(self.code_map).to_numpy(dtype='i4')
+    # ----------------------------------------------------------------------
+    def _read_month(self, month):
+        '''
+        the records and the snapshot times of one month (memory-mapped)
+        '''
+        bin_path, times_path = self._month_paths(month)
+
+        if not os.path.exists(bin_path) or os.path.getsize(bin_path) == 0:
+            records = np.zeros(0, dtype=RECORD_DTYPE)
+        else:
+            records = np.memmap(bin_path, dtype=RECORD_DTYPE, mode='r')
+
+        if not os.path.exists(times_path) or os.path.getsize(times_path) == 0:
+            times = np.zeros(0, dtype='<u4')
+        else:
+            times = np.memmap(times_path, dtype='<u4', mode='r')
+
+        return records, times
+    # ----------------------------------------------------------------------
+    def _restore_month(self, month):
+        '''
+        rebuild the lots of the last stored snapshot after a restart
+        '''
+        self.month = month
+        self.last_lots = np.full(len(self.code_map), MISSING_LOTS, dtype='i2')
+
+        records, _ = self._read_month(month)
+        # the later records overwrite the earlier ones
+        self.last_lots[records['code']] = records['lots']
+        return None
+    # ----------------------------------------------------------------------
+    def append(self, data, dt):
+        '''
+        append one snapshot of "CarParkAvailabilityv2"
+
+        Args:
+            data (pandas.DataFrame): the raw snapshot.
+            dt (datetime.datetime): the snapshot time.
+
+        Returns:
+            n (int): the number of appended records.
+
+        '''
+        data = data.copy()
+        data['id'] = data['CarParkID'].astype(str).str.cat(data['LotType'].astype(str), sep='_')
+        data.drop_duplicates(subset='id', inplace=True)
+
+        lots = pd.to_numeric(data['AvailableLots'], errors='coerce')
+        data = data[lots.notna()]
+        lots = lots[lots.notna()].to_numpy(dtype='f8')
+
+        out_of_range = (lots < LOTS_MIN) | (lots > LOTS_MAX)
+        if out_of_range.any():
+            logger.warning('%s lots out of [%s, %s] clipped, e.g. %s',
+                           out_of_range.sum(), LOTS_MIN, LOTS_MAX, lots[out_of_range][:5].tolist())
+        lots = np.clip(lots, LOTS_MIN, LOTS_MAX).astype('i2')
+
+        month = dt.strftime('%Y-%m')
+
+        with self.lock:
+            codes = self._encode(data)
+
+            if month != self.month:
+                self._restore_month(month)
+
+            last_lots = np.full(len(self.code_map), MISSING_LOTS, dtype='i2')
+            last_lots[:self.last_lots.shape[0]] = self.last_lots
+
+            cur_lots = np.full(len(self.code_map), MISSING_LOTS, dtype='i2')
+            cur_lots[codes] = lots
+
+            if self.delta:
+                # the changed lots, including the carparks which left the feed
+                changed = np.flatnonzero(cur_lots != last_lots)
+            else:
+                changed = np.sort(codes)
+
+            records = np.zeros(changed.shape[0], dtype=RECORD_DTYPE)
+            records['t'] = _to_seconds(dt)
+            records['code'] = changed
+            records['lots'] = cur_lots[changed]
+
+            bin_path, times_path = self._month_paths(month)
+            with open(bin_path, 'ab') as f:
+                records.tofile(f)
+            with open(times_path, 'ab') as f:
+                np.array([_to_seconds(dt)], dtype='<u4').tofile(f)
+
+            self.last_lots = cur_lots
+        return records.shape[0]
+    # ----------------------------------------------------------------------
+    def save(self, path, data):
+        '''
+        the storage backend interface of "save_data_df"
+        '''
+        _, dt = _path_to_dataset(path, self.folder_path if self.data_root_path is None else self.data_root_path)
+        self.append(data, dt)
+        return None
+    # ----------------------------------------------------------------------
+    def flush(self):
+        return None
+    # ----------------------------------------------------------------------
+    def _months(self, start, end):
+
+        month_li = sorted(f[:-len('.bin')] for f in os.listdir(self.folder_path) if f.endswith('.bin'))
+
+        if not (start is None):
+            month_li = [m for m in month_li if m >= start.strftime('%Y-%m')]
+        if not (end is None):
+            month_li = [m for m in month_li if m <= end.strftime('%Y-%m')]
+        return month_li
+    # ----------------------------------------------------------------------
+    def query(self, start=None, end=None, ids=None):
+        '''
+        the lots of every snapshot in [start, end]
+
+        Args:
+            start (datetime.datetime or str, optional): Defaults to None.
+            end (datetime.datetime or str, optional): Defaults to None.
+            ids (list, optional): the carpark ids, e.g. ['CLM_H']. Defaults to None (all).
+
+        Returns:
+            data (pandas.DataFrame): long format, columns ['id', 'lots', 'datetime'].
+
+        '''
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+
+        t0 = 0 if start is None else _to_seconds(start)
+        t1 = np.iinfo('u4').max if end is None else _to_seconds(end)
+
+        codes = None
+        if not (ids is None):
+            codes = np.array([self.code_map[i] for i in ids if i in self.code_map], dtype='i4')
+
+        data_li = []
+        for month in self._months(start, end):
+            records, times = self._read_month(month)
+
+            if not (codes is None):
+                records = records[np.isin(records['code'], codes)]
+
+            if self.delta:
+                # forward fill the changes to every snapshot of the month
+                times = np.unique(np.asarray(times, dtype='i8'))
+                data = _forward_fill(records[records['t'] <= t1], times[(times >= t0) & (times <= t1)])
+            else:
+                mask = (records['t'] >= t0) & (records['t'] <= t1)
+                data = pd.DataFrame({'t': records['t'][mask], 'code': records['code'][mask],
+                                     'lots': records['lots'][mask]})
+
+            data = data[data['lots'] != MISSING_LOTS]
+            data_li.append(data)
+
+        if len(data_li) == 0:
+            return pd.DataFrame(columns=['id', 'lots', 'datetime'])
+
+        data = pd.concat(data_li, ignore_index=True, axis=0)
+
+        id_li = self.static.sort_values(by='code')['id'].to_numpy()
+        data = pd.DataFrame({'id'      : pd.Categorical.from_codes(data['code'].to_numpy(dtype='i4'),
+                                                                   categories=id_li),
+                             'lots'    : data['lots'].to_numpy(dtype='i2'),
+                             'datetime': _to_datetime(data['t'])})
+        return data
+    # ----------------------------------------------------------------------
+    def series(self, carpark_id, start=None, end=None):
+        '''
+        the lots of one carpark
+
+        Returns:
+            data (pandas.Series): indexed by the snapshot time.
+
+        '''
+        data = self.query(start=start, end=end, ids=[carpark_id])
+        return pd.Series(data['lots'].to_numpy(), index=data['datetime'].to_numpy(), name=carpark_id)
+# ============================================================================
@@ -0,0 +1,221 @@
+
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+
+import requests
+import pandas as pd
+
+from DataMallSession import request_with_retry
+
+
+logger = logging.getLogger(__name__)
+
+# the parameter tables shipped with the repository, e.g. "V5.4_ANNEX_E.txt"
+PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Parameters')
+
+CACHE_CONFIG = {'maxsize'    : 64,                  # the entries of the in-process cache
+                'ttl_sec'    : 24 * 3600.,          # the freshness of a cached response
+                'cache_path' : os.path.join(os.getcwd(), 'data', 'http_cache'),
+                'bundled'    : True}                # read the bundled files first
+
+
+class LruTtlCache():
+    '''
+    Thread-safe in-process cache, the least recently used entries are
+    dropped beyond "maxsize", and the entries expire after "ttl_sec"
+    '''
+    def __init__(self, maxsize=64, ttl_sec=3600.):
+        self.maxsize = maxsize
+        self.ttl_sec = ttl_sec
+
+        # key -> (expire time, value)
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+    # ----------------------------------------------------------------------
+    def get(self, key):
+        '''
+        the cached value of "key", or None if missing or expired
+        '''
+        with self.lock:
+            item = self.items.get(key)
+
+            if item is None:
+                return None
+
+            if item[0] < time.monotonic():
+                del self.items[key]
+                return None
+
+            self.items.move_to_end(key)
+            return item[1]
+    # ----------------------------------------------------------------------
+    def set(self, key, value, ttl_sec=None):
+
+        ttl_sec = self.ttl_sec if ttl_sec is None else ttl_sec
+
+        with self.lock:
+            self.items[key] = (time.monotonic() + ttl_sec, value)
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return None
+    # ----------------------------------------------------------------------
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+        return None
+# ============================================================================
+
+
+_MEMORY_CACHE = LruTtlCache(maxsize=CACHE_CONFIG['maxsize'], ttl_sec=CACHE_CONFIG['ttl_sec'])
+
+
+def _disk_paths(url):
+
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return (os.path.join(CACHE_CONFIG['cache_path'], '{0}.body'.format(key)),
+            os.path.join(CACHE_CONFIG['cache_path'], '{0}.json'.format(key)))
+# ----------------------------------------------------------------------------
+def _read_disk(url):
+    '''
+    the cached response of "url": (text, meta) or (None, None)
+    '''
+    body_path, meta_path = _disk_paths(url)
+
+    if not (os.path.exists(body_path) and os.path.exists(meta_path)):
+        return None, None
+
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    with open(body_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return text, meta
+# ----------------------------------------------------------------------------
+def _write_disk(url, text, meta):
+
+    body_path, meta_path = _disk_paths(url)
+
+    if not os.path.exists(CACHE_CONFIG['cache_path']):
+        os.makedirs(CACHE_CONFIG['cache_path'])
+
+    # write then replace, a reader never sees a half-written entry
+    if not (text is None):
+        with open(body_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(body_path + '.tmp', body_path)
+
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return None
+# ----------------------------------------------------------------------------
+def _fetch_disk_cached(url, ttl_sec):
+    '''
+    the response of "url" from the disk cache, revalidated by "ETag" /
+    "Last-Modified" once stale, the stale copy is used if the request fails
+    '''
+    text, meta = _read_disk(url)
+
+    if not (text is None) and time.time() - meta['fetched'] < ttl_sec:
+        return text
+
+    headers = {}
+    if not (text is None):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        req = request_with_retry('GET', url, headers=headers)
+    except requests.RequestException as e:
+        if text is None:
+            raise
+        logger.warning('Use the stale cache of %s: %r', url, e)
+        return text
+
+    if req.status_code == requests.codes.not_modified and not (text is None):
+        meta['fetched'] = time.time()
+        _write_disk(url, None, meta)
+        return text
+
+    if req.status_code != requests.codes.ok:
+        if text is None:
+            raise IOError('Request failed ({0}): {1}'.format(req.status_code, url))
+        logger.warning('Use the stale cache of %s: status %s', url, req.status_code)
+        return text
+
+    req.encoding = req.encoding or 'utf-8'
+    text = req.text
+    _write_disk(url, text, {'url'           : url,
+                            'etag'          : req.headers.get('ETag'),
+                            'last_modified' : req.headers.get('Last-Modified'),
+                            'fetched'       : time.time()})
+    return text
+# ----------------------------------------------------------------------------
+def fetch_text(url, ttl_sec=None):
+    '''
+    the text of a static file (e.g. a parameter table), from the layers:
+        1. the in-process LRU cache, with TTL
+        2. the bundled file of "PARAMS_PATH" with the same file name
+        3. the on-disk cache keyed by "url", revalidated once stale
+        4. the network
+
+    Args:
+        url (str): DESCRIPTION.
+        ttl_sec (float, optional): Defaults to None, CACHE_CONFIG['ttl_sec'].
+
+    Returns:
+        text (str): DESCRIPTION.
+
+    '''
+    ttl_sec = CACHE_CONFIG['ttl_sec'] if ttl_sec is None else ttl_sec
+
+    text = _MEMORY_CACHE.get(url)
+    if not (text is None):
+        return text
+
+    local_path = os.path.join(PARAMS_PATH, os.path.basename(url))
+
+    if CACHE_CONFIG['bundled'] and os.path.exists(local_path):
+        with open(local_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = _fetch_disk_cached(url, ttl_sec)
+
+    _MEMORY_CACHE.set(url, text, ttl_sec=ttl_sec)
+    return text
+# ----------------------------------------------------------------------------
+def read_params_csv(url, **kwargs):
+    '''
+    "pandas.read_csv" of a parameter table, see "fetch_text"
+
+    Args:
+        url (str): DESCRIPTION.
+        **kwargs: the arguments of "pandas.read_csv".
+
+    Returns:
+        params_df (pandas.DataFrame): DESCRIPTION.
+
+    '''
+    return pd.read_csv(io.StringIO(fetch_text(url)), **kwargs)
+# ----------------------------------------------------------------------------
+def clear_cache(disk=False):
+    '''
+    clear the in-process cache, and the on-disk cache if "disk"
+    '''
+    _MEMORY_CACHE.clear()
+
+    if disk and os.path.exists(CACHE_CONFIG['cache_path']):
+        for fn in os.listdir(CACHE_CONFIG['cache_path']):
+            os.remove(os.path.join(CACHE_CONFIG['cache_path'], fn))
+    return None
+# ============================================================================
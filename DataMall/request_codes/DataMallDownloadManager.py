@@ -0,0 +1,334 @@
+
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import zipfile
+import datetime
+import logging
+import threading
+
+import requests
+
+from DataMallSession import get_session, request_with_retry
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadManager():
+    '''
+    Resumable, checkpointed downloads of the monthly DataMall datasets
+
+    A local manifest (json) keeps one entry per "dataset/month/ID" artifact:
+        status        : 'complete', 'partial' or 'failed'
+        path          : the local file
+        bytes         : the file size
+        sha256        : the file checksum
+        etag          : the ETag of the download, if any
+        last_modified : the Last-Modified of the download, if any
+        attempts      : the number of attempts
+        error         : the last error message
+        updated       : the time of the last update
+
+    Complete artifacts are skipped, partial downloads are resumed with a
+    "Range" request, and failures are retried with exponential backoff.
+    '''
+    def __init__(self, manifest_path, max_retries=5, backoff_sec=2., max_backoff_sec=120.):
+        '''
+
+        Args:
+            manifest_path (str): the path of the manifest (.json).
+            max_retries (int, optional): the number of retries. Defaults to 5.
+            backoff_sec (float, optional): the delay of the first retry. Defaults to 2.
+            max_backoff_sec (float, optional): the maximum delay. Defaults to 120.
+
+        Returns:
+            None.
+
+        '''
+        self.manifest_path = manifest_path
+        self.max_retries = max_retries
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+
+        self.lock = threading.RLock()
+        self.manifest = self._load_manifest()
+        return None
+    # ----------------------------------------------------------------------
+    def _load_manifest(self):
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        return {}
+    # ----------------------------------------------------------------------
+    def _save_manifest(self):
+
+        folder_path = os.path.dirname(self.manifest_path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        # write then replace, the manifest is never left half-written
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        return None
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def key(dataset, month, id_):
+        return '{0}/{1}/{2}'.format(dataset, month, id_)
+    # ----------------------------------------------------------------------
+    def get(self, dataset, month, id_):
+        '''
+        the manifest entry of an artifact, or None
+        '''
+        with self.lock:
+            entry = self.manifest.get(self.key(dataset, month, id_))
+            return None if entry is None else dict(entry)
+    # ----------------------------------------------------------------------
+    def update(self, dataset, month, id_, **kwargs):
+        '''
+        update (and save) the manifest entry of an artifact
+        '''
+        with self.lock:
+            entry = self.manifest.setdefault(self.key(dataset, month, id_),
+                                             {'status': 'partial', 'attempts': 0})
+            entry.update(kwargs)
+            entry['updated'] = datetime.datetime.now().isoformat(timespec='seconds')
+            self._save_manifest()
+            return dict(entry)
+    # ----------------------------------------------------------------------
+    def previous(self, dataset, month, id_):
+        '''
+        the manifest entry of the latest complete artifact of "dataset/id_"
+        before "month", or None
+        '''
+        with self.lock:
+            months = [k.split('/')[1] for k, entry in self.manifest.items()
+                      if k.split('/')[0] == dataset and k.split('/', 2)[2] == id_ and
+                         k.split('/')[1] < month and entry['status'] == 'complete']
+
+            if len(months) == 0:
+                return None
+            return dict(self.manifest[self.key(dataset, max(months), id_)])
+    # ----------------------------------------------------------------------
+    def entries(self, dataset, month):
+        '''
+        the manifest entries of "dataset/month", {id_: entry}
+        '''
+        prefix = '{0}/{1}/'.format(dataset, month)
+        with self.lock:
+            return {k[len(prefix):]: dict(entry) for k, entry in self.manifest.items()
+                    if k.startswith(prefix)}
+    # ----------------------------------------------------------------------
+    def is_complete(self, dataset, month, id_):
+        '''
+        whether the artifact is complete, and its file still exists unchanged
+        '''
+        entry = self.get(dataset, month, id_)
+
+        if (entry is None) or (entry['status'] != 'complete'):
+            return False
+
+        path = entry.get('path')
+        if (path is None) or not os.path.exists(path):
+            return False
+
+        return os.path.getsize(path) == entry.get('bytes')
+    # ----------------------------------------------------------------------
+    def _backoff(self, attempt):
+
+        delay = min(self.max_backoff_sec, self.backoff_sec * 2 ** attempt)
+        # full jitter
+        time.sleep(delay * random.uniform(0.5, 1.))
+        return None
+    # ----------------------------------------------------------------------
+    def run(self, dataset, month, id_, func):
+        '''
+        run "func" for an artifact unless it is already complete, retrying
+        failures with exponential backoff
+
+        Args:
+            dataset (str): DESCRIPTION.
+            month (str): DESCRIPTION.
+            id_ (str): DESCRIPTION.
+            func (callable): func() -> path (str) of the finished artifact,
+                or a dict of manifest fields including "path". It raises an
+                exception if the attempt fails.
+
+        Returns:
+            entry (dict): the manifest entry.
+
+        '''
+        if self.is_complete(dataset, month, id_):
+            logger.info('Skip (complete): %s', self.key(dataset, month, id_))
+            return self.get(dataset, month, id_)
+
+        for attempt in range(self.max_retries + 1):
+
+            attempts = (self.get(dataset, month, id_) or {}).get('attempts', 0) + 1
+            self.update(dataset, month, id_, status='partial', attempts=attempts)
+
+            try:
+                result = func()
+            except Exception as e:
+                logger.warning('Attempt %s failed: %s, %r', attempts,
+                               self.key(dataset, month, id_), e)
+                self.update(dataset, month, id_, status='failed', error=repr(e))
+
+                if attempt < self.max_retries:
+                    self._backoff(attempt)
+                continue
+
+            if isinstance(result, str):
+                result = {'path': result}
+
+            path = result['path']
+            fields = {'bytes' : os.path.getsize(path),
+                      'sha256': result['sha256'] if 'sha256' in result else file_sha256(path)}
+            fields.update(result)
+
+            return self.update(dataset, month, id_, status='complete', error=None, **fields)
+
+        logger.error('Error: %s', self.key(dataset, month, id_))
+        return self.get(dataset, month, id_)
+    # ----------------------------------------------------------------------
+    def download_file(self, link, path, session=None, chunk_size=1024*1024, etag=None):
+        '''
+        download "link" to "path", resuming from "path.part" left by an
+        interrupted attempt, if the remote file still has the ETag (or
+        Last-Modified) of the partial file ("If-Range")
+
+        Args:
+            link (str): the download link.
+            path (str): the destination file.
+            session (requests.Session, optional): Defaults to the shared session.
+            chunk_size (int, optional): DESCRIPTION.
+            etag (str, optional): the ETag of a previous download, nothing
+                is downloaded if the content is unchanged. Defaults to None.
+
+        Returns:
+            info (dict): path, bytes, etag, last_modified. Or 
+                {'not_modified': True} if the content has the ETag "etag".
+
+        '''
+        session = get_session() if session is None else session
+
+        folder_path = os.path.dirname(path)
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        part_path = path + '.part'
+        # the validator (ETag or Last-Modified) of the content of "part_path"
+        validator_path = part_path + '.validator'
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+
+        if offset > 0 and os.path.exists(validator_path):
+            with open(validator_path, 'r') as f:
+                validator = f.read().strip() or None
+
+        if offset > 0 and validator is None:
+            # the partial file cannot be matched with the remote file, restart
+            os.remove(part_path)
+            offset = 0
+
+        headers = {}
+        if offset > 0:
+            # a changed remote file is sent whole (200), not appended
+            headers = {'Range': 'bytes={0}-'.format(offset), 'If-Range': validator}
+
+        if offset == 0 and not (etag is None):
+            headers['If-None-Match'] = etag
+
+        with request_with_retry('GET', link, session=session, headers=headers, stream=True) as req:
+
+            if req.status_code == requests.codes.not_modified:
+                return {'not_modified': True}
+
+            if req.status_code == 416:
+                # the partial file is already complete
+                mode = None
+            elif req.status_code == requests.codes.partial_content:
+                mode = 'ab'
+            elif req.status_code == requests.codes.ok:
+                # the server ignores the "Range", restart
+                mode = 'wb'
+            else:
+                raise IOError('Download failed ({0}): {1}'.format(req.status_code, link))
+
+            info = {'etag'         : req.headers.get('ETag'),
+                    'last_modified': req.headers.get('Last-Modified')}
+
+            if mode == 'wb':
+                # a strong ETag, else the date, for the "If-Range" of a resume
+                new_validator = info['etag'] if not (info['etag'] is None) and \
+                                not info['etag'].startswith('W/') else info['last_modified']
+
+                if new_validator is None:
+                    if os.path.exists(validator_path):
+                        os.remove(validator_path)
+                else:
+                    with open(validator_path, 'w') as f:
+                        f.write(new_validator)
+
+            if not (mode is None):
+                with open(part_path, mode) as f:
+                    for chunk in req.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+
+        os.replace(part_path, path)
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+
+        info.update({'path': path, 'bytes': os.path.getsize(path)})
+        return info
+# ==========================================================================
+
+
+
+
+def file_sha256(path, chunk_size=1024*1024):
+    '''
+    the sha256 checksum of a file
+    '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+# ----------------------------------------------------------------------------
+def verify_zip(path):
+    '''
+    check the CRC of every member of the zip file "path", raise an
+    IOError if the file is not a zip file or a member is corrupted
+    '''
+    try:
+        with zipfile.ZipFile(path) as zf:
+            bad_name = zf.testzip()
+    except zipfile.BadZipFile as e:
+        raise IOError('Bad zip file: {0}, {1}'.format(path, e))
+
+    if not (bad_name is None):
+        raise IOError('Bad CRC: {0} in {1}'.format(bad_name, path))
+    return None
+# ----------------------------------------------------------------------------
+def link_or_copy(src_path, dst_path):
+    '''
+    hard link "src_path" to "dst_path" (a copy if the link fails, e.g.
+    across file systems)
+    '''
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copy2(src_path, dst_path)
+    return None
+# ==========================================================================
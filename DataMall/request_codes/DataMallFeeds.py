@@ -0,0 +1,272 @@
+
+import os
+import time
+import logging
+import datetime
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from RequestDataMallAPI import (ReqDataMallAPI, save_data_df, _concat_chunks,
+                                HEADERS, ROOT_PATH, PAGE_WORKERS, PAGE_RATE_LIMIT)
+from DataMallStorage import FEED_SCHEMAS, apply_schema
+from DataMallMetrics import METRICS, record_collector, collector_error
+
+
+logger = logging.getLogger(__name__)
+
+# the requests of a fan-out (e.g. one per train line) sent concurrently,
+# they are also paced by the rate limiter of the host
+FAN_OUT_WORKERS = 16
+
+
+# the realtime DataMall feeds, one entry per endpoint
+#   url          : the endpoint
+#   folder_name  : the dataset
+#   paging       : how the records are requested, see "FETCHERS"
+#   page_workers : the pages requested concurrently ('pages' only)
+#   fan_out      : (optional) a parameter requested for each of its values,
+#                  see "FAN_OUT_VALUES", e.g. 'TrainLine'
+#   partition    : the sub-folder of a snapshot, by its time
+#   schema       : (optional) the column types, see "DataMallStorage.FEED_SCHEMAS"
+#   interval_sec : the refresh interval of the feed
+FEEDS = {
+    'taxi_avail'              : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/Taxi-Availability',
+                                 'folder_name'  : '2_9_TAXI_AVAILABILITYS',
+                                 'paging'       : 'pages',
+                                 'page_workers' : PAGE_WORKERS,
+                                 'partition'    : '%Y-%m-%d',
+                                 'schema'       : FEED_SCHEMAS['2_9_TAXI_AVAILABILITYS'],
+                                 'interval_sec' : 60},
+    'carpark_avail'           : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/CarParkAvailabilityv2',
+                                 'folder_name'  : '2_12_CARPARK_AVAILABILITY',
+                                 'paging'       : 'pages',
+                                 'page_workers' : PAGE_WORKERS,
+                                 'partition'    : '%Y-%m-%d',
+                                 'schema'       : FEED_SCHEMAS['2_12_CARPARK_AVAILABILITY'],
+                                 'interval_sec' : 60},
+    'traffic_incident'        : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/TrafficIncidents',
+                                 'folder_name'  : '2_19_TRAFFIC_INCIDENTS',
+                                 'paging'       : 'pages',
+                                 'page_workers' : 1,
+                                 'partition'    : '%Y-%m-%d',
+                                 'interval_sec' : 2 * 60},
+    'vms'                     : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/VMS',
+                                 'folder_name'  : '2_21_VMS_EMAS',
+                                 'paging'       : 'pages',
+                                 'page_workers' : 1,
+                                 'partition'    : '%Y-%m-%d',
+                                 'interval_sec' : 2 * 60},
+    'travel_time'             : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/EstTravelTimes',
+                                 'folder_name'  : '2_14_TRAVEL_TIMES',
+                                 'paging'       : 'pages',
+                                 'page_workers' : 2,
+                                 'partition'    : '%Y-%m-%d',
+                                 'schema'       : FEED_SCHEMAS['2_14_TRAVEL_TIMES'],
+                                 'interval_sec' : 5 * 60},
+    'traffic_speed'           : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/TrafficSpeedBandsv2',
+                                 'folder_name'  : '2_20_TRAFFIC_SPEED',
+                                 'paging'       : 'pages',
+                                 'page_workers' : PAGE_WORKERS,
+                                 'partition'    : '%Y-%m-%d',
+                                 'schema'       : FEED_SCHEMAS['2_20_TRAFFIC_SPEED'],
+                                 'interval_sec' : 5 * 60},
+    'platform_crowd_realtime' : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/PCDRealTime',
+                                 'folder_name'  : '2_25_PLATFORM_CROWD_REAL_TIME',
+                                 'paging'       : 'single',
+                                 'fan_out'      : 'TrainLine',
+                                 'partition'    : '%Y-%m-%d',
+                                 'interval_sec' : 10 * 60},
+    'road_openings'           : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/RoadOpenings',
+                                 'folder_name'  : '2_16_ROAD_OPENINGS',
+                                 'paging'       : 'pages',
+                                 'page_workers' : 1,
+                                 'partition'    : '%Y-%m',
+                                 'interval_sec' : 24 * 3600},
+    'road_works'              : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/RoadWorks',
+                                 'folder_name'  : '2_17_ROAD_WORKS',
+                                 'paging'       : 'pages',
+                                 'page_workers' : 1,
+                                 'partition'    : '%Y-%m',
+                                 'interval_sec' : 24 * 3600},
+    'platform_crowd_forecast' : {'url'          : 'http://datamall2.mytransport.sg/ltaodataservice/PCDForecast',
+                                 'folder_name'  : '2_26_PLATFORM_CROWD_FORECAST',
+                                 'paging'       : 'forecast',
+                                 'fan_out'      : 'TrainLine',
+                                 'partition'    : '%Y-%m',
+                                 'interval_sec' : 24 * 3600},
+    }
+
+
+def _fetch_pages(rdm):
+    return rdm.req_pages_data()
+
+
+def _fetch_single(rdm):
+    return rdm.req_platform_crowd_realtime()
+
+
+def _fetch_forecast(rdm):
+    data_df, _ = rdm.req_platform_crowd_forecast()
+    return data_df
+
+
+# paging style -> fetcher(ReqDataMallAPI) -> pandas.DataFrame or None
+FETCHERS = {'pages'    : _fetch_pages,      # "$skip" pages of 500 records
+            'single'   : _fetch_single,     # one request, all the records
+            'forecast' : _fetch_forecast}   # one request, nested by station
+
+
+def _train_line_codes():
+    params_df = ReqDataMallAPI(url=None, headers=None)._req_train_line_params()
+    return params_df['Train Line Code'].tolist()
+
+
+# fan-out parameter -> the function listing its values
+FAN_OUT_VALUES = {'TrainLine': _train_line_codes}
+# ============================================================================
+
+
+
+
+def feed_save_path(name, dt):
+    '''
+    the snapshot path of the feed "name" at the time "dt", e.g.
+        <ROOT_PATH>/2_21_VMS_EMAS/2022-06-01/2022-06-01-00-49-27.csv
+    '''
+    feed = FEEDS[name]
+    file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
+    return os.path.join(ROOT_PATH, feed['folder_name'], dt.strftime(feed['partition']), file_name)
+# ----------------------------------------------------------------------------
+def _fetch_params(feed, params):
+    '''
+    request the records of "feed" with the parameters "params"
+    '''
+    rdm = ReqDataMallAPI(feed['url'], headers=HEADERS, params=params,
+                         max_workers=feed.get('page_workers', 1), rate_limit=PAGE_RATE_LIMIT)
+    return FETCHERS[feed['paging']](rdm)
+# ----------------------------------------------------------------------------
+def fetch_feed(name):
+    '''
+    request all the records of the feed "name"
+
+    The requests of a fan-out (e.g. one per train line) are sent
+    concurrently, up to "FAN_OUT_WORKERS". A failed value is logged and
+    counted, and the records of the other values are still returned.
+
+    Returns:
+        data_df (pandas.DataFrame) or None: None if no record is received.
+
+    '''
+    feed = FEEDS[name]
+
+    if feed.get('fan_out') is None:
+        return _fetch_params(feed, {})
+
+    key = feed['fan_out']
+    values = FAN_OUT_VALUES[key]()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FAN_OUT_WORKERS, len(values)))) as executor:
+        futures = [(v, executor.submit(_fetch_params, feed, {key: v})) for v in values]
+
+    # in the order of the values
+    data_all_df = []
+    for v, future in futures:
+        try:
+            data_df = future.result()
+        except Exception:
+            METRICS.inc('datamall_fan_out_errors_total', feed=feed['folder_name'], param=v)
+            logger.warning('Failed: %s, %s=%s', feed['folder_name'], key, v, exc_info=True)
+            continue
+
+        if not (data_df is None):
+            data_all_df.append(data_df)
+
+    if len(data_all_df) == 0:
+        return None
+    return _concat_chunks(data_all_df)
+# ----------------------------------------------------------------------------
+def run_feed(name, dt=None):
+    '''
+    request and save one snapshot of the feed "name", the failures are
+    logged and counted, see "DataMallMetrics.collector_error"
+
+    Args:
+        name (str): the feed, see "FEEDS".
+        dt (datetime.datetime, optional): the snapshot time. Defaults to None, now.
+
+    Returns:
+        None.
+
+    '''
+    feed = FEEDS[name]
+    dt = datetime.datetime.now() if dt is None else dt
+
+    t0 = time.perf_counter()
+    try:
+        data_df = fetch_feed(name)
+
+        if data_df is None:
+            raise IOError('No data: {0}'.format(feed['url']))
+
+        if not (feed.get('schema') is None):
+            data_df = apply_schema(data_df, feed['schema'])
+
+        save_data_df(feed_save_path(name, dt), data_df)
+    except Exception:
+        collector_error(feed['folder_name'])
+    finally:
+        record_collector(name, time.perf_counter() - t0, budget_sec=feed['interval_sec'])
+    return None
+# ----------------------------------------------------------------------------
+def run_feeds(names, max_workers=None):
+    '''
+    one fetch cycle: request and save the feeds "names" concurrently,
+    with the same snapshot time
+
+    Args:
+        names (list): the feeds, see "FEEDS".
+        max_workers (int, optional): Defaults to None, one thread per feed.
+
+    Returns:
+        None.
+
+    '''
+    dt = datetime.datetime.now()
+
+    if len(names) == 1:
+        return run_feed(names[0], dt=dt)
+
+    with ThreadPoolExecutor(max_workers=len(names) if max_workers is None else max_workers) as executor:
+        list(executor.map(functools.partial(run_feed, dt=dt), names))
+    return None
+# ============================================================================
+
+
+
+
+def cycle_collectors(names=None):
+    '''
+    the table of "DataMallRunner.CollectorRunner", the feeds with the same
+    interval are batched into one job, see "run_feeds"
+
+    Args:
+        names (list, optional): the feeds. Defaults to None, all the feeds.
+
+    Returns:
+        table (list): DESCRIPTION.
+
+    '''
+    names = list(FEEDS.keys()) if names is None else names
+
+    # interval -> feeds, in the order of "names"
+    cycles = {}
+    for name in names:
+        cycles.setdefault(FEEDS[name]['interval_sec'], []).append(name)
+
+    return [{'name'         : 'cycle_{0}s'.format(interval_sec),
+             'func'         : functools.partial(run_feeds, cycle),
+             'url'          : [FEEDS[name]['url'] for name in cycle],
+             'folder_name'  : [FEEDS[name]['folder_name'] for name in cycle],
+             'interval_sec' : interval_sec} for interval_sec, cycle in cycles.items()]
+# ============================================================================
@@ -0,0 +1,266 @@
+
+import os
+import json
+import time
+import bisect
+import logging
+import datetime
+import threading
+
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# the upper bounds (seconds) of the duration histograms
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., 120., 300.)
+
+# the metrics recorded by the DataMall client and the collectors
+#   name -> (type, help)
+METRICS_HELP = {
+    'datamall_request_seconds'         : ('histogram', 'The latency of the HTTP requests.'),
+    'datamall_requests_total'          : ('counter',   'The HTTP requests, by status code.'),
+    'datamall_response_bytes_total'    : ('counter',   'The bytes of the HTTP responses.'),
+    'datamall_retries_total'           : ('counter',   'The retried HTTP requests, by reason.'),
+    'datamall_pages_total'             : ('counter',   'The pages requested.'),
+    'datamall_rows_total'              : ('counter',   'The records received.'),
+    'datamall_parse_seconds'           : ('histogram', 'The time to parse the responses.'),
+    'datamall_write_seconds'           : ('histogram', 'The time to write a snapshot.'),
+    'datamall_written_rows_total'      : ('counter',   'The records written.'),
+    'datamall_collector_seconds'       : ('histogram', 'The duration of the collector jobs.'),
+    'datamall_collector_overruns_total': ('counter',   'The collector runs longer than their interval.'),
+    'datamall_collector_errors_total'  : ('counter',   'The failed collections, by feed.'),
+    'datamall_collector_skipped_total' : ('counter',   'The skipped collector runs, by reason.'),
+    'datamall_fan_out_errors_total'    : ('counter',   'The failed requests of a fan-out, by value.'),
+    'datamall_delta_duplicate_keys_total' : ('counter', 'The records of a delta log with a duplicate key, dropped.'),
+    'datamall_delta_schema_changes_total' : ('counter', 'The column changes of a delta log, a new log is started.'),
+    }
+
+
+class Histogram():
+    '''
+    cumulative histogram of the observed values
+    '''
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # the last one is +Inf
+        self.sum = 0.
+        self.count = 0
+    # ----------------------------------------------------------------------
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+        return None
+    # ----------------------------------------------------------------------
+    def cumulative(self):
+        '''
+        [(upper bound, cumulative count), ...] including '+Inf'
+        '''
+        result, n = [], 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            n = n + count
+            result.append((bound, n))
+        return result
+# ============================================================================
+
+
+class MetricsRegistry():
+    '''
+    Thread-safe counters and histograms, identified by a name and labels,
+    e.g. METRICS.inc('datamall_pages_total', endpoint='BusStops')
+    '''
+    def __init__(self):
+        # (name, labels) -> float or Histogram, labels: sorted tuple of (key, value)
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        return None
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+    # ----------------------------------------------------------------------
+    def inc(self, name, value=1, **labels):
+        '''
+        increase the counter "name" by "value"
+        '''
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        return None
+    # ----------------------------------------------------------------------
+    def observe(self, name, value, **labels):
+        '''
+        add "value" to the histogram "name"
+        '''
+        key = self._key(name, labels)
+        with self.lock:
+            if not (key in self.histograms):
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+        return None
+    # ----------------------------------------------------------------------
+    @contextmanager
+    def timer(self, name, **labels):
+        '''
+        observe the duration of the "with" block, also if it raises
+        '''
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+    # ----------------------------------------------------------------------
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+        return None
+    # ----------------------------------------------------------------------
+    def snapshot(self):
+        '''
+        the current values
+
+        Returns:
+            records (list): [{'name', 'labels', 'value'} for the counters,
+                {'name', 'labels', 'count', 'sum', 'buckets'} for the histograms]
+
+        '''
+        with self.lock:
+            records = [{'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in sorted(self.counters.items())]
+
+            records.extend({'name'   : name,
+                            'labels' : dict(labels),
+                            'count'  : hist.count,
+                            'sum'    : hist.sum,
+                            'buckets': [[str(b), n] for b, n in hist.cumulative()]}
+                           for (name, labels), hist in sorted(self.histograms.items(),
+                                                              key=lambda x: x[0]))
+        return records
+    # ----------------------------------------------------------------------
+    def to_prometheus(self):
+        '''
+        the metrics in the Prometheus text format
+        '''
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if len(items) == 0:
+                return ''
+            return '{' + ','.join('{0}="{1}"'.format(k, v.replace('"', '\\"')) for k, v in items) + '}'
+
+        with self.lock:
+            names = sorted(set(n for n, _ in self.counters.keys()) |
+                           set(n for n, _ in self.histograms.keys()))
+
+            lines = []
+            for name in names:
+                type_, help_ = METRICS_HELP.get(name, ('untyped', ''))
+                lines.append('# HELP {0} {1}'.format(name, help_))
+                lines.append('# TYPE {0} {1}'.format(name, type_))
+
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append('{0}{1} {2}'.format(name, fmt_labels(labels), value))
+
+                for (n, labels), hist in sorted(self.histograms.items(), key=lambda x: x[0]):
+                    if n != name:
+                        continue
+                    for bound, count in hist.cumulative():
+                        lines.append('{0}_bucket{1} {2}'.format(
+                            name, fmt_labels(labels, [('le', str(bound))]), count))
+                    lines.append('{0}_sum{1} {2}'.format(name, fmt_labels(labels), hist.sum))
+                    lines.append('{0}_count{1} {2}'.format(name, fmt_labels(labels), hist.count))
+
+        return '\n'.join(lines) + '\n'
+# ============================================================================
+
+
+# the process-wide registry
+METRICS = MetricsRegistry()
+
+
+def write_prometheus(path, registry=METRICS):
+    '''
+    write the metrics to a Prometheus text file, e.g. for the textfile
+    collector of the node exporter
+    '''
+    folder_path = os.path.dirname(path)
+    if folder_path and not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    # write then replace, a scraper never reads a half-written file
+    with open(path + '.tmp', 'w') as f:
+        f.write(registry.to_prometheus())
+    os.replace(path + '.tmp', path)
+    return None
+# ----------------------------------------------------------------------------
+def append_jsonl(path, registry=METRICS, keep_days=7):
+    '''
+    append the current metrics, as one json line with its time, to the log
+    of the day "<path stem>_YYYY-MM-DD.jsonl", the logs older than
+    "keep_days" days are deleted
+
+    Each line is the full cumulative snapshot, the daily logs keep the size
+    of the history bounded.
+    '''
+    folder_path, file_name = os.path.split(path)
+    if folder_path and not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    now = datetime.datetime.now()
+    stem, ext = os.path.splitext(file_name)
+
+    record = {'time'    : now.isoformat(timespec='seconds'),
+              'metrics' : registry.snapshot()}
+
+    with open(os.path.join(folder_path, '{0}_{1}{2}'.format(stem, now.strftime('%Y-%m-%d'), ext)), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    if not (keep_days is None):
+        oldest = (now - datetime.timedelta(days=keep_days)).strftime('%Y-%m-%d')
+        prefix = stem + '_'
+
+        for fn in os.listdir(folder_path or '.'):
+            date = fn[len(prefix):-len(ext)] if (fn.startswith(prefix) and fn.endswith(ext)) else ''
+            # only the daily logs of "path"
+            if len(date) == len('YYYY-MM-DD') and date < oldest:
+                os.remove(os.path.join(folder_path, fn))
+    return None
+# ----------------------------------------------------------------------------
+def export_metrics(prom_path=None, jsonl_path=None, registry=METRICS):
+    '''
+    export the metrics to a Prometheus text file and / or the daily json
+    lines logs of "jsonl_path", see "append_jsonl"
+    '''
+    if not (prom_path is None):
+        write_prometheus(prom_path, registry=registry)
+    if not (jsonl_path is None):
+        append_jsonl(jsonl_path, registry=registry)
+    return None
+# ============================================================================
+
+
+
+
+def record_collector(name, duration, budget_sec=None):
+    '''
+    record the duration of a collector run, and whether it is longer
+    than "budget_sec"
+    '''
+    METRICS.observe('datamall_collector_seconds', duration, collector=name)
+
+    if not (budget_sec is None) and duration > budget_sec:
+        METRICS.inc('datamall_collector_overruns_total', collector=name)
+        logger.warning('%s took %.1f s, over its %s s budget', name, duration, budget_sec)
+    return None
+# ----------------------------------------------------------------------------
+def collector_error(feed):
+    '''
+    record a failed collection of "feed" (folder name)
+    '''
+    METRICS.inc('datamall_collector_errors_total', feed=feed)
+    logger.error('Error: %s', feed, exc_info=True)
+    return None
+# ============================================================================
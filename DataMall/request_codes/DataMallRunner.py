@@ -0,0 +1,189 @@
+
+import time
+import random
+import logging
+import datetime
+
+from apscheduler.events import (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR,
+                                EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES)
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from DataMallMetrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+
+def next_aligned_time(interval_sec, offset_sec=0., now=None):
+    '''
+    the next wall-clock boundary of "interval_sec" (counted from the local
+    midnight) plus "offset_sec", e.g. the next full minute + 15 seconds
+
+    Args:
+        interval_sec (float): DESCRIPTION.
+        offset_sec (float, optional): Defaults to 0.
+        now (datetime.datetime, optional): Defaults to None, the current time.
+
+    Returns:
+        dt (datetime.datetime): DESCRIPTION.
+
+    '''
+    now = datetime.datetime.now() if now is None else now
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    elapsed = (now - midnight).total_seconds() - offset_sec
+    n = int(elapsed // interval_sec) + 1
+
+    return midnight + datetime.timedelta(seconds=n * interval_sec + offset_sec)
+# ============================================================================
+
+
+class CollectorRunner():
+    '''
+    Scheduler of the "save_*" collectors, configured by a table of
+        {'name'          : the job id, e.g. 'save_carpark_avail',
+         'func'          : the collector,
+         'url'           : the DataMall endpoint (documentation),
+         'folder_name'   : the dataset (documentation),
+         'interval_sec'  : the period of the runs,
+         'offset_sec'    : (optional) the offset from the wall-clock boundary,
+         'max_instances' : (optional) the concurrent runs, default 1}
+
+    The runs are aligned to the wall-clock boundaries of their interval
+    (e.g. every full minute), and the collectors without "offset_sec" are
+    staggered by "stagger_sec" so they do not all call the API at the same
+    second. Missed runs are coalesced into one. A run which would start
+    while "max_instances" runs of the same collector are still running is
+    skipped and logged as an overrun.
+    '''
+    def __init__(self, table, stagger_sec=5., jitter_sec=0., max_workers=None, blocking=True):
+        '''
+
+        Args:
+            table (list): the collectors, see above.
+            stagger_sec (float, optional): the offset between two collectors
+                of the table. Defaults to 5.
+            jitter_sec (float, optional): a random delay, up to "jitter_sec",
+                added to every run. Defaults to 0.
+            max_workers (int, optional): the threads running the collectors.
+                Defaults to None, the sum of the "max_instances".
+            blocking (bool, optional): whether "start" blocks. Defaults to True.
+
+        Returns:
+            None.
+
+        '''
+        self.table = list(table)
+        self.stagger_sec = stagger_sec
+        self.jitter_sec = jitter_sec
+
+        if max_workers is None:
+            max_workers = max(1, sum(info.get('max_instances', 1) for info in self.table))
+
+        scheduler_class = BlockingScheduler if blocking else BackgroundScheduler
+        self.scheduler = scheduler_class(executors={'default': ThreadPoolExecutor(max_workers)},
+                                         job_defaults={'coalesce': True})
+
+        # job id -> the table entry
+        self.jobs = {info['name']: info for info in self.table}
+
+        self.scheduler.add_listener(self._on_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR |
+                                    EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+        return None
+    # ----------------------------------------------------------------------
+    def _offset(self, ix, info):
+
+        if 'offset_sec' in info:
+            return info['offset_sec']
+        return (ix * self.stagger_sec) % info['interval_sec']
+    # ----------------------------------------------------------------------
+    def _run(self, name):
+        '''
+        run one collector, after the random jitter
+        '''
+        if self.jitter_sec > 0:
+            time.sleep(random.uniform(0., self.jitter_sec))
+
+        return self.jobs[name]['func']()
+    # ----------------------------------------------------------------------
+    def _on_event(self, event):
+
+        info = self.jobs.get(event.job_id)
+        if info is None:
+            return None
+
+        if event.code == EVENT_JOB_MAX_INSTANCES:
+            METRICS.inc('datamall_collector_skipped_total', collector=event.job_id, reason='overrun')
+            logger.warning('Overrun: %s is still running, the run of %s is skipped',
+                           event.job_id, event.scheduled_run_times)
+
+        elif event.code == EVENT_JOB_MISSED:
+            METRICS.inc('datamall_collector_skipped_total', collector=event.job_id, reason='missed')
+            logger.warning('Missed: the run of %s at %s', event.job_id, event.scheduled_run_time)
+
+        elif event.code == EVENT_JOB_ERROR:
+            logger.error('Error: %s, %r', event.job_id, event.exception)
+
+        else:
+            # the run finished after the next scheduled run
+            delay = (datetime.datetime.now(event.scheduled_run_time.tzinfo) -
+                     event.scheduled_run_time).total_seconds()
+
+            # (the duration itself is counted by "record_collector" in "DataMallFeeds.run_feed")
+            if delay > info['interval_sec']:
+                logger.warning('Overrun: %s took %.1f s, its interval is %s s',
+                               event.job_id, delay, info['interval_sec'])
+        return None
+    # ----------------------------------------------------------------------
+    def add_jobs(self):
+        '''
+        schedule the collectors of the table
+        '''
+        for ix, info in enumerate(self.table):
+            interval_sec = info['interval_sec']
+            offset_sec = self._offset(ix, info)
+
+            trigger = IntervalTrigger(seconds=interval_sec,
+                                      start_date=next_aligned_time(interval_sec, offset_sec))
+
+            self.scheduler.add_job(self._run, trigger, args=[info['name']], id=info['name'], name=info['name'],
+                                   max_instances=info.get('max_instances', 1),
+                                   misfire_grace_time=int(interval_sec))
+
+            logger.info('Schedule %s every %s s, offset %s s', info['name'], interval_sec, offset_sec)
+        return None
+    # ----------------------------------------------------------------------
+    def run_once(self):
+        '''
+        run every collector of the table once, in the order of the table
+        '''
+        for info in self.table:
+            info['func']()
+        return None
+    # ----------------------------------------------------------------------
+    def start(self, run_first=True):
+        '''
+        start the scheduler
+
+        Args:
+            run_first (bool, optional): run every collector once before.
+                Defaults to True.
+
+        Returns:
+            None.
+
+        '''
+        if run_first:
+            self.run_once()
+
+        self.add_jobs()
+        self.scheduler.start()
+        return None
+    # ----------------------------------------------------------------------
+    def shutdown(self, wait=True):
+        self.scheduler.shutdown(wait=wait)
+        return None
+# ============================================================================
@@ -0,0 +1,392 @@
+
+import time
+import random
+import logging
+import threading
+
+import requests
+
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+from DataMallMetrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+# the process-wide session shared by all DataMall requests
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+SESSION_CONFIG = {'pool_connections' : 10,     # the number of hosts kept in the pool
+                  'pool_maxsize'     : 16,     # the connections kept alive per host
+                  'pool_block'       : False,  # block when all connections of a host are busy
+                  'keep_alive'       : True}
+
+# the token bucket shared by all the requests to a host, see "get_rate_limiter"
+#   the rate is halved when the host throttles (429) and increased by
+#   "rate_step" per successful request, between "min_rate" and "max_rate"
+LIMITER_CONFIG = {'rate'      : 20.,    # the initial requests per second
+                  'burst'     : 10,     # the tokens that can be spent at once
+                  'min_rate'  : 1.,
+                  'max_rate'  : 50.,
+                  'rate_step' : 0.1}
+
+# the retries of "request_with_retry"
+RETRY_CONFIG = {'max_retries'     : 5,
+                'backoff_sec'     : 0.5,  # the delay of the first retry
+                'max_backoff_sec' : 60.,
+                'retry_status'    : (429, 500, 502, 503, 504),
+                'timeout'         : 60.}
+
+# host -> TokenBucket
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def configure_session(**kwargs):
+    '''
+    update the pool settings, the shared session is rebuilt on the next
+    "get_session()" call
+
+    Args:
+        pool_connections (int, optional): the number of host pools to cache.
+        pool_maxsize (int, optional): the maximum number of connections
+            kept alive per host.
+        pool_block (bool, optional): whether a request waits for a free
+            connection when the host pool is full.
+        keep_alive (bool, optional): whether to reuse the connections.
+
+    Returns:
+        None.
+
+    '''
+    unknown = set(kwargs.keys()).difference(SESSION_CONFIG.keys())
+    if len(unknown) > 0:
+        raise ValueError('Unknown session option(s): {0}'.format(sorted(unknown)))
+
+    SESSION_CONFIG.update(kwargs)
+    close_session()
+    return None
+# ----------------------------------------------------------------------------
+def _build_session():
+
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections = SESSION_CONFIG['pool_connections'],
+                          pool_maxsize     = SESSION_CONFIG['pool_maxsize'],
+                          pool_block       = SESSION_CONFIG['pool_block'])
+
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    if not SESSION_CONFIG['keep_alive']:
+        session.headers['Connection'] = 'close'
+
+    return session
+# ----------------------------------------------------------------------------
+def get_session():
+    '''
+    get the process-wide connection-pooled session, created on the first call
+
+    Returns:
+        session (requests.Session): DESCRIPTION.
+
+    '''
+    global _SESSION
+
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                _SESSION = _build_session()
+    return _SESSION
+# ----------------------------------------------------------------------------
+def close_session():
+    '''
+    close the shared session and all of its pooled connections
+    '''
+    global _SESSION
+
+    with _SESSION_LOCK:
+        if not (_SESSION is None):
+            _SESSION.close()
+        _SESSION = None
+    return None
+# ----------------------------------------------------------------------------
+def session_stats():
+    '''
+    connection-reuse counters of the shared session, per host
+
+    Returns:
+        stats (dict): {host: {'requests': int, 'connections': int, 'reused': int}}
+            "connections" is the number of new TCP (and TLS) connections opened,
+            "reused" is the number of requests served by a kept-alive connection.
+
+    '''
+    stats = {}
+
+    if _SESSION is None:
+        return stats
+
+    adapters = {id(a): a for a in _SESSION.adapters.values()}.values()
+
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+
+            host = '{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)
+
+            stat = stats.setdefault(host, {'requests': 0, 'connections': 0, 'reused': 0})
+            stat['requests'] = stat['requests'] + pool.num_requests
+            stat['connections'] = stat['connections'] + pool.num_connections
+            stat['reused'] = max(0, stat['requests'] - stat['connections'])
+
+    return stats
+# ============================================================================
+
+
+
+
+class TokenBucket():
+    '''
+    Thread-safe token bucket with an adaptive rate (AIMD)
+
+    "acquire()" takes one token, waiting until one is available. The bucket
+    refills at "rate" tokens per second up to "burst" tokens. "throttled()"
+    halves the rate and pauses the bucket (e.g. until the "Retry-After" of
+    a 429 response), "succeeded()" increases the rate by "rate_step".
+    '''
+    def __init__(self, rate, burst=1, min_rate=None, max_rate=None, rate_step=0.):
+        '''
+
+        Args:
+            rate (float): the requests per second.
+            burst (int, optional): the size of the bucket. Defaults to 1.
+            min_rate (float, optional): Defaults to None, "rate".
+            max_rate (float, optional): Defaults to None, "rate".
+            rate_step (float, optional): the rate increase per success.
+                Defaults to 0. (a fixed rate).
+
+        Returns:
+            None.
+
+        '''
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_rate = self.rate if min_rate is None else min_rate
+        self.max_rate = self.rate if max_rate is None else max_rate
+        self.rate_step = rate_step
+
+        self.tokens = float(burst)
+        self.last_time = time.monotonic()
+        # no token is given before this time, e.g. "Retry-After"
+        self.paused_until = 0.
+
+        self.lock = threading.Lock()
+        return None
+    # ----------------------------------------------------------------------
+    def _refill(self, now):
+
+        self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+        return None
+    # ----------------------------------------------------------------------
+    def try_acquire(self):
+        '''
+        take one token if one is available, without waiting
+
+        Returns:
+            delay (float): 0. if a token is taken, else the seconds until
+                the next token.
+
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if now >= self.paused_until and self.tokens >= 1.:
+                self.tokens = self.tokens - 1.
+                return 0.
+
+            return max(self.paused_until - now, (1. - self.tokens) / self.rate)
+    # ----------------------------------------------------------------------
+    def acquire(self):
+        '''
+        take one token, waiting if the bucket is empty or paused
+
+        Returns:
+            waited (float): the seconds waited.
+
+        '''
+        waited = 0.
+
+        while True:
+            delay = self.try_acquire()
+            if delay == 0.:
+                return waited
+
+            time.sleep(delay)
+            waited = waited + delay
+    # ----------------------------------------------------------------------
+    def throttled(self, retry_after=None):
+        '''
+        the host throttled a request: halve the rate, and pause the bucket
+        for "retry_after" seconds
+        '''
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2.)
+            self.tokens = min(self.tokens, 0.)
+
+            if not (retry_after is None):
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+        logger.warning('Throttled, rate: %.2f/s, retry after: %s', self.rate, retry_after)
+        return None
+    # ----------------------------------------------------------------------
+    def succeeded(self):
+
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.rate_step)
+        return None
+# ============================================================================
+
+
+
+
+def get_rate_limiter(url):
+    '''
+    the token bucket shared by all the requests to the host of "url"
+
+    Returns:
+        limiter (TokenBucket): DESCRIPTION.
+
+    '''
+    host = urlsplit(url).netloc
+
+    with _LIMITERS_LOCK:
+        if not (host in _LIMITERS):
+            _LIMITERS[host] = TokenBucket(**LIMITER_CONFIG)
+        return _LIMITERS[host]
+# ----------------------------------------------------------------------------
+def parse_retry_after(req):
+    '''
+    the seconds of the "Retry-After" header (seconds or HTTP date), or None
+    '''
+    value = req.headers.get('Retry-After')
+
+    if value is None:
+        return None
+
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0., parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+# ----------------------------------------------------------------------------
+def backoff_delay(attempt):
+    '''
+    the delay (seconds) before the retry "attempt", jittered exponential
+    backoff, see "RETRY_CONFIG"
+    '''
+    delay = min(RETRY_CONFIG['max_backoff_sec'], RETRY_CONFIG['backoff_sec'] * 2 ** attempt)
+    # full jitter
+    return random.uniform(0., delay)
+# ----------------------------------------------------------------------------
+def _backoff(attempt):
+
+    time.sleep(backoff_delay(attempt))
+    return None
+# ----------------------------------------------------------------------------
+def request_with_retry(method, url, session=None, limiter=None, endpoint=None, **kwargs):
+    '''
+    send a request through the shared rate limiter of its host, retrying
+    the throttled (429), server error (5xx) and timed out requests with
+    jittered exponential backoff
+
+    A 429 response halves the rate of the host, and the "Retry-After"
+    delay is honoured by all the requests to the host.
+
+    Args:
+        method (str): 'GET', ...
+        url (str): DESCRIPTION.
+        session (requests.Session, optional): Defaults to the shared session.
+        limiter (TokenBucket, optional): an additional limiter of the caller,
+            e.g. a per-job rate. Defaults to None.
+        endpoint (str, optional): the label of the request metrics.
+            Defaults to None, the path of "url".
+        **kwargs: the arguments of "requests.Session.request".
+
+    Returns:
+        req (requests.Response): the last response, whatever its status
+            code. The exception of the last attempt is raised if no
+            response is received.
+
+    '''
+    session = get_session() if session is None else session
+    host_limiter = get_rate_limiter(url)
+
+    endpoint = urlsplit(url).path if endpoint is None else endpoint
+
+    kwargs.setdefault('timeout', RETRY_CONFIG['timeout'])
+
+    max_retries = RETRY_CONFIG['max_retries']
+
+    for attempt in range(max_retries + 1):
+
+        host_limiter.acquire()
+        if not (limiter is None):
+            limiter.acquire()
+
+        t0 = time.perf_counter()
+        try:
+            req = session.request(method, url, **kwargs)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            METRICS.inc('datamall_requests_total', endpoint=endpoint, status=type(e).__name__)
+            logger.warning('Attempt %s failed: %s, %r', attempt + 1, url, e)
+
+            if attempt == max_retries:
+                raise
+            METRICS.inc('datamall_retries_total', endpoint=endpoint, reason=type(e).__name__)
+            _backoff(attempt)
+            continue
+
+        METRICS.observe('datamall_request_seconds', time.perf_counter() - t0, endpoint=endpoint)
+        METRICS.inc('datamall_requests_total', endpoint=endpoint, status=req.status_code)
+
+        # the streamed content is not read yet, its declared size is counted
+        if kwargs.get('stream', False):
+            n_bytes = int(req.headers.get('Content-Length', 0) or 0)
+        else:
+            n_bytes = len(req.content)
+        METRICS.inc('datamall_response_bytes_total', n_bytes, endpoint=endpoint)
+
+        if not (req.status_code in RETRY_CONFIG['retry_status']) or attempt == max_retries:
+            if req.status_code < 400:
+                host_limiter.succeeded()
+            return req
+
+        METRICS.inc('datamall_retries_total', endpoint=endpoint, reason=req.status_code)
+
+        if req.status_code == 429:
+            retry_after = parse_retry_after(req)
+            host_limiter.throttled(retry_after)
+
+            if retry_after is None:
+                _backoff(attempt)
+        else:
+            logger.warning('Attempt %s failed (%s): %s', attempt + 1, req.status_code, url)
+            _backoff(attempt)
+
+        req.close()
+    return req
+# ============================================================================
@@ -0,0 +1,638 @@
+
+import os
+import atexit
+import logging
+import datetime
+import threading
+
+import pandas as pd
+
+from DataMallMetrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+
+# column types of the snapshots, by folder name (dataset)
+#   the other columns keep the types inferred by pandas
+FEED_SCHEMAS = {
+    '2_9_TAXI_AVAILABILITYS'    : {'Longitude'     : 'float64',
+                                   'Latitude'      : 'float64'},
+    '2_12_CARPARK_AVAILABILITY' : {'CarParkID'     : 'category',
+                                   'Area'          : 'category',
+                                   'Development'   : 'category',
+                                   'Location'      : 'string',
+                                   'AvailableLots' : 'Int16',
+                                   'LotType'       : 'category',
+                                   'Agency'        : 'category'},
+    '2_14_TRAVEL_TIMES'         : {'Name'          : 'category',
+                                   'Direction'     : 'Int8',
+                                   'FarEndPoint'   : 'category',
+                                   'StartPoint'    : 'category',
+                                   'EndPoint'      : 'category',
+                                   'EstTime'       : 'Int16'},
+    '2_20_TRAFFIC_SPEED'        : {'LinkID'        : 'category',
+                                   'RoadName'      : 'category',
+                                   'RoadCategory'  : 'category',
+                                   'SpeedBand'     : 'Int8',
+                                   'MinimumSpeed'  : 'Int16',
+                                   'MaximumSpeed'  : 'Int16',
+                                   'Location'      : 'string'},
+    }
+
+# the natural keys of the slow-changing feeds, by folder name (dataset)
+#   keys      : the columns identifying a record
+#   partition : the period of a change log, each log starts with a full snapshot
+DELTA_KEYS = {
+    '2_14_TRAVEL_TIMES'      : {'keys'     : ['Name', 'Direction', 'FarEndPoint',
+                                              'StartPoint', 'EndPoint'],
+                                'partition': '%Y-%m-%d'},
+    '2_16_ROAD_OPENINGS'     : {'keys'     : ['EventID'],
+                                'partition': '%Y-%m'},
+    '2_17_ROAD_WORKS'        : {'keys'     : ['EventID'],
+                                'partition': '%Y-%m'},
+    # the incidents have no id, a changed message is a delete and an insert
+    '2_19_TRAFFIC_INCIDENTS' : {'keys'     : ['Type', 'Latitude', 'Longitude', 'Message'],
+                                'partition': '%Y-%m-%d'},
+    '2_21_VMS_EMAS'          : {'keys'     : ['EquipmentID'],
+                                'partition': '%Y-%m-%d'},
+    }
+
+# the column added to every snapshot
+SNAPSHOT_TIME_COL = 'snapshot_time'
+
+# the change column of the delta logs: insert, update, delete
+DELTA_OP_COL = 'op'
+
+
+def _path_to_dataset(path, root_path):
+    '''
+    split the path of a snapshot into the folder name (dataset) and the
+    snapshot time, e.g.
+        <root_path>/2_12_CARPARK_AVAILABILITY/2022-06-01/2022-06-01-00-49-27.csv
+        -> ('2_12_CARPARK_AVAILABILITY', datetime(2022, 6, 1, 0, 49, 27))
+
+    Returns:
+        dataset (str) or None: None if "path" is not under "root_path".
+        dt (datetime.datetime): DESCRIPTION.
+
+    '''
+    rel_path = os.path.relpath(os.path.abspath(path), os.path.abspath(root_path))
+
+    if rel_path.startswith(os.pardir):
+        dataset = None
+    else:
+        dataset = rel_path.split(os.sep)[0]
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    # the timestamp is at the end of the file name, e.g. 'taxi_stands_2022-06-01'
+    for fmt, n in [("%Y-%m-%d-%H-%M-%S", 19), ("%Y-%m-%d", 10)]:
+        try:
+            return dataset, datetime.datetime.strptime(stem[-n:], fmt)
+        except ValueError:
+            continue
+    return dataset, datetime.datetime.now()
+# ----------------------------------------------------------------------------
+def apply_schema(data, schema):
+    '''
+    cast the columns of "data" to the types of "schema", values that
+    cannot be parsed become missing values
+
+    Args:
+        data (pandas.DataFrame): DESCRIPTION.
+        schema (dict): {column: dtype}.
+
+    Returns:
+        data (pandas.DataFrame): DESCRIPTION.
+
+    '''
+    data = data.copy()
+
+    for col, dtype in schema.items():
+        if not (col in data.columns):
+            continue
+
+        if dtype in ['Int8', 'Int16', 'Int32', 'Int64', 'float32', 'float64']:
+            data[col] = pd.to_numeric(data[col], errors='coerce').astype(dtype)
+        else:
+            data[col] = data[col].astype(dtype)
+    return data
+# ============================================================================
+
+
+class CsvBackend():
+    '''
+    one csv file per snapshot, the original layout
+    '''
+    def save(self, path, data):
+
+        folder_path = os.path.dirname(path)
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        data.to_csv(path, index=False)
+        return None
+    # ----------------------------------------------------------------------
+    def flush(self):
+        return None
+# ============================================================================
+
+
+class ParquetBackend():
+    '''
+    Append the snapshots into Parquet datasets partitioned by date:
+        <root_path>/<dataset>/date=<YYYY-MM-DD>/part-<first>-<last>.parquet
+
+    By default every snapshot is written (atomically) as its own part file
+    when it arrives, typed by "FEED_SCHEMAS" with a "snapshot_time" column,
+    so a killed collector loses nothing. The part files of a date are merged
+    by "compact" / "compact_dates", e.g. once a day.
+
+    With "max_snapshots" > 1 the snapshots are buffered in memory, at most
+    "max_snapshots" of them and "max_age_sec" seconds (and until the date
+    changes), so a crash loses at most this buffer.
+    '''
+    def __init__(self, root_path, data_root_path, schemas=FEED_SCHEMAS,
+                 compression='zstd', max_snapshots=1, max_age_sec=300):
+        '''
+
+        Args:
+            root_path (str): the root folder of the Parquet datasets.
+            data_root_path (str): the root folder of the snapshot paths
+                passed to "save", e.g. "ROOT_PATH".
+            schemas (dict, optional): DESCRIPTION. Defaults to FEED_SCHEMAS.
+            compression (str, optional): DESCRIPTION. Defaults to 'zstd'.
+            max_snapshots (int, optional): the number of snapshots per file.
+                Defaults to 1, written when it arrives.
+            max_age_sec (float, optional): the longest time a snapshot is
+                buffered (max_snapshots > 1). Defaults to 300.
+
+        Returns:
+            None.
+
+        '''
+        self.root_path = root_path
+        self.data_root_path = data_root_path
+        self.schemas = schemas
+        self.compression = compression
+        self.max_snapshots = max(1, max_snapshots)
+        self.max_age_sec = max_age_sec
+
+        # dataset -> list of snapshots
+        self.buffers = {}
+        self.lock = threading.RLock()
+
+        atexit.register(self.flush)
+        return None
+    # ----------------------------------------------------------------------
+    def save(self, path, data):
+        '''
+        buffer one snapshot, the snapshot path is only used to find the
+        dataset and the snapshot time
+        '''
+        dataset, dt = _path_to_dataset(path, self.data_root_path)
+
+        if dataset is None:
+            return CsvBackend().save(path, data)
+        
+        if data.shape[0] == 0:
+            return None
+
+        data = data.copy()
+        data[SNAPSHOT_TIME_COL] = pd.Timestamp(dt)
+
+        with self.lock:
+            buffer = self.buffers.setdefault(dataset, [])
+
+            # a new date starts a new partition
+            if len(buffer) > 0 and buffer[-1][SNAPSHOT_TIME_COL].iloc[0].date() != dt.date():
+                self._flush_dataset(dataset)
+                buffer = self.buffers.setdefault(dataset, [])
+
+            buffer.append(data)
+
+            age_sec = (dt - buffer[0][SNAPSHOT_TIME_COL].iloc[0]).total_seconds()
+
+            if len(buffer) >= self.max_snapshots or age_sec >= self.max_age_sec:
+                self._flush_dataset(dataset)
+        return None
+    # ----------------------------------------------------------------------
+    def _flush_dataset(self, dataset):
+
+        buffer = self.buffers.pop(dataset, [])
+
+        if len(buffer) == 0:
+            return None
+
+        data = pd.concat(buffer, ignore_index=True, axis=0)
+        data = apply_schema(data, self.schemas.get(dataset, {}))
+
+        t0, t1 = data[SNAPSHOT_TIME_COL].min(), data[SNAPSHOT_TIME_COL].max()
+
+        folder_path = os.path.join(self.root_path, dataset, 'date={0}'.format(t0.strftime('%Y-%m-%d')))
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        file_name = 'part-{0}-{1}.parquet'.format(t0.strftime('%H%M%S'), t1.strftime('%H%M%S'))
+        file_path = os.path.join(folder_path, file_name)
+
+        # write then replace, a crash never leaves a half-written part
+        data.to_parquet(file_path + '.tmp', index=False, compression=self.compression)
+        os.replace(file_path + '.tmp', file_path)
+        return None
+    # ----------------------------------------------------------------------
+    def flush(self):
+        '''
+        write all the buffered snapshots
+        '''
+        with self.lock:
+            for dataset in list(self.buffers.keys()):
+                self._flush_dataset(dataset)
+        return None
+    # ----------------------------------------------------------------------
+    def compact(self, dataset, date):
+        '''
+        merge the part files of one date partition into one file
+
+        Args:
+            dataset (str): DESCRIPTION.
+            date (str): 'YYYY-MM-DD'.
+
+        Returns:
+            None.
+
+        '''
+        folder_path = os.path.join(self.root_path, dataset, 'date={0}'.format(date))
+
+        file_li = sorted(f for f in os.listdir(folder_path) if f.endswith('.parquet'))
+        if len(file_li) <= 1:
+            return None
+
+        data = pd.concat([pd.read_parquet(os.path.join(folder_path, f)) for f in file_li],
+                         ignore_index=True, axis=0)
+        data = apply_schema(data, self.schemas.get(dataset, {}))
+
+        tmp_path = os.path.join(folder_path, 'compact.parquet.tmp')
+        data.to_parquet(tmp_path, index=False, compression=self.compression)
+
+        for f in file_li:
+            os.remove(os.path.join(folder_path, f))
+        os.replace(tmp_path, os.path.join(folder_path, 'part-all.parquet'))
+        return None
+    # ----------------------------------------------------------------------
+    def compact_dates(self, datasets=None, before=None):
+        '''
+        merge the part files of every date partition before "before"
+
+        Args:
+            datasets (list, optional): Defaults to None, all the datasets.
+            before (datetime.date, optional): Defaults to None, today.
+
+        Returns:
+            None.
+
+        '''
+        before = datetime.date.today() if before is None else before
+
+        if datasets is None:
+            datasets = sorted(os.listdir(self.root_path)) if os.path.exists(self.root_path) else []
+
+        for dataset in datasets:
+            dataset_path = os.path.join(self.root_path, dataset)
+            if not os.path.isdir(dataset_path):
+                continue
+
+            for folder_name in sorted(os.listdir(dataset_path)):
+                if not folder_name.startswith('date='):
+                    continue
+
+                date = folder_name[len('date='):]
+                if datetime.datetime.strptime(date, '%Y-%m-%d').date() < before:
+                    self.compact(dataset, date)
+        return None
+# ============================================================================
+
+
+class DeltaBackend():
+    '''
+    Change-only capture of the slow-changing feeds (VMS, incidents, road
+    openings / works, travel times)
+
+    The records of a snapshot are identified by the natural keys of
+    "DELTA_KEYS" and compared, by a hash of all their columns, with the
+    last state kept in memory. Only the changes are appended to the log
+        <root_path>/<dataset>/<partition>.csv
+    with the columns "snapshot_time", "op" ('I' insert, 'U' update,
+    'D' delete) and the record columns, and the snapshot time to
+        <root_path>/<dataset>/<partition>.times
+
+    A log starts with the full snapshot (all inserts), so any snapshot can be
+    rebuilt from its own log, see "read_delta_snapshot". After a restart the
+    last state is rebuilt from the last log of the current partition.
+
+    When the columns of the feed change, a new log of the partition is
+    started ("<partition>.1.csv", "<partition>.2.csv", ...) with the full
+    snapshot. The records with a duplicate key are logged and counted, the
+    last one is kept.
+    '''
+    def __init__(self, root_path, data_root_path, delta_keys=DELTA_KEYS):
+        '''
+
+        Args:
+            root_path (str): the root folder of the delta logs.
+            data_root_path (str): the root folder of the snapshot paths
+                passed to "save", e.g. "ROOT_PATH".
+            delta_keys (dict, optional): DESCRIPTION. Defaults to DELTA_KEYS.
+
+        Returns:
+            None.
+
+        '''
+        self.root_path = root_path
+        self.data_root_path = data_root_path
+        self.delta_keys = delta_keys
+
+        # dataset -> (partition, log path, columns, state: pandas.DataFrame
+        #             indexed by key, hashes of the state)
+        self.states = {}
+        self.lock = threading.RLock()
+        return None
+    # ----------------------------------------------------------------------
+    def _log_paths(self, dataset, partition, segment=0):
+
+        return (_delta_log_path(self.root_path, dataset, partition, segment),
+                os.path.join(self.root_path, dataset, '{0}.times'.format(partition)))
+    # ----------------------------------------------------------------------
+    def _index(self, data, keys):
+        '''
+        the records of "data" indexed by their natural key, with the hash of
+        all their columns
+        '''
+        # as written to / read from the log, missing values are empty
+        data = data.astype(str).where(data.notna(), '')
+
+        index = data[keys[0]]
+        for col in keys[1:]:
+            index = index.str.cat(data[col], sep='|')
+
+        data.index = pd.Index(index, name=None)
+        data = data[~data.index.duplicated(keep='last')]
+
+        hashes = pd.util.hash_pandas_object(data, index=False)
+        return data, hashes
+    # ----------------------------------------------------------------------
+    def _restore(self, dataset, partition):
+        '''
+        the last state of "dataset" from the last log of "partition"
+        '''
+        log_li = _delta_log_segments(self.root_path, dataset, partition)
+
+        if len(log_li) == 0:
+            return None
+
+        log_path = log_li[-1]
+        state = _replay_delta_log(log_path, self.delta_keys[dataset]['keys'])
+        columns = [c for c in state.columns if not (c in [SNAPSHOT_TIME_COL, DELTA_OP_COL])]
+
+        data, hashes = self._index(state[columns], self.delta_keys[dataset]['keys'])
+        return log_path, columns, data, hashes
+    # ----------------------------------------------------------------------
+    def save(self, path, data):
+        '''
+        append the changes of one snapshot, the snapshot path is only used
+        to find the dataset and the snapshot time
+        '''
+        dataset, dt = _path_to_dataset(path, self.data_root_path)
+
+        if not (dataset in self.delta_keys):
+            return CsvBackend().save(path, data)
+
+        # a failed request returns no record, it is not a delete of all records
+        if data.shape[0] == 0:
+            return None
+
+        keys = self.delta_keys[dataset]['keys']
+        partition = dt.strftime(self.delta_keys[dataset]['partition'])
+        _, times_path = self._log_paths(dataset, partition)
+
+        with self.lock:
+            state = self.states.get(dataset)
+
+            if (state is None) or (state[0] != partition):
+                restored = self._restore(dataset, partition)
+                if restored is None:
+                    # a new log, starting with the full snapshot
+                    state = (partition, self._log_paths(dataset, partition)[0],
+                             list(data.columns), None, None)
+                else:
+                    state = (partition,) + restored
+
+            _, log_path, columns, last, last_hashes = state
+
+            if set(data.columns) != set(columns):
+                # the columns are not dropped or filled, a new log is started
+                METRICS.inc('datamall_delta_schema_changes_total', dataset=dataset)
+                logger.warning('%s: the columns changed (added: %s, removed: %s), new log of %s',
+                               dataset, [c for c in data.columns if not (c in columns)],
+                               [c for c in columns if not (c in data.columns)], partition)
+
+                segment = len(_delta_log_segments(self.root_path, dataset, partition))
+                log_path, _ = self._log_paths(dataset, partition, segment)
+                columns, last, last_hashes = list(data.columns), None, None
+
+            new, new_hashes = self._index(data.reindex(columns=columns), keys)
+
+            n_duplicates = data.shape[0] - new.shape[0]
+            if n_duplicates > 0:
+                METRICS.inc('datamall_delta_duplicate_keys_total', n_duplicates, dataset=dataset)
+                logger.warning('%s: %s records with a duplicate key %s, the last one is kept',
+                               dataset, n_duplicates, keys)
+
+            if last is None:
+                changes = new.assign(**{DELTA_OP_COL: 'I'})
+            else:
+                is_insert = ~new.index.isin(last.index)
+                is_delete = ~last.index.isin(new.index)
+
+                common = new.index[~is_insert]
+                is_update = new_hashes[common].to_numpy() != last_hashes[common].to_numpy()
+
+                changes = pd.concat([new[is_insert].assign(**{DELTA_OP_COL: 'I'}),
+                                     new.loc[common[is_update]].assign(**{DELTA_OP_COL: 'U'}),
+                                     last[is_delete].assign(**{DELTA_OP_COL: 'D'})],
+                                    ignore_index=True, axis=0)
+
+            folder_path = os.path.dirname(log_path)
+            if not os.path.exists(folder_path):
+                os.makedirs(folder_path)
+
+            if changes.shape[0] > 0:
+                changes.insert(0, SNAPSHOT_TIME_COL, dt.strftime('%Y-%m-%d %H:%M:%S'))
+                changes = changes[[SNAPSHOT_TIME_COL, DELTA_OP_COL] + columns]
+                changes.to_csv(log_path, index=False, mode='a', header=not os.path.exists(log_path))
+
+            with open(times_path, 'a') as f:
+                f.write(dt.strftime('%Y-%m-%d %H:%M:%S') + '\n')
+
+            self.states[dataset] = (partition, log_path, columns, new, new_hashes)
+        return None
+    # ----------------------------------------------------------------------
+    def flush(self):
+        return None
+# ============================================================================
+
+
+
+
+def _delta_log_path(root_path, dataset, partition, segment=0):
+    '''
+    the log "segment" of a partition: "<partition>.csv", "<partition>.1.csv", ...
+    '''
+    if segment == 0:
+        file_name = '{0}.csv'.format(partition)
+    else:
+        file_name = '{0}.{1}.csv'.format(partition, segment)
+    return os.path.join(root_path, dataset, file_name)
+# ----------------------------------------------------------------------------
+def _delta_log_segments(root_path, dataset, partition):
+    '''
+    the existing logs of a partition, in order
+    '''
+    log_li = []
+    while os.path.exists(_delta_log_path(root_path, dataset, partition, len(log_li))):
+        log_li.append(_delta_log_path(root_path, dataset, partition, len(log_li)))
+    return log_li
+# ----------------------------------------------------------------------------
+def _replay_delta_log(log_path, keys, dt=None):
+    '''
+    the last change of every record up to "dt", deleted records excluded
+    '''
+    log = pd.read_csv(log_path, header=0, index_col=None, dtype=str, keep_default_na=False)
+
+    if not (dt is None):
+        log = log[pd.to_datetime(log[SNAPSHOT_TIME_COL]) <= pd.Timestamp(dt)]
+
+    log = log.drop_duplicates(subset=keys, keep='last')
+    log = log[log[DELTA_OP_COL] != 'D']
+    return log.reset_index(drop=True)
+# ----------------------------------------------------------------------------
+def read_delta_snapshot(root_path, dataset, dt, delta_keys=DELTA_KEYS):
+    '''
+    rebuild the snapshot of a delta log at the time "dt"
+
+    Args:
+        root_path (str): the root folder of the delta logs.
+        dataset (str): the folder name, e.g. '2_21_VMS_EMAS'.
+        dt (datetime.datetime or str): the time, the last snapshot
+            collected at or before "dt" is rebuilt.
+        delta_keys (dict, optional): DESCRIPTION. Defaults to DELTA_KEYS.
+
+    Returns:
+        data (pandas.DataFrame) or None: the records (as str) with the
+            "snapshot_time" of the rebuilt snapshot, None if no snapshot
+            of the partition was collected before "dt".
+
+    '''
+    dt = pd.Timestamp(dt)
+    partition = dt.strftime(delta_keys[dataset]['partition'])
+
+    times_path = os.path.join(root_path, dataset, '{0}.times'.format(partition))
+
+    if not os.path.exists(times_path):
+        return None
+
+    with open(times_path, 'r') as f:
+        times = pd.to_datetime([line.strip() for line in f if line.strip()])
+    times = times[times <= dt]
+
+    if len(times) == 0:
+        return None
+
+    # the last log started at or before "dt", it starts with a full snapshot
+    log_path = None
+    for path in _delta_log_segments(root_path, dataset, partition):
+        first = pd.read_csv(path, header=0, index_col=None, dtype=str, nrows=1)
+        if pd.Timestamp(first[SNAPSHOT_TIME_COL].iloc[0]) <= dt:
+            log_path = path
+
+    if log_path is None:
+        return None
+
+    data = _replay_delta_log(log_path, delta_keys[dataset]['keys'], dt=dt)
+    data = data.drop(columns=[DELTA_OP_COL])
+    data[SNAPSHOT_TIME_COL] = times.max()
+    return data
+# ============================================================================
+
+
+
+
+def read_parquet_dataset(root_path, dataset, start=None, end=None, columns=None):
+    '''
+    read the snapshots of a Parquet dataset written by "ParquetBackend"
+
+    Args:
+        root_path (str): the root folder of the Parquet datasets.
+        dataset (str): the folder name, e.g. '2_12_CARPARK_AVAILABILITY'.
+        start (str, optional): the first date, 'YYYY-MM-DD'. Defaults to None.
+        end (str, optional): the last date, 'YYYY-MM-DD'. Defaults to None.
+        columns (list, optional): the columns to read. Defaults to None (all).
+
+    Returns:
+        data (pandas.DataFrame): DESCRIPTION.
+
+    '''
+    dataset_path = os.path.join(root_path, dataset)
+
+    file_li = []
+    for fd in sorted(os.listdir(dataset_path)):
+        if not fd.startswith('date='):
+            continue
+
+        date = fd[len('date='):]
+        # only the partitions in the date range are listed
+        if (not (start is None) and date < start) or (not (end is None) and date > end):
+            continue
+
+        fd_path = os.path.join(dataset_path, fd)
+        file_li.extend(os.path.join(fd_path, f) for f in sorted(os.listdir(fd_path))
+                       if f.endswith('.parquet'))
+
+    if len(file_li) == 0:
+        return pd.DataFrame(columns=columns)
+
+    data = pd.concat([pd.read_parquet(f, columns=columns) for f in file_li],
+                     ignore_index=True, axis=0)
+    return data
+# ============================================================================
+
+
+
+
+# folder name (dataset) -> backend, the key None is the default backend
+STORAGE_BACKENDS = {None: CsvBackend()}
+
+
+def set_storage_backend(backend, folder_name=None):
+    '''
+    set the storage backend of "save_data_df"
+
+    Args:
+        backend (object): an object with "save(path, data)" and "flush()".
+        folder_name (str, optional): the dataset using the backend.
+            Defaults to None, the default backend of all datasets.
+
+    Returns:
+        None.
+
+    '''
+    STORAGE_BACKENDS[folder_name] = backend
+    return None
+# ----------------------------------------------------------------------------
+def get_storage_backend(path, root_path):
+    '''
+    the storage backend of the snapshot "path"
+    '''
+    dataset, _ = _path_to_dataset(path, root_path)
+    return STORAGE_BACKENDS.get(dataset, STORAGE_BACKENDS[None])
+# ============================================================================
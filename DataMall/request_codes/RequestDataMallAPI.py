@@ -6,44 +6,89 @@ import time
 
 import zipfile
 import datetime
+import tempfile
 import requests
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
+from pandas.api.types import union_categoricals
+
+from DataMallSession import get_session, request_with_retry, TokenBucket
+from DataMallDownloadManager import DownloadManager, verify_zip, link_or_copy, file_sha256
+from DataMallCache import read_params_csv
+from DataMallMetrics import METRICS
+from DataMallStorage import get_storage_backend
+
 # from apscheduler.schedulers.blocking import BlockingScheduler
 
+
+logger = logging.getLogger(__name__)
+
+
 class ReqDataMallAPI():
-    def __init__(self, url, headers, params={}, sleep_sec=0.01):
+    def __init__(self, url, headers, params={}, sleep_sec=0., 
+                 max_workers=1, rate_limit=None, session=None):
         '''
 
         Args:
             url (str): DESCRIPTION.
             headers (dict): DESCRIPTION.
-            sleep_sec (float, optional): DESCRIPTION. Defaults to None.
+            sleep_sec (float, optional): an additional fixed delay before the
+                requests. Defaults to 0., the requests are paced by the
+                adaptive rate limiter shared by all the requests to a host,
+                see "DataMallSession.request_with_retry".
+            max_workers (int, optional): the number of pages requested 
+                concurrently by "req_pages_data". Defaults to 1 (serial).
+            rate_limit (float, optional): the maximum number of requests per
+                second of this instance, on top of the shared limiter.
+                Defaults to None.
+            session (requests.Session, optional): the session used by all 
+                requests. Defaults to None, the process-wide pooled session.
 
         Returns:
             None.
 
         '''
         self.url = url
+        # the label of the metrics, e.g. 'BusStops'
+        self.endpoint = None if url is None else url.rstrip('/').split('/')[-1]
         self.headers = headers
         self.sleep_sec = sleep_sec
-        self.params = params
+        # copy, "_req_one_page" must not modify the caller's (or default) dict
+        self.params = dict(params)
+        
+        self.session = get_session() if session is None else session
         
         self.max_records_per_page = 500
         
+        self.max_workers = max_workers
+        self.rate_limiter = None if rate_limit is None else TokenBucket(rate_limit)
+        
         self.logs_download_pages = []
         return None
     # ----------------------------------------------------------------------
+    def _get(self, url, endpoint=None, **kwargs):
+        '''
+        GET "url" with the shared rate limiter and the retry policy, the 
+        metrics are labelled by "endpoint" (default: "self.endpoint")
+        '''
+        if self.sleep_sec > 0:
+            time.sleep(self.sleep_sec)
+        
+        return request_with_retry('GET', url, session=self.session, limiter=self.rate_limiter, 
+                                  endpoint=self.endpoint if endpoint is None else endpoint, 
+                                  **kwargs)
+    # ----------------------------------------------------------------------
     def _req_download_link(self):
         '''
         obtain the download link from the requested content from "self.url"
         
         '''
         # Request the download link
-        req = requests.get(url = self.url, headers = self.headers, 
-            params = self.params)
+        req = self._get(self.url, headers = self.headers, params = self.params)
         
         sc, content = req.status_code, req.text
         
@@ -73,7 +118,7 @@ class ReqDataMallAPI():
 
         '''
         # request the data by download link
-        req = requests.get(link)               
+        req = self._get(link, endpoint='{0}:download'.format(self.endpoint))
         
         # If successfully request, the requested content is the binary format
         sc, content = req.status_code, req.content
@@ -90,25 +135,77 @@ class ReqDataMallAPI():
             
         return content, sc
     # ----------------------------------------------------------------------
-    def _obtain_data_from_zip(self, content):
+    def _req_download_zip_stream(self, link, chunk_size=1024*1024, spool_size=16*1024*1024):
+        '''
+        request the zip file from "link" (url), and spool it chunk by chunk 
+        to a temporary file instead of holding the whole content in memory
+        
+        Args:
+            link (str): the download link of the data
+            chunk_size (int, optional): the size (bytes) of the downloaded chunks.
+            spool_size (int, optional): the file is kept in memory up to this
+                size (bytes), and rolled over to disk beyond it.
+
+        Returns:
+            fzip (tempfile.SpooledTemporaryFile) or str: the spooled zip file, 
+                or the error content if the request is unsuccessful
+            sc (int): the status code.
+
+        '''
+        req = self._get(link, endpoint='{0}:download'.format(self.endpoint), stream=True)
+        
+        sc = req.status_code
+        
+        with req:
+            if sc == requests.codes.ok :
+                fzip = tempfile.SpooledTemporaryFile(max_size=spool_size)
+                for chunk in req.iter_content(chunk_size=chunk_size):
+                    fzip.write(chunk)
+                fzip.seek(0)
+                content = 'Successful'
+            else:
+                fzip = content = req.content.decode('ascii')
+        
+        self.logs_download_zip = {'state'              : 'download_request',
+                                   'request_status_code': sc,
+                                   'request_url'        : link,
+                                   'request_content'    : content }
+        
+        return fzip, sc
+    # ----------------------------------------------------------------------
+    def _obtain_data_from_zip(self, content, dtype=None, chunksize=None):
         '''
         obtain the data file (.csv) from the zip file ("content")
+        
+        The csv member is parsed straight from the decompressed zip stream,
+        without decoding the whole member into a string first.
 
         Args:
-            content (TYPE): DESCRIPTION.
+            content (bytes or file-like object): DESCRIPTION.
+            dtype (dict, optional): the dtype hints of the columns, e.g.
+                {'PT_CODE': 'category'}. Defaults to None.
+            chunksize (int, optional): parse the csv by chunks of "chunksize"
+                rows. Defaults to None.
 
         Returns:
             data_df (pandas.DataFrame) or None: DESCRIPTION.
 
         '''
+        if isinstance(content, bytes):
+            content = io.BytesIO(content)
         
-        with zipfile.ZipFile(io.BytesIO(content), 'r') as zf:
+        with zipfile.ZipFile(content, 'r') as zf:
         
             file_name = zf.namelist()[0]
             
-            data = zf.read(file_name).decode("utf-8")
+            with zf.open(file_name) as f, METRICS.timer('datamall_parse_seconds', endpoint=self.endpoint):
+                data_df = pd.read_csv(f, header=0, index_col=None, encoding='utf-8',
+                                      dtype=dtype, chunksize=chunksize)
+                
+                if not (chunksize is None):
+                    data_df = _concat_chunks(data_df)
         
-        data_df = pd.read_csv(io.StringIO(data), header=0, index_col=None)
+        METRICS.inc('datamall_rows_total', data_df.shape[0], endpoint=self.endpoint)
         
         return data_df, file_name
     # ----------------------------------------------------------------------
@@ -120,8 +217,6 @@ class ReqDataMallAPI():
             file_name (str) or None: DESCRIPTION.
 
         '''
-        time.sleep(self.sleep_sec)
-        
         link, link_sc = self._req_download_link()
         
         if link_sc == requests.codes.ok :
@@ -131,8 +226,14 @@ class ReqDataMallAPI():
                 return fzip
         return None
     # ---------------------------------------------------------------------- 
-    def req_download_data(self):
+    def req_download_data(self, stream=False, dtype=None, chunksize=None):
         '''
+        
+        Args:
+            stream (bool, optional): spool the zip file to a temporary file
+                instead of memory. Defaults to False.
+            dtype (dict, optional): the dtype hints of the columns. Defaults to None.
+            chunksize (int, optional): parse the csv by chunks. Defaults to None.
 
         Returns:
             data_df (pandas.DataFrame) or None: DESCRIPTION.
@@ -142,10 +243,18 @@ class ReqDataMallAPI():
         link, link_sc = self._req_download_link()
         
         if link_sc == requests.codes.ok :
-            fzip, fzip_sc = self._req_download_zip(link)
+            if stream:
+                fzip, fzip_sc = self._req_download_zip_stream(link)
+            else:
+                fzip, fzip_sc = self._req_download_zip(link)
             
             if fzip_sc == requests.codes.ok :
-                data_df, file_name = self._obtain_data_from_zip(fzip)
+                try:
+                    data_df, file_name = self._obtain_data_from_zip(fzip, dtype=dtype, 
+                                                                    chunksize=chunksize)
+                finally:
+                    if stream:
+                        fzip.close()
                 return data_df, file_name
         return None, None
     # ----------------------------------------------------------------------
@@ -156,7 +265,7 @@ class ReqDataMallAPI():
         Returns:
             data_df (pandas.DataFrame): 
         '''
-        req = requests.get(url = self.url, headers = self.headers, params = self.params)
+        req = self._get(self.url, headers = self.headers, params = self.params)
         
         sc, content = req.status_code, req.text
         
@@ -187,16 +296,18 @@ class ReqDataMallAPI():
         '''
         assert (no_page is None) or (no_page >= 0)
         
-        params = self.params
+        # each page has its own "$skip", pages may be requested concurrently
+        params = dict(self.params)
         
         if not(no_page is None):
             params.update({'$skip': str(no_page * self.max_records_per_page)})
         
-        req = requests.get(url = self.url, headers = self.headers, 
-                           params = params)
+        req = self._get(self.url, headers = self.headers, params = params)
         
         content, sc = req.text, req.status_code
         
+        METRICS.inc('datamall_pages_total', endpoint=self.endpoint)
+        
         self.logs_download_pages.append({'no_page'            : no_page,
                                          'original_url'       : self.url,
                                          'parameters'         : str(params),
@@ -222,15 +333,14 @@ class ReqDataMallAPI():
         
         while True:
             
-            time.sleep(self.sleep_sec)
-            
             content, sc = self._req_one_page(no_page=no_page)
             
             # Stop Criterion 1: unsuccessful request
             if sc != 200:
                 break
             
-            content = json.loads(content)['value']
+            with METRICS.timer('datamall_parse_seconds', endpoint=self.endpoint):
+                content = json.loads(content)['value']
             # print(len(content))
             data_all.extend(content)
             no_page = no_page + 1
@@ -245,19 +355,104 @@ class ReqDataMallAPI():
         
         return data_all
     # ----------------------------------------------------------------------
+    def _req_page_records(self, no_page):
+        '''
+        Request one page in the concurrent mode
+
+        Args:
+            no_page (int): the number of page
+
+        Returns:
+            content (list) or None: the records of the page, 
+                None if the request is unsuccessful
+
+        '''
+        content, sc = self._req_one_page(no_page=no_page)
+        
+        if sc != 200:
+            return None
+        
+        with METRICS.timer('datamall_parse_seconds', endpoint=self.endpoint):
+            return json.loads(content)['value']
+    # ----------------------------------------------------------------------
+    def _req_all_page_concurrent(self, max_page=None):
+        '''
+        Request all pages concurrently and convert them into list type
+        
+        The number of records is unknown in advance, so the pages are probed 
+        in waves of "self.max_workers" pages. The probing stops at the wave 
+        containing the last page (an unsuccessful request or a page with 
+        less than "self.max_records_per_page" records). The records are 
+        reassembled in "$skip" order, the same as "_req_all_page".
+        
+        Args:
+            max_page (int, optional): the last page to request. Defaults to None.
+            
+        Returns:
+            data_all (list): DESCRIPTION.
+
+        '''
+        pages = {}
+        # the first page where "_req_all_page" would stop
+        last_page = None
+        
+        no_page = 0
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            
+            while last_page is None:
+                
+                wave = range(no_page, no_page + self.max_workers)
+                if not(max_page is None):
+                    wave = [p for p in wave if p <= max_page]
+                
+                # Stop Criterion 3: reach to the max page
+                if len(wave) == 0:
+                    break
+                
+                for p, content in zip(wave, executor.map(self._req_page_records, wave)):
+                    pages[p] = content
+                    
+                    # Stop Criterion 1 and 2: unsuccessful request or no more data
+                    if (content is None) or (len(content) < self.max_records_per_page):
+                        last_page = p if last_page is None else min(last_page, p)
+                
+                no_page = no_page + self.max_workers
+        
+        data_all = []
+        
+        for p in sorted(pages.keys()):
+            # unsuccessful request, the same as the Stop Criterion 1
+            if pages[p] is None:
+                break
+            
+            data_all.extend(pages[p])
+            
+            if p == last_page:
+                break
+        
+        return data_all
+    # ----------------------------------------------------------------------
     def req_pages_data(self):
         '''
+        Request all pages, concurrently if "self.max_workers" > 1
 
         Returns:
             data_df (pandas.DataFrame) or None: DESCRIPTION.
         '''
-        data_all = self._req_all_page()
+        if self.max_workers > 1:
+            data_all = self._req_all_page_concurrent()
+        else:
+            data_all = self._req_all_page()
         
         if len(data_all) == 0:
             return None
         else:
             # dict to pandas.DataFrame
-            data_df = pd.DataFrame(data_all)
+            with METRICS.timer('datamall_parse_seconds', endpoint=self.endpoint):
+                data_df = pd.DataFrame(data_all)
+            
+            METRICS.inc('datamall_rows_total', data_df.shape[0], endpoint=self.endpoint)
             return data_df
     # ----------------------------------------------------------------------
     def req_platform_crowd_forecast(self):
@@ -268,21 +463,15 @@ class ReqDataMallAPI():
             date (str):
 
         '''
-        time.sleep(self.sleep_sec)
-        
-        req = requests.get(url=self.url, headers=self.headers, params=self.params)
+        req = self._get(self.url, headers=self.headers, params=self.params)
         
         content = req.text 
-        data = json.loads(content)['value'][0]
-        dt = data['Date']
+        data = json.loads(content)['value']
         
-        data_df = pd.DataFrame(columns=['Station', 'Start', 'CrowdLevel'])
+        with METRICS.timer('datamall_parse_seconds', endpoint=self.endpoint):
+            data_df, dt = parse_platform_crowd_forecast(data)
         
-        for sta in data['Stations']:
-            data_sta = pd.DataFrame(sta['Interval'])
-            data_sta['Station'] = sta['Station']
-            
-            data_df = data_df.append(data_sta, ignore_index=True)
+        METRICS.inc('datamall_rows_total', data_df.shape[0], endpoint=self.endpoint)
         return data_df, dt
     # ----------------------------------------------------------------------
     def req_platform_crowd_realtime(self):
@@ -293,9 +482,7 @@ class ReqDataMallAPI():
             date (str):
 
         '''
-        time.sleep(self.sleep_sec)
-        
-        req = requests.get(url=self.url, headers=self.headers, params=self.params)
+        req = self._get(self.url, headers=self.headers, params=self.params)
         
         content = req.text 
         
@@ -307,18 +494,22 @@ class ReqDataMallAPI():
     # ----------------------------------------------------------------------
     def _req_geospatial_params(self):
         '''
+        the layer IDs of the geospatial whole island, read from the bundled
+        "Parameters" file or the cache, see "DataMallCache.fetch_text"
 
         Returns:
             params_df (pandas.DataFrame): DESCRIPTION.
 
         '''
         url = 'https://raw.githubusercontent.com/veager/GeoDatabase-Singapore/main/DataMall/Parameters/V5.4_ANNEX_E.txt'
-        params_df = pd.read_csv(url, header=0, index_col=None, comment='#')
+        params_df = read_params_csv(url, header=0, index_col=None, comment='#')
         
         return params_df
     # ----------------------------------------------------------------------
     def _req_train_line_params(self):
         '''
+        the train line codes, read from the bundled "Parameters" file or
+        the cache, see "DataMallCache.fetch_text"
 
         Returns:
             params_df (pandas.DataFrame): DESCRIPTION.
@@ -326,20 +517,99 @@ class ReqDataMallAPI():
         '''
         url = 'https://raw.githubusercontent.com/veager/GeoDatabase-Singapore/main/DataMall/Parameters/V5.4_Train_Line.txt'
         
-        params_df = pd.read_csv(url, header=0, index_col=None, sep=',')
+        params_df = read_params_csv(url, header=0, index_col=None, sep=',')
         
         return params_df
 # ==========================================================================
 
 
+def _concat_chunks(chunks):
+    '''
+    concatenate the chunks of "pandas.read_csv", the categorical columns
+    keep the categorical dtype (with the union of the categories)
+    
+    Args:
+        chunks (iterable of pandas.DataFrame): DESCRIPTION.
+
+    Returns:
+        data_df (pandas.DataFrame): DESCRIPTION.
+
+    '''
+    chunks = list(chunks)
+    
+    if len(chunks) == 1:
+        return chunks[0]
+    
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([c[col] for c in chunks]).categories
+            for c in chunks:
+                c[col] = c[col].cat.set_categories(categories)
+    
+    data_df = pd.concat(chunks, ignore_index=True, axis=0)
+    return data_df
+# ==========================================================================
+
+
+
+
+# the crowd levels of the platform crowd density: low, moderate, high,
+# "NA" (not available) becomes a missing value
+CROWD_LEVELS = pd.CategoricalDtype(['l', 'm', 'h'], ordered=True)
+
+
+def parse_platform_crowd_forecast(value):
+    '''
+    flatten the "value" of a PCDForecast response, nested as
+        [{'Date', 'Stations': [{'Station', 'Interval': [{'Start', 'CrowdLevel'}]}]}]
+    into one row per station and interval, in a single pass
+
+    Args:
+        value (list): DESCRIPTION.
+
+    Returns:
+        data_df (pandas.DataFrame): columns 'Station', 'Start' (timestamp),
+            'CrowdLevel' (ordered categorical, see "CROWD_LEVELS").
+        dt (str): the 'Date' of the forecast, None if "value" is empty.
+
+    '''
+    stations, starts, levels = [], [], []
+    
+    for data in value:
+        for sta in data['Stations']:
+            for itv in sta['Interval']:
+                stations.append(sta['Station'])
+                starts.append(itv['Start'])
+                levels.append(itv['CrowdLevel'])
+    
+    # the same intervals repeat for every station, each one is parsed once
+    codes, uniques = pd.factorize(pd.Series(starts, dtype='object'))
+    starts = pd.to_datetime(pd.Series(uniques, dtype='object'), format='ISO8601').take(codes)
+    
+    data_df = pd.DataFrame({'Station'    : pd.Categorical(stations),
+                            'Start'      : starts.reset_index(drop=True),
+                            'CrowdLevel' : pd.Categorical(levels, dtype=CROWD_LEVELS)})
+    
+    dt = value[0]['Date'] if len(value) > 0 else None
+    return data_df, dt
+# ==========================================================================
+
+
 
 
 def save_data_df(path, data):
+    '''
+    save the data by the storage backend of its dataset (folder name), 
+    a csv file at "path" by default, see "set_storage_backend"
+    '''
+    backend = get_storage_backend(path, ROOT_PATH)
+    
+    dataset = os.path.relpath(path, ROOT_PATH).split(os.sep)[0]
+    
+    with METRICS.timer('datamall_write_seconds', dataset=dataset):
+        backend.save(path, data)
     
-    folder_path = os.path.dirname(path)
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    data.to_csv(path, index=False)
+    METRICS.inc('datamall_written_rows_total', 0 if data is None else data.shape[0], dataset=dataset)
     return None
 # ============================================================================
 
@@ -351,6 +621,16 @@ HEADERS = {'AccountKey': '+mx8ADrbR8WWO4x6/kewfw==',
 
 ROOT_PATH = os.path.join(os.getcwd(), 'data')
 
+# the manifest of the monthly downloads, see "DownloadManager"
+MANIFEST_PATH = os.path.join(ROOT_PATH, 'manifest.json')
+
+# the number of pages requested concurrently, and the page requests per second
+PAGE_WORKERS = 8
+PAGE_RATE_LIMIT = 20.
+
+# the geospatial layers downloaded concurrently
+GEOSPATIAL_WORKERS = 8
+
 
 
 # + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + 
@@ -372,6 +652,11 @@ ROOT_PATH = os.path.join(os.getcwd(), 'data')
 
 def save_pages_data():
     
+    dm = DownloadManager(MANIFEST_PATH)
+    
+    dt = datetime.datetime.now()
+    month = dt.strftime("%Y-%m")
+    
     req_urls = [{'url'         : 'http://datamall2.mytransport.sg/ltaodataservice/BusServices',
                  'folder_name' : '2_2_BUS_SERVICES',
                  'file_name'   : ''
@@ -388,42 +673,111 @@ def save_pages_data():
                  'folder_name' : '2_13_ERP_RATES',
                  'file_name'   : ''},
                 ]
-              
+    
     for info in req_urls:
-        rdm = ReqDataMallAPI(url = info['url'], headers = HEADERS)
-        data_df = rdm.req_pages_data()
-        
-        dt = datetime.datetime.now()
         
         save_path = os.path.join(ROOT_PATH, 
                                  info['folder_name'], 
                                 '{0}.csv'.format(dt.strftime("%Y-%m-%d"))
                                 )
-        save_data_df(path = save_path, data = data_df)
+        
+        def _save(info=info, save_path=save_path):
+            rdm = ReqDataMallAPI(url = info['url'], headers = HEADERS, 
+                                 max_workers = PAGE_WORKERS, rate_limit = PAGE_RATE_LIMIT)
+            data_df = rdm.req_pages_data()
+            
+            if data_df is None:
+                raise IOError('No data: {0}'.format(info['url']))
+            
+            save_data_df(path = save_path, data = data_df)
+            return save_path
+        
+        dm.run(info['folder_name'], month, 'pages', _save)
     
     # - - - - - - - - - - - - - - - - - - - - - - - - - -
     
     url = 'http://datamall2.mytransport.sg/ltaodataservice/TaxiStands'
     folder_name = '2_10_TAXI_STANDS'
     
-    dt = datetime.datetime.now()
-    
     file_name = '{0}_{1}.csv'.format('taxi_stands', dt.strftime("%Y-%m-%d"))
     save_path = os.path.join(ROOT_PATH, folder_name, file_name)
     
-    req = ReqDataMallAPI(url, headers=HEADERS)
-    data_df = req.request_url_data()
+    def _save():
+        req = ReqDataMallAPI(url, headers=HEADERS)
+        data_df = req.request_url_data()
+        
+        save_data_df(save_path, data_df)
+        return save_path
     
-    save_data_df(save_path, data_df)
+    dm.run(folder_name, month, 'data', _save)
     return None
 # =============================================================================
 
 
-def save_geospatial():
+def _req_download_link_or_raise(rdm):
+    '''
+    request the download link, raise an exception if it is unsuccessful
+    '''
+    link, sc = rdm._req_download_link()
+    
+    if sc != requests.codes.ok:
+        raise IOError('Request failed ({0}): {1}'.format(sc, rdm.logs_download_link['parameters']))
+    return link
+# -----------------------------------------------------------------------------
+def _download_geospatial_layer(dm, url, folder_name, dt_str, id_, file_path):
+    '''
+    download the zip file of the layer "id_", checked by "verify_zip"
+
+    The layer is not downloaded again if its ETag is the one of the last
+    month, the file of the last month is linked instead. A downloaded layer
+    with the same sha256 as the last month is flagged as "unchanged".
+
+    Returns:
+        info (dict): the manifest fields, see "DownloadManager.run".
+
+    '''
+    prev = dm.previous(folder_name, dt_str, id_)
+    
+    if not (prev is None) and not os.path.exists(prev['path']):
+        prev = None
+    
+    rdm = ReqDataMallAPI(url=url, headers=HEADERS, params={'ID': id_})
+    
+    link = _req_download_link_or_raise(rdm)
+    
+    info = dm.download_file(link, file_path, session=rdm.session, 
+                            etag=None if prev is None else prev.get('etag'))
+    
+    if info.get('not_modified', False):
+        link_or_copy(prev['path'], file_path)
+        return {'path'          : file_path, 
+                'sha256'        : prev['sha256'], 
+                'etag'          : prev.get('etag'), 
+                'last_modified' : prev.get('last_modified'), 
+                'unchanged'     : True}
     
+    try:
+        verify_zip(file_path)
+    except IOError:
+        # downloaded again by the next attempt
+        os.remove(file_path)
+        raise
+    
+    info['sha256'] = file_sha256(file_path)
+    info['unchanged'] = not (prev is None) and prev['sha256'] == info['sha256']
+    return info
+# -----------------------------------------------------------------------------
+def save_geospatial(max_workers=GEOSPATIAL_WORKERS):
+    '''
+    download the layers of the geospatial whole island of this month,
+    "max_workers" layers at once, and write the manifest of the month to
+    "<folder>/manifest.json"
+    '''
     url = 'http://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland'
     folder_name = '2_23_GEOSPATIAL'
     
+    dm = DownloadManager(MANIFEST_PATH)
+    
     dt_str = datetime.datetime.now().strftime('%Y-%m')
     
     save_folder = os.path.join(ROOT_PATH, folder_name, dt_str)
@@ -434,25 +788,25 @@ def save_geospatial():
     # Request parameters
     params_df = ReqDataMallAPI(url=None , headers=None)._req_geospatial_params()
     
-    for ix, row in params_df.iterrows():
-        
-        # if row['ID'] != 'PedestrainOverheadbridge_Underpass':
-        #     continue
-        
-        params = {'ID': row['ID']}
-        rdm = ReqDataMallAPI(url=url, headers=HEADERS, params=params, sleep_sec=1.)
-        content = rdm.req_download_zip()
-        
-        if content is None:
-            print(rdm.logs_download_link['parameters'])
-            print(rdm.logs_download_link['request_content'])
-            print(rdm.logs_download_link['request_status_code'])
-            continue
+    def _run(id_):
+        file_path = os.path.join(save_folder, '{0}.zip'.format(id_))
         
-        file_path = os.path.join(save_folder, '{0}.zip'.format(row['ID']))
-        with open(file_path, 'wb') as f:
-            f.write(content)
+        return dm.run(folder_name, dt_str, id_, 
+                      lambda: _download_geospatial_layer(dm, url, folder_name, dt_str, id_, file_path))
     
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_run, params_df['ID'].tolist()))
+    
+    # the manifest of the month
+    entries = dm.entries(folder_name, dt_str)
+    
+    with open(os.path.join(save_folder, 'manifest.json'), 'w') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    
+    logger.info('%s %s: %s complete, %s unchanged, %s failed', folder_name, dt_str,
+                sum(e['status'] == 'complete' for e in entries.values()),
+                sum(e.get('unchanged', False) for e in entries.values()),
+                sum(e['status'] != 'complete' for e in entries.values()))
     return None
 # =============================================================================
 
@@ -470,6 +824,19 @@ def save_geospatial():
 # + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + 
 
 
+# dtype hints of the passenger volume tables, the codes keep the leading zeros
+PASSENGER_VOLUME_DTYPES = {'YEAR_MONTH'           : 'category',
+                           'DAY_TYPE'             : 'category',
+                           'TIME_PER_HOUR'        : 'int8',
+                           'PT_TYPE'              : 'category',
+                           'PT_CODE'              : 'category',
+                           'ORIGIN_PT_CODE'       : 'category',
+                           'DESTINATION_PT_CODE'  : 'category',
+                           'TOTAL_TAP_IN_VOLUME'  : 'int32',
+                           'TOTAL_TAP_OUT_VOLUME' : 'int32',
+                           'TOTAL_TRIPS'          : 'int32'}
+
+
 def save_passenger_data():
 
     dt = datetime.datetime.now() - datetime.timedelta(days=30)
@@ -487,10 +854,37 @@ def save_passenger_data():
                 {'url'         : 'http://datamall2.mytransport.sg/ltaodataservice/PV/Train',
                  'folder_name' : '2_8_PVOL_TRAIN_STATIONS'}]
     
+    dm = DownloadManager(MANIFEST_PATH)
+    
     for info in req_urls:
-        try:
+        
+        # the zip is downloaded (and resumed) as a file, then parsed to csv
+        zip_path = os.path.join(ROOT_PATH, 
+                                info['folder_name'],
+                                params['Date'][:4],   # Year
+                                '{0}.zip'.format(params['Date']))
+        
+        def _download(info=info, zip_path=zip_path):
             rdm = ReqDataMallAPI(url = info['url'], headers = HEADERS, params = params)
-            data_df, file_name = rdm.req_download_data()
+            
+            # a complete zip is kept by the failed attempt of parsing
+            if not os.path.exists(zip_path):
+                link = _req_download_link_or_raise(rdm)
+                zip_info = dm.download_file(link, zip_path, session=rdm.session)
+                
+                dm.update(info['folder_name'], params['Date'], 'data',
+                          etag = zip_info['etag'], 
+                          last_modified = zip_info['last_modified'])
+            
+            try:
+                verify_zip(zip_path)
+            except IOError:
+                # downloaded again by the next attempt
+                os.remove(zip_path)
+                raise
+            
+            with open(zip_path, 'rb') as f:
+                data_df, file_name = rdm._obtain_data_from_zip(f, dtype=PASSENGER_VOLUME_DTYPES)
             
             save_path = os.path.join(ROOT_PATH, 
                                      info['folder_name'],
@@ -498,8 +892,10 @@ def save_passenger_data():
                                      file_name)
             
             save_data_df(path = save_path, data = data_df)
-        except:
-            print('Error:', info['folder_name'])
+            os.remove(zip_path)
+            return save_path
+        
+        dm.run(info['folder_name'], params['Date'], 'data', _download)
 
     return None
 # =============================================================================
@@ -532,218 +928,76 @@ def save_passenger_data():
 # + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + + 
 
 
+# the realtime feeds are described once in "DataMallFeeds.FEEDS", and
+# requested and saved by "DataMallFeeds.run_feed" / "run_feeds"
+
 def save_taxi_avail():
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/Taxi-Availability'
-        folder_name = '2_9_TAXI_AVAILABILITYS'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('2_9_TAXI_AVAILABILITYS')
+    from DataMallFeeds import run_feed
+    return run_feed('taxi_avail')
 
-    return None
-    
 
 
 def save_carpark_avail():
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/CarParkAvailabilityv2'
-        folder_name = '2_12_CARPARK_AVAILABILITY'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_12_CARPARK_AVAILABILITY')
-
-    return None
+    from DataMallFeeds import run_feed
+    return run_feed('carpark_avail')
 
 
 
 def save_travel_time():
-    try:
-        # = = = travel time
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/EstTravelTimes'
-        folder_name = '2_14_TRAVEL_TIMES'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_14_TRAVEL_TIMES')
+    from DataMallFeeds import run_feed
+    return run_feed('travel_time')
+
+
 
-  
-# = = = traffic speed
 def save_traffic_speed():
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/TrafficSpeedBandsv2'
-        folder_name = '2_20_TRAFFIC_SPEED'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_20_TRAFFIC_SPEED')
-    return None
+    from DataMallFeeds import run_feed
+    return run_feed('traffic_speed')
 
 
 
 def save_road_openning_work():  # Update Freq : 24 hours
-    # = = = road opennings
-    try: 
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/RoadOpenings'
-        folder_name = '2_16_ROAD_OPENINGS'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_16_ROAD_OPENINGS')
-    
-    # = = = road works
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/RoadWorks'
-        folder_name = '2_17_ROAD_WORKS'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_17_ROAD_WORKS')
-        
-    return None
+    from DataMallFeeds import run_feeds
+    return run_feeds(['road_openings', 'road_works'])
 
 
 
-def save_traffic_incident_vms():
+def save_road_openings():
+    from DataMallFeeds import run_feed
+    return run_feed('road_openings')
 
-    # = = = traffic incident
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/TrafficIncidents'
-        folder_name = '2_19_TRAFFIC_INCIDENTS'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_19_TRAFFIC_INCIDENTS')
 
-    
-    try:
-        # = = = VMS / EMAS
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/VMS'
-        folder_name = '2_21_VMS_EMAS'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        req = ReqDataMallAPI(url, headers=HEADERS)
-        data_df = req.req_pages_data()
-        
-        save_data_df(save_path, data_df)
-    except:
-        print('Error: 2_21_VMS_EMAS')
 
-    return None
+def save_road_works():
+    from DataMallFeeds import run_feed
+    return run_feed('road_works')
 
 
 
-def save_platform_crowd_realtime():     # Update Freq : 10 minutes
-    '''
-    request the real-time platform crowd of all stations
-    '''
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/PCDRealTime'
-        folder_name = '2_25_PLATFORM_CROWD_REAL_TIME'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m-%d"), file_name)
-        
-        params_df = ReqDataMallAPI(url=None, headers=None)._req_train_line_params()
-        
-        data_all_df = []
-        for ix, row in params_df.iterrows():
-            params = {'TrainLine': row['Train Line Code']}
-            
-            rdm = ReqDataMallAPI(url = url, headers = HEADERS, params = params)
-            data_df = rdm.req_platform_crowd_realtime()
+def save_traffic_incident_vms():
+    from DataMallFeeds import run_feeds
+    return run_feeds(['traffic_incident', 'vms'])
 
-            data_all_df.append(data_df)
-        data_all_df = pd.concat(data_all_df, ignore_index=True, axis=0)
 
-        save_data_df(save_path, data_all_df)
-    except:
-        print('Error: 2_25_PLATFORM_CROWD_REAL_TIME')
 
-    return None
+def save_traffic_incident():
+    from DataMallFeeds import run_feed
+    return run_feed('traffic_incident')
 
 
-def save_platform_crowd_forecast():  # Update Freq : 24 hours
-    '''
-    request the forecasted platform crowd of all stations
-    '''
-    try:
-        url = 'http://datamall2.mytransport.sg/ltaodataservice/PCDForecast'
-        folder_name = '2_26_PLATFORM_CROWD_FORECAST'
-        
-        dt = datetime.datetime.now()
-        file_name = '{0}.csv'.format(dt.strftime("%Y-%m-%d-%H-%M-%S"))
-        save_path = os.path.join(ROOT_PATH, folder_name, dt.strftime("%Y-%m"), file_name)
-        
-        params_df = ReqDataMallAPI(url=None, headers=None)._req_train_line_params()
-        
-        data_all_df = []
-        for ix, row in params_df.iterrows():
-            params = {'TrainLine': row['Train Line Code']}
-            
-            rdm = ReqDataMallAPI(url = url, headers = HEADERS, params = params)
-            data_df = rdm.req_platform_crowd_forecast()
 
-            data_all_df.append(data_df)
-        data_all_df = pd.concat(data_all_df, ignore_index=True, axis=0)
+def save_vms():
+    from DataMallFeeds import run_feed
+    return run_feed('vms')
 
-        save_data_df(save_path, data_all_df)
-    except:
-        print('Error: 2_26_PLATFORM_CROWD_FORECAST')
-        
-    return None
-# ==========================================================================
\ No newline at end of file
+
+
+def save_platform_crowd_realtime():     # Update Freq : 10 minutes
+    from DataMallFeeds import run_feed
+    return run_feed('platform_crowd_realtime')
+
+
+
+def save_platform_crowd_forecast():  # Update Freq : 24 hours
+    from DataMallFeeds import run_feed
+    return run_feed('platform_crowd_forecast')
+# ==========================================================================
@@ -0,0 +1,445 @@
+
+import json
+import time
+import asyncio
+import datetime
+import logging
+
+import aiohttp
+import pandas as pd
+
+from RequestDataMallAPI import (save_data_df, _concat_chunks, parse_platform_crowd_forecast,
+                                HEADERS)
+from DataMallSession import get_rate_limiter, backoff_delay, parse_retry_after, RETRY_CONFIG
+from DataMallFeeds import FEEDS, FAN_OUT_VALUES, feed_save_path
+from DataMallStorage import apply_schema
+from DataMallMetrics import METRICS, record_collector, collector_error
+
+
+logger = logging.getLogger(__name__)
+
+# limits shared by every async request of the process
+ASYNC_LIMITS = {'connections'          : 32,   # open connections in total
+                'connections_per_host' : 16,   # open connections per host
+                'requests'             : 16}   # requests in flight
+
+# the shared session and semaphore, bound to the running event loop
+_ASYNC_STATE = {'loop': None, 'session': None, 'semaphore': None}
+
+
+def _get_async_state():
+    '''
+    get (or create) the session and request semaphore of the running loop
+    '''
+    loop = asyncio.get_running_loop()
+
+    if _ASYNC_STATE['loop'] is not loop or _ASYNC_STATE['session'].closed:
+        connector = aiohttp.TCPConnector(limit          = ASYNC_LIMITS['connections'],
+                                         limit_per_host = ASYNC_LIMITS['connections_per_host'])
+        _ASYNC_STATE['loop'] = loop
+        _ASYNC_STATE['session'] = aiohttp.ClientSession(connector=connector)
+        _ASYNC_STATE['semaphore'] = asyncio.Semaphore(ASYNC_LIMITS['requests'])
+
+    return _ASYNC_STATE['session'], _ASYNC_STATE['semaphore']
+# ----------------------------------------------------------------------------
+async def _acquire_async(limiter):
+    '''
+    take one token of the (thread-safe) "limiter", sleeping in the event loop
+    while the bucket is empty or paused
+    '''
+    while True:
+        delay = limiter.try_acquire()
+        if delay == 0.:
+            return None
+        await asyncio.sleep(delay)
+# ----------------------------------------------------------------------------
+async def close_async_session():
+    '''
+    close the shared session of the running loop
+    '''
+    session = _ASYNC_STATE['session']
+    if not (session is None) and not session.closed:
+        await session.close()
+    _ASYNC_STATE.update({'loop': None, 'session': None, 'semaphore': None})
+    return None
+# ============================================================================
+
+
+class AsyncReqDataMallAPI():
+    '''
+    asyncio counterpart of "ReqDataMallAPI"
+    '''
+    def __init__(self, url, headers, params={}, max_workers=8):
+        '''
+
+        Args:
+            url (str): DESCRIPTION.
+            headers (dict): DESCRIPTION.
+            params (dict, optional): DESCRIPTION. Defaults to {}.
+            max_workers (int, optional): the number of pages requested
+                concurrently by "req_pages_data". Defaults to 8.
+
+        Returns:
+            None.
+
+        '''
+        self.url = url
+        self.headers = headers
+        self.params = dict(params)
+        self.endpoint = url.rstrip('/').split('/')[-1]
+
+        self.max_records_per_page = 500
+        self.max_workers = max_workers
+
+        self.logs_download_pages = []
+        return None
+    # ----------------------------------------------------------------------
+    async def _req(self, params):
+        '''
+        request "self.url" with "params" under the shared request limit and
+        the shared rate limiter of its host, with the retries of
+        "DataMallSession.request_with_retry"
+
+        Returns:
+            content (str): DESCRIPTION.
+            sc (int): the status code.
+
+        '''
+        session, semaphore = _get_async_state()
+        host_limiter = get_rate_limiter(self.url)
+
+        timeout = aiohttp.ClientTimeout(total=RETRY_CONFIG['timeout'])
+        max_retries = RETRY_CONFIG['max_retries']
+
+        for attempt in range(max_retries + 1):
+
+            # the token is taken before the request slot, the waits hold neither
+            # a slot nor a thread
+            await _acquire_async(host_limiter)
+
+            error = None
+            async with semaphore:
+                t0 = time.perf_counter()
+                try:
+                    async with session.get(self.url, headers=self.headers, params=params,
+                                           timeout=timeout) as req:
+                        content, sc = await req.text(), req.status
+                        request_url = str(req.url)
+                        retry_after = parse_retry_after(req)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+
+            if not (error is None):
+                METRICS.inc('datamall_requests_total', endpoint=self.endpoint, status=type(error).__name__)
+                logger.warning('Attempt %s failed: %s, %r', attempt + 1, self.url, error)
+
+                if attempt == max_retries:
+                    raise error
+                METRICS.inc('datamall_retries_total', endpoint=self.endpoint, reason=type(error).__name__)
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            METRICS.observe('datamall_request_seconds', time.perf_counter() - t0, endpoint=self.endpoint)
+            METRICS.inc('datamall_requests_total', endpoint=self.endpoint, status=sc)
+            METRICS.inc('datamall_response_bytes_total', len(content), endpoint=self.endpoint)
+
+            if not (sc in RETRY_CONFIG['retry_status']) or attempt == max_retries:
+                if sc < 400:
+                    host_limiter.succeeded()
+                break
+
+            METRICS.inc('datamall_retries_total', endpoint=self.endpoint, reason=sc)
+
+            if sc == 429:
+                host_limiter.throttled(retry_after)
+
+                if retry_after is None:
+                    await asyncio.sleep(backoff_delay(attempt))
+            else:
+                logger.warning('Attempt %s failed (%s): %s', attempt + 1, sc, self.url)
+                await asyncio.sleep(backoff_delay(attempt))
+
+        self.logs_download_pages.append({'original_url'       : self.url,
+                                         'parameters'         : str(params),
+                                         'request_status_code': sc,
+                                         'request_url'        : request_url,
+                                         'request_content'    : 'Successful' if sc == 200 else content })
+        return content, sc
+    # ----------------------------------------------------------------------
+    async def _req_page_records(self, no_page):
+        '''
+        Request a designated page
+
+        Returns:
+            content (list) or None: the records of the page,
+                None if the request is unsuccessful
+
+        '''
+        params = dict(self.params)
+        params.update({'$skip': str(no_page * self.max_records_per_page)})
+
+        content, sc = await self._req(params)
+
+        if sc != 200:
+            return None
+        return json.loads(content)['value']
+    # ----------------------------------------------------------------------
+    async def _req_all_page(self, max_page=None):
+        '''
+        Request all pages concurrently, probed in waves of "self.max_workers"
+        pages, see "ReqDataMallAPI._req_all_page_concurrent"
+
+        Returns:
+            data_all (list): DESCRIPTION.
+
+        '''
+        pages = {}
+        last_page = None
+
+        no_page = 0
+
+        while last_page is None:
+
+            wave = range(no_page, no_page + self.max_workers)
+            if not(max_page is None):
+                wave = [p for p in wave if p <= max_page]
+
+            if len(wave) == 0:
+                break
+
+            contents = await asyncio.gather(*[self._req_page_records(p) for p in wave])
+
+            for p, content in zip(wave, contents):
+                pages[p] = content
+
+                if (content is None) or (len(content) < self.max_records_per_page):
+                    last_page = p if last_page is None else min(last_page, p)
+
+            no_page = no_page + self.max_workers
+
+        data_all = []
+
+        for p in sorted(pages.keys()):
+            if pages[p] is None:
+                break
+
+            data_all.extend(pages[p])
+
+            if p == last_page:
+                break
+
+        return data_all
+    # ----------------------------------------------------------------------
+    async def req_pages_data(self):
+        '''
+
+        Returns:
+            data_df (pandas.DataFrame) or None: DESCRIPTION.
+        '''
+        data_all = await self._req_all_page()
+
+        if len(data_all) == 0:
+            return None
+        else:
+            data_df = pd.DataFrame(data_all)
+            return data_df
+    # ----------------------------------------------------------------------
+    async def request_url_data(self):
+        '''
+        request the data of url
+
+        Returns:
+            data_df (pandas.DataFrame) or None:
+        '''
+        content, sc = await self._req(self.params)
+
+        if sc != 200:
+            return None
+
+        data_df = pd.DataFrame(json.loads(content)['value'])
+        return data_df
+    # ----------------------------------------------------------------------
+    async def req_platform_crowd_forecast(self):
+        '''
+
+        Returns:
+            data_df (pandas.DataFrame): DESCRIPTION.
+            date (str):
+
+        '''
+        content, sc = await self._req(self.params)
+
+        if sc != 200:
+            raise IOError('Request failed ({0}): {1}'.format(sc, self.url))
+
+        data_df, dt = parse_platform_crowd_forecast(json.loads(content)['value'])
+        return data_df, dt
+    # ----------------------------------------------------------------------
+    async def req_platform_crowd_realtime(self):
+        '''
+
+        Returns:
+            data_df (pandas.DataFrame): DESCRIPTION.
+
+        '''
+        return await self.request_url_data()
+# ============================================================================
+
+
+
+
+async def _fetch_pages_async(req):
+    return await req.req_pages_data()
+
+
+async def _fetch_single_async(req):
+    return await req.req_platform_crowd_realtime()
+
+
+async def _fetch_forecast_async(req):
+    data_df, _ = await req.req_platform_crowd_forecast()
+    return data_df
+
+
+# paging style -> fetcher(AsyncReqDataMallAPI) -> pandas.DataFrame or None,
+# the async counterpart of "DataMallFeeds.FETCHERS"
+ASYNC_FETCHERS = {'pages'    : _fetch_pages_async,
+                  'single'   : _fetch_single_async,
+                  'forecast' : _fetch_forecast_async}
+# ============================================================================
+
+
+
+
+async def _fetch_params_async(feed, params):
+    '''
+    request the records of "feed" with the parameters "params"
+    '''
+    req = AsyncReqDataMallAPI(feed['url'], headers=HEADERS, params=params,
+                              max_workers=feed.get('page_workers', 1))
+    return await ASYNC_FETCHERS[feed['paging']](req)
+# ----------------------------------------------------------------------------
+async def fetch_feed_async(name):
+    '''
+    request all the records of the feed "name", see "DataMallFeeds.fetch_feed"
+
+    The requests of a fan-out (e.g. one per train line) are sent
+    concurrently, under the shared request limit. A failed value is logged
+    and counted, and the records of the other values are still returned.
+
+    Returns:
+        data_df (pandas.DataFrame) or None: None if no record is received.
+
+    '''
+    feed = FEEDS[name]
+
+    if feed.get('fan_out') is None:
+        return await _fetch_params_async(feed, {})
+
+    key = feed['fan_out']
+    values = await asyncio.to_thread(FAN_OUT_VALUES[key])
+
+    results = await asyncio.gather(*[_fetch_params_async(feed, {key: v}) for v in values],
+                                   return_exceptions=True)
+
+    # in the order of the values
+    data_all_df = []
+    for v, data_df in zip(values, results):
+        if isinstance(data_df, Exception):
+            METRICS.inc('datamall_fan_out_errors_total', feed=feed['folder_name'], param=v)
+            logger.warning('Failed: %s, %s=%s', feed['folder_name'], key, v, exc_info=data_df)
+            continue
+
+        if not (data_df is None):
+            data_all_df.append(data_df)
+
+    if len(data_all_df) == 0:
+        return None
+    return _concat_chunks(data_all_df)
+# ----------------------------------------------------------------------------
+def _save_feed(name, dt, data_df):
+
+    feed = FEEDS[name]
+    if not (feed.get('schema') is None):
+        data_df = apply_schema(data_df, feed['schema'])
+
+    save_data_df(feed_save_path(name, dt), data_df)
+    return None
+# ----------------------------------------------------------------------------
+async def run_feed_async(name, dt=None):
+    '''
+    request and save one snapshot of the feed "name", see
+    "DataMallFeeds.run_feed", the csv file is written in a worker thread
+    to keep the event loop free
+
+    Args:
+        name (str): the feed, see "FEEDS".
+        dt (datetime.datetime, optional): the snapshot time. Defaults to None, now.
+
+    Returns:
+        None.
+
+    '''
+    feed = FEEDS[name]
+    dt = datetime.datetime.now() if dt is None else dt
+
+    t0 = time.perf_counter()
+    try:
+        data_df = await fetch_feed_async(name)
+
+        if data_df is None:
+            raise IOError('No data: {0}'.format(feed['url']))
+
+        await asyncio.to_thread(_save_feed, name, dt, data_df)
+    except Exception:
+        collector_error(feed['folder_name'])
+    finally:
+        record_collector(name, time.perf_counter() - t0, budget_sec=feed['interval_sec'])
+    return None
+# ============================================================================
+
+
+
+
+# (feed, interval in seconds), one job per feed of "FEEDS"
+ASYNC_JOBS = [(name, feed['interval_sec']) for name, feed in FEEDS.items()]
+
+
+async def _run_periodic(name, interval):
+    '''
+    run the feed "name" every "interval" seconds, a run which overruns its
+    interval delays the next run instead of overlapping it
+    '''
+    loop = asyncio.get_running_loop()
+
+    next_time = loop.time()
+    while True:
+        await run_feed_async(name)
+
+        next_time = next_time + interval
+        delay = next_time - loop.time()
+        if delay < 0:
+            logger.warning('%s overran its %s s interval by %.1f s',
+                           name, interval, -delay)
+            next_time = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
+# ----------------------------------------------------------------------------
+async def run_collectors(jobs=ASYNC_JOBS):
+    '''
+    run all the collectors in one event loop
+
+    Args:
+        jobs (list, optional): (feed, interval in seconds) tuples.
+            Defaults to ASYNC_JOBS.
+
+    Returns:
+        None.
+
+    '''
+    try:
+        await asyncio.gather(*[_run_periodic(name, interval) for name, interval in jobs])
+    finally:
+        await close_async_session()
+    return None
+# ============================================================================
@@ -0,0 +1,18 @@
+import asyncio
+import logging
+
+from RequestDataMallAPIAsync import *
+
+
+# all the feeds of "DataMallFeeds.FEEDS" run in one event loop:
+#   1 minute   : taxi availability, carpark availability
+#   2 minutes  : traffic incident, VMS
+#   5 minutes  : travel time, traffic speed
+#   10 minutes : platform crowd real time
+#   24 hours   : road openings, road works, platform crowd forecast
+
+logging.basicConfig(level=logging.INFO, format='[ %(asctime)s ] %(levelname)s %(message)s')
+
+print('Start...')
+
+asyncio.run(run_collectors(ASYNC_JOBS))
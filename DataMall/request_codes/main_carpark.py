@@ -1,4 +1,10 @@
 from RequestDataMallAPI import *
+from CarparkTimeSeries import CarparkStore
+from DataMallSession import session_stats
+from DataMallStorage import set_storage_backend, ParquetBackend, DeltaBackend
+from DataMallMetrics import export_metrics
+from DataMallRunner import CollectorRunner
+from DataMallFeeds import cycle_collectors
 
 
 
@@ -9,55 +15,55 @@ save_geospatial()
 save_passenger_data()
 '''
 
-from apscheduler.schedulers.blocking import BlockingScheduler
-
-def initial_job():
-
-    save_taxi_avail()      # Update Freq : 1 minute
-    save_carpark_avail()   # Update Freq : 1 minute
-    
-    save_travel_time()     # Update Freq : 5 minutes 
-    save_traffic_speed()   # Update Freq : 5 minutes
-    
-    # save_traffic_incident_vms()         # Update Freq : 2 minutes
-    
-    # save_road_openning_work()           # Update Freq : 24 hours
-    
-    # save_platform_crowd_realtime()      # Update Freq : 10 minutes
-    
-    # save_platform_crowd_forecast()      # Update Freq : 24 hours
-
-
-def scheduler_job():
-    # BlockingScheduler
-    scheduler = BlockingScheduler()
-
-    # car park, 
-    # 1 minute
-    scheduler.add_job(save_taxi_avail,    'interval', minutes=1, id='save_taxi_avail')
-    scheduler.add_job(save_carpark_avail, 'interval', minutes=1, id='save_carpark_avail')
-    
-    # traffic incident, VMS
-    # 2 minute
-    # scheduler.add_job(save_traffic_incident_vms, 'interval', minutes=2, id='save_traffic_incident_vms')
-    
-    # traffic speed, 5 minute
-    scheduler.add_job(save_travel_time,   'interval', minutes=5, id='save_travel_time')
-    scheduler.add_job(save_traffic_speed, 'interval', minutes=5, id='save_traffic_speed')
-    
-    # 10 minutes
-    # scheduler.add_job(save_platform_crowd_realtime, 'interval', minutes=10, id='save_platform_crowd_realtime')
-
-    # 24 hours
-    # scheduler.add_job(save_road_openning_work, 'interval', hours=24, id='save_road_openning_work')
-    # scheduler.add_job(save_platform_crowd_forecast, 'interval', hours=24, id='save_platform_crowd_realtime')
-    
-    scheduler.start()
 
+# the 1-minute and 5-minute snapshots are appended to date-partitioned 
+# Parquet datasets instead of one csv file per snapshot
+PARQUET_BACKEND = ParquetBackend(os.path.join(ROOT_PATH, 'parquet'), ROOT_PATH)
 
+for folder_name in ['2_9_TAXI_AVAILABILITYS', '2_20_TRAFFIC_SPEED']:
+    set_storage_backend(PARQUET_BACKEND, folder_name)
 
-print('Start...')
+# the travel times only append the changed records
+set_storage_backend(DeltaBackend(os.path.join(ROOT_PATH, 'delta'), ROOT_PATH), '2_14_TRAVEL_TIMES')
+
+# the carpark availability only appends the changed lots
+set_storage_backend(CarparkStore(os.path.join(ROOT_PATH, 'carpark_store'), delta=True, 
+                                 data_root_path=ROOT_PATH), 
+                    '2_12_CARPARK_AVAILABILITY')
+
+# the metrics files of this process, exported every minute
+METRICS_NAME = 'main_carpark'
+
+
+def print_session_job():
+    # connection reuse of the shared pooled session
+    for host, stat in session_stats().items():
+        print('[ {0} ] {1} requests: {2}, connections: {3}, reused: {4}'.format(
+            datetime.datetime.now(), host, stat['requests'], stat['connections'], stat['reused']))
+
+
+def export_metrics_job():
+    export_metrics(prom_path  = os.path.join(ROOT_PATH, 'metrics', '{0}.prom'.format(METRICS_NAME)),
+                   jsonl_path = os.path.join(ROOT_PATH, 'metrics', '{0}.jsonl'.format(METRICS_NAME)))
 
-initial_job()
 
-scheduler_job()
+# the feeds of this process, see "DataMallFeeds.FEEDS", the feeds with the
+# same interval are requested together in one cycle
+#   taxi, car park             : 1 minute
+#   travel time, traffic speed : 5 minutes
+TABLE = cycle_collectors(['taxi_avail', 'carpark_avail', 'travel_time', 'traffic_speed'])
+
+TABLE = TABLE + [
+    # connection reuse counters, 10 minutes
+    {'name': 'print_session_job',  'func': print_session_job,  'interval_sec': 10 * 60, 'offset_sec': 50},
+    # per-endpoint latency, pages, rows, bytes, retries, parse and write time
+    {'name': 'export_metrics_job', 'func': export_metrics_job, 'interval_sec': 60,      'offset_sec': 55},
+    # one Parquet file per day instead of one per snapshot, after midnight
+    {'name': 'compact_parquet_job', 'func': PARQUET_BACKEND.compact_dates, 'interval_sec': 24 * 3600, 'offset_sec': 15 * 60},
+    ]
+
+
+
+print('Start...')
+
+CollectorRunner(TABLE, stagger_sec=10.).start()
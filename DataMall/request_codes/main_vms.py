@@ -1,8 +1,8 @@
 from RequestDataMallAPI import *
-from apscheduler.schedulers.blocking import BlockingScheduler
-
-import apscheduler.schedulers.background
-scheduler = apscheduler.schedulers.background.BackgroundScheduler(job_defaults={'max_instances': 7})
+from DataMallStorage import set_storage_backend, DeltaBackend
+from DataMallMetrics import export_metrics
+from DataMallRunner import CollectorRunner
+from DataMallFeeds import cycle_collectors
 
 
 '''
@@ -12,50 +12,37 @@ save_geospatial()
 save_passenger_data()
 '''
 
+# the slow-changing feeds only append the inserted, updated and deleted records,
+# see "DataMallStorage.read_delta_snapshot" to rebuild a snapshot
+DELTA_BACKEND = DeltaBackend(os.path.join(ROOT_PATH, 'delta'), ROOT_PATH)
 
-def initial_job():
+for folder_name in ['2_16_ROAD_OPENINGS', '2_17_ROAD_WORKS', '2_19_TRAFFIC_INCIDENTS', '2_21_VMS_EMAS']:
+    set_storage_backend(DELTA_BACKEND, folder_name)
 
-    # save_taxi_avail()                   # Update Freq : 1 minute
-    # save_carpark_avail()                # Update Freq : 1 minute
-    # save_travel_time_traffic_speed()    # Update Freq : 5 minutes 
-    
-    save_traffic_incident_vms()         # Update Freq : 2 minutes
-    
-    save_platform_crowd_realtime()      # Update Freq : 10 minutes
-    
-    save_road_openning_work()           # Update Freq : 24 hours
-    # save_platform_crowd_forecast()      # Update Freq : 24 hours
+# the metrics files of this process, exported every minute
+METRICS_NAME = 'main_vms'
 
 
-def scheduler_job():
-    # BlockingScheduler
-    scheduler = BlockingScheduler()
+def export_metrics_job():
+    export_metrics(prom_path  = os.path.join(ROOT_PATH, 'metrics', '{0}.prom'.format(METRICS_NAME)),
+                   jsonl_path = os.path.join(ROOT_PATH, 'metrics', '{0}.jsonl'.format(METRICS_NAME)))
 
-    # car park, 
-    # 1 minute
-    # scheduler.add_job(save_taxi_avail,    'interval', minutes=1, id='save_taxi_avail')
-    # scheduler.add_job(save_carpark_avail, 'interval', minutes=1, id='save_carpark_avail')
-    
-    # traffic incident, VMS
-    # 2 minute
-    scheduler.add_job(save_traffic_incident_vms, 'interval', minutes=2, id='save_traffic_incident_vms')
-    
-    # traffic speed, 5 minute
-    # scheduler.add_job(save_travel_time_traffic_speed, 'interval', minutes=5, id='save_travel_time_traffic_speed')
-    
-    # 10 minutes
-    scheduler.add_job(save_platform_crowd_realtime, 'interval', minutes=10, id='save_platform_crowd_realtime')
 
-    # 24 hours
-    scheduler.add_job(save_road_openning_work, 'interval', hours=24, id='save_road_openning_work')
-    # scheduler.add_job(save_platform_crowd_forecast, 'interval', hours=24, id='save_platform_crowd_realtime')
-    
-    scheduler.start()
+# the feeds of this process, see "DataMallFeeds.FEEDS", the feeds with the
+# same interval are requested together in one cycle
+#   traffic incident, VMS : 2 minutes
+#   platform crowd        : 10 minutes
+#   road openings, works  : 24 hours
+TABLE = cycle_collectors(['traffic_incident', 'vms', 'platform_crowd_realtime',
+                          'road_openings', 'road_works'])
 
+TABLE = TABLE + [
+    # per-endpoint latency, pages, rows, bytes, retries, parse and write time
+    {'name': 'export_metrics_job', 'func': export_metrics_job, 'interval_sec': 60, 'offset_sec': 55},
+    ]
 
 
-print('Start...')
 
-initial_job()
+print('Start...')
 
-scheduler_job()
+CollectorRunner(TABLE, stagger_sec=10.).start()
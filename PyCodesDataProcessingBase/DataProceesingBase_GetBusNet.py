@@ -3,6 +3,8 @@ import pandas as pd
 import networkx as nx
 import geopandas as gpd
 
+from .DataProcessingBase_NetExport import NetNodeTable, NetEdgeTable, ExportNetTables, EXPORT_FORMATS
+
 
 
 def ReadBusStopLocShp(path):
@@ -128,9 +130,63 @@ def ReadBusRouteCsv(path):
     # stop_no = route_data['BusStopCode'].value_counts()
     return data
 # --------------------------------------------------------
+def BusRouteEdges(route):
+    '''
+    the consecutive stop pairs of every bus route, vectorized
+        the routes are sorted once by (ServiceNo, Direction, StopSequence),
+        the services keep their order of appearance in "route"
+
+    Parameters
+    ----------
+    route : pandas.DataFrame
+        columns: 'ServiceNo', 'Operator', 'Direction', 'BusStopCode', 
+        'StopSequence', 'Distance'
+    
+    Returns
+    -------
+    edge : pandas.DataFrame
+        one row per consecutive stop pair of a route, columns:
+        'Source', 'Target', 'ServiceNo', 'Operator', 'Direction', 'dist'
+
+    '''
+    # the services in their order of appearance
+    serv_code, _ = pd.factorize(route['ServiceNo'])
+    
+    order = np.lexsort((route['StopSequence'].values, 
+                        route['Direction'].values, 
+                        serv_code))
+    
+    serv = serv_code[order]
+    direc = route['Direction'].values[order]
+    stop = route['BusStopCode'].values[order]
+    dist = route['Distance'].values[order].astype(float)
+    
+    # the next row is the next stop of the same route
+    same = (serv[1:] == serv[:-1]) & (direc[1:] == direc[:-1])
+    
+    ix = order[:-1][same]
+    edge = pd.DataFrame({
+        'Source'    : stop[:-1][same],
+        'Target'    : stop[1:][same],
+        'ServiceNo' : route['ServiceNo'].values[ix],
+        'Operator'  : route['Operator'].values[ix] if 'Operator' in route.columns else None,
+        'Direction' : direc[:-1][same],
+        'dist'      : (dist[1:] - dist[:-1])[same]
+    })
+    return edge
+# --------------------------------------------------------
+def _GroupLists(codes, values):
+    '''
+    the lists of "values" of every group code 0, 1, ..., in the order of "values"
+    '''
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes))[:-1]
+    return [v.tolist() for v in np.split(values[order], bounds)]
+# --------------------------------------------------------
 def BusStopRoute2Net(stop, route, multiedge=False):
     '''
     According to bus route table, construct the bus networks
+        the edges are derived by "BusRouteEdges" and loaded in bulk
 
     Parameters
     ----------
@@ -140,9 +196,15 @@ def BusStopRoute2Net(stop, route, multiedge=False):
     route : pandas.DataFrame
         DESCRIPTION.
     
+    multiedge : bool
+        False: networkx.DiGraph, one edge per stop pair, 
+            attributes 'dist', 'serv_li', 'serv_num'
+        True: networkx.MultiDiGraph, one edge per stop pair and service 
+            (the edge key), attributes 'serv', 'oprt', 'dist'
+    
     Returns
     -------
-    net : networkx.DiGraph
+    net : networkx.DiGraph or networkx.MultiDiGraph
         Directed bus networks
 
     '''
@@ -150,87 +212,56 @@ def BusStopRoute2Net(stop, route, multiedge=False):
     # because there lack the info 
     route = route.merge(right=stop[['BusStopCode', 'geometry']], 
         on='BusStopCode', how='inner')
-    route.sort_values(by=['ServiceNo', 'Direction', 'StopSequence'])
     
-    # bus line list
-    bus_line_li = route['ServiceNo'].unique().tolist()
+    edge = BusRouteEdges(route)
     
     if multiedge:
         # directed multiedge graph
         net = nx.MultiDiGraph()
         
-        # add bus route
-        for serv_ix in bus_line_li:
-            one_route = route[route['ServiceNo'] == serv_ix]
-            # directions list [1,2] or [1]
-            directions = route['Direction'].unique().tolist()
-
-            for d_ix in directions:
-                # select one-direction bus line
-                route_dir = one_route[one_route['Direction'] == d_ix]
-                route_dir = route_dir.sort_values(by='StopSequence')
-                route_dir.reset_index(drop=True, inplace=True)
-                
-                for i in range(route_dir.shape[0]-1):
-                    start_node = route_dir.loc[i, 'BusStopCode']
-                    end_node = route_dir.loc[i+1, 'BusStopCode']
-                    dist = route_dir.loc[i+1, 'Distance'] - route_dir.loc[i, 'Distance']
-                    
-                    net.add_edge(start_node, end_node, serv_ix)
-                    net.edges[start_node, end_node, serv_ix]['serv'] = serv_ix
-                    net.edges[start_node, end_node, serv_ix]['oprt'] = route_dir.loc[i, 'Operator']
-                    net.edges[start_node, end_node, serv_ix]['dist'] = dist
+        # one edge per service, the last direction wins
+        edge = edge.drop_duplicates(subset=['Source', 'Target', 'ServiceNo'], keep='last')
+        
+        net.add_edges_from(
+            (u, v, k, {'serv': k, 'oprt': o, 'dist': d}) for u, v, k, o, d in 
+            zip(edge['Source'], edge['Target'], edge['ServiceNo'], edge['Operator'], edge['dist'])
+        )
     #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  - 
     else:
         # directed graph
         net = nx.DiGraph()
         
-        # add bus route
-        for serv_ix in bus_line_li:
-            one_route = route[route['ServiceNo'] == serv_ix]
-            # directions list [1,2] or [1]
-            directions = route['Direction'].unique().tolist()
-
-            for d_ix in directions:
-                # select one-direction bus line
-                route_dir = one_route[one_route['Direction'] == d_ix]
-                route_dir = route_dir.sort_values(by='StopSequence')
-                route_dir.reset_index(drop=True, inplace=True)
-
-                for i in range(route_dir.shape[0]-1):
-                    start_node = route_dir.loc[i, 'BusStopCode']
-                    end_node = route_dir.loc[i+1, 'BusStopCode']
-                    dist = route_dir.loc[i+1, 'Distance'] - route_dir.loc[i, 'Distance']
-                    
-                    # a new route between two stop node
-                    if not net.has_edge(start_node, end_node):
-                        net.add_edge(start_node, end_node)
-                        net.edges[start_node, end_node]['dist'] = dist
-                        net.edges[start_node, end_node]['serv_li'] = [serv_ix]
-                    # already existing route
-                    else:
-                        serv_li = net.edges[start_node, end_node]['serv_li'].copy()
-                        serv_li.append(serv_ix)
-                        serv_li = list(set(serv_li))
-                        net.edges[start_node, end_node]['serv_li'] = serv_li.copy()
-                        net.edges[start_node, end_node]['serv_num'] = len(serv_li)
+        # one edge per stop pair: the distance of the first service, 
+        # and the services passing the edge
+        edge = edge.drop_duplicates(subset=['Source', 'Target', 'ServiceNo'], ignore_index=True)
+        pair = edge.groupby(['Source', 'Target'], sort=False).ngroup().values
+        
+        first = np.unique(pair, return_index=True)[1]
+        serv_lis = _GroupLists(pair, edge['ServiceNo'].values)
+        
+        net.add_edges_from(
+            (u, v, {'dist': d, 'serv_li': sl, 'serv_num': len(sl)}) for u, v, d, sl in
+            zip(edge['Source'].values[first], edge['Target'].values[first], 
+                edge['dist'].values[first], serv_lis)
+        )
     # -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  - 
     
     # add bus stop information
     route = route[['BusStopCode', 'ServiceNo', 'geometry']]
     # drop duplicate
-    route.drop_duplicates(subset=['BusStopCode', 'ServiceNo'], inplace=True, ignore_index=True)
-    route.sort_values(by='BusStopCode', ignore_index=True, inplace=True)
+    route = route.drop_duplicates(subset=['BusStopCode', 'ServiceNo'], ignore_index=True)
     route = gpd.GeoDataFrame(route, crs=stop.crs)
     
-    for group in route.groupby(by='BusStopCode'):
-        (node, group) = group
-        serv_li = group['ServiceNo'].unique().tolist()
-        net.nodes[node]['serv_li'] = serv_li
-        net.nodes[node]['serv_num'] = len(serv_li)
-        
-        net.nodes[node]['lng'] = group['geometry'].x.values[0]
-        net.nodes[node]['lat'] = group['geometry'].y.values[0]
+    stop_code = route.groupby('BusStopCode', sort=True).ngroup().values
+    
+    serv_lis = _GroupLists(stop_code, route['ServiceNo'].values)
+    # the location of the first row of each stop
+    node = route.iloc[np.unique(stop_code, return_index=True)[1]]
+    
+    net.add_nodes_from(
+        (n, {'serv_li': sl, 'serv_num': len(sl), 'lng': x, 'lat': y}) for n, sl, x, y in
+        zip(node['BusStopCode'].values, serv_lis, node.geometry.x.values, node.geometry.y.values)
+    )
     return net
 # --------------------------------------------------------
 def NetProcessing(net):
@@ -306,14 +337,8 @@ def Route2LineShp(stop, route):
         inplace = True
     )
     
-    # route shapfile, line layer
-    route_shp = gpd.GeoDataFrame(
-        columns = ['Operator', 'ServiceNo', 'Direction', 'StopSequence', 'Distance', 'geometry'],
-        crs = stop.crs
-    )
-    
-    row = {}
-    # one bus line group
+    # route shapfile, line layer, one row per bus line group
+    rows = []
     for group in route.groupby(by=['ServiceNo', 'Direction']):
         (_, group) = group
         # the number of stops in one bus line group
@@ -321,6 +346,7 @@ def Route2LineShp(stop, route):
         group.reset_index(drop=True, inplace=True)
         group.sort_values(by='StopSequence', inplace=True)
 
+        row = {}
         row['Operator'] = group['Operator'][0]
         row['ServiceNo'] = group['ServiceNo'][0]
         row['Direction'] = group['Direction'][0]
@@ -328,19 +354,31 @@ def Route2LineShp(stop, route):
         row['Distance'] = group['Distance'][n-1] - group['Distance'][0]
         row['geometry'] = LineString(group['geometry'].to_list())
 
-        route_shp = route_shp.append(row, ignore_index=True)
+        rows.append(row)
     
+    # built once
+    route_shp = gpd.GeoDataFrame(rows, 
+        columns = ['Operator', 'ServiceNo', 'Direction', 'StopSequence', 'Distance', 'geometry'],
+        geometry = 'geometry', crs = stop.crs
+    )
     return route_shp
 # --------------------------------------------------------
-def BusNet2NodeEgesPd(net):
+def BusNet2NodeEgesPd(net, path=None, formats=EXPORT_FORMATS):
     '''
     Transfer the bus network (netwrokx.DiGraph object) to nodes and edges (pandas.DataFram)
     to input Gephi.
+        the tables are built in one pass, see "NetNodeTable" and "NetEdgeTable"
     
     Parameters
     ----------
     net : netwrokx.DiGraph
         bus network
+    
+    path : str, optional
+        write the tables to "path" (without extension), see "ExportNetTables"
+    
+    formats : tuple, optional
+        'csv' (Gephi), 'graphml', 'parquet'
 
     Returns
     -------
@@ -350,30 +388,14 @@ def BusNet2NodeEgesPd(net):
         DESCRIPTION.
 
     '''
+    node_pd = NetNodeTable(net, cols=['lat', 'lng', 'serv_num', 'serv_li'])
     
-    node_pd = pd.DataFrame(
-        columns = ['Id', 'lat', 'lng', 'serv_num', 'serv_li']
-    )
-    row = {}
-    for node in net.nodes:
-        row['Id'] = node
-        row['lat'] = net.nodes[node]['lat']
-        row['lng'] = net.nodes[node]['lng']
-        row['serv_num'] = net.nodes[node]['serv_num']
-        row['serv_li'] = ','.join(net.nodes[node]['serv_li'])
-        node_pd = node_pd.append(row, ignore_index=True)
-    
-    edge_pd = pd.DataFrame(
-        columns = ['Source', 'Target', 'dist', 'serv_num', 'serv_li']
-    )
-    row = {}
-    for (start, end) in net.edges:
-        row['Source'] = start
-        row['Target'] = end
-        row['dist'] = net.edges[start, end]['dist']
-        row['serv_num'] = len(net.edges[start, end]['serv_li'])
-        row['serv_li'] = ','.join(net.edges[start, end]['serv_li'])
-        edge_pd = edge_pd.append(row, ignore_index=True)
+    edge_pd = NetEdgeTable(net, cols=['dist', 'serv_li'], sep=None)
+    edge_pd.insert(3, 'serv_num', edge_pd['serv_li'].map(len))
+    edge_pd['serv_li'] = edge_pd['serv_li'].str.join(',')
+    
+    if not (path is None):
+        ExportNetTables(node_pd, edge_pd, path, formats=formats, directed=net.is_directed())
     return node_pd, edge_pd
 # --------------------------------------------------------
 # =============================================================================
\ No newline at end of file
@@ -1,7 +1,11 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import networkx as nx
 
+from .DataProceesingBase_GetBusNet import BusRouteEdges, _GroupLists
+from .DataProcessingBase_NetExport import NetNodeTable, NetEdgeTable, ExportNetTables, EXPORT_FORMATS
+
 
 def ReadBusRoute(path):
     data = pd.read_csv(
@@ -15,6 +19,7 @@ def ReadBusRoute(path):
 def BusRoute2Net(route_data):
     '''
     According to bus route table, construct the bus networks
+        the edges are derived by "BusRouteEdges" and loaded in bulk
 
     Parameters
     ----------
@@ -29,55 +34,35 @@ def BusRoute2Net(route_data):
     '''
     net = nx.DiGraph()
     
-    # node list
-    node_li = route_data['BusStopCode'].unique().tolist()
-    node_li.sort()
-    # print(len(stop_no_li))
     # stop bus operator information
     node_operator = route_data[['ServiceNo', 'BusStopCode']].drop_duplicates()
     
-    # add bus stop
-    for node in node_li:
-        
-        net.add_node(node)
-        # add node accociated bus line information
-        serv_li = node_operator[node_operator['BusStopCode'] == node]['ServiceNo']
-        serv_li = serv_li.drop_duplicates().to_list()
-        net.nodes[node]['serv_li'] = ','.join(serv_li)
-        net.nodes[node]['serv_no'] = len(serv_li)
-        
+    # add bus stop, sorted
+    node_code = node_operator.groupby('BusStopCode', sort=True).ngroup().values
+    node_li = np.sort(node_operator['BusStopCode'].unique())
+    serv_lis = _GroupLists(node_code, node_operator['ServiceNo'].values)
+    
+    net.add_nodes_from(
+        (node, {'serv_li': ','.join(serv_li), 'serv_no': len(serv_li)}) 
+        for node, serv_li in zip(node_li, serv_lis)
+    )
+    
     # add bus route
-    # bus route list
-    bus_line = route_data['ServiceNo'].unique().tolist()
+    edge = BusRouteEdges(route_data)
     
-    for serv_ix in bus_line:
-        route = route_data[route_data['ServiceNo'] == serv_ix]
-        route = route.sort_values(by=['Direction', 'StopSequence'])
-        # directions list [1,2] or [1]
-        directions = route['Direction'].unique().tolist()
-        
-        for d_ix in directions:
-            # select one-direction bus line
-            route_dir = route[route['Direction'] == d_ix]
-            route_dir = route_dir.sort_values(by='StopSequence')
-            route_dir = route_dir.reset_index(drop=True)
-            
-            for i in range(route_dir.shape[0]-1):
-                start_node = route_dir.loc[i, 'BusStopCode']
-                end_node = route_dir.loc[i+1, 'BusStopCode']
-                dist = route_dir.loc[i+1, 'Distance'] - route_dir.loc[i, 'Distance']
-                # a new route between two stop node
-                if not net.has_edge(start_node, end_node):
-                    net.add_edge(start_node, end_node)
-                    net.edges[start_node, end_node]['serv_li'] = [serv_ix]
-                    net.edges[start_node, end_node]['distance'] = dist
-                # already existing route
-                else:
-                    serv_li = net.edges[start_node, end_node]['serv_li']
-                    if not (serv_ix in serv_li):
-                        serv_li.append(serv_ix)
-                        net.edges[start_node, end_node]['serv_li'] = serv_li
-     
+    # one edge per stop pair: the distance of the first service, 
+    # and the services passing the edge
+    edge = edge.drop_duplicates(subset=['Source', 'Target', 'ServiceNo'], ignore_index=True)
+    pair = edge.groupby(['Source', 'Target'], sort=False).ngroup().values
+    
+    first = np.unique(pair, return_index=True)[1]
+    serv_lis = _GroupLists(pair, edge['ServiceNo'].values)
+    
+    net.add_edges_from(
+        (u, v, {'serv_li': sl, 'distance': d}) for u, v, d, sl in
+        zip(edge['Source'].values[first], edge['Target'].values[first], 
+            edge['dist'].values[first], serv_lis)
+    )
     # print(len(net.nodes), len(net.edges))
     return net
 # --------------------------------------------------------
@@ -133,15 +118,22 @@ def BusNetAddLoc(net, node_loc):
             net.nodes[node]['lat'] = node_info['geometry'].y.values[0]
     return net
 # --------------------------------------------------------
-def BusNet2NodeEgesPd(net):
+def BusNet2NodeEgesPd(net, path=None, formats=EXPORT_FORMATS):
     '''
     Transfer the bus network (netwrokx.DiGraph object) to nodes and edges (pandas.DataFram)
     to input Gephi.
+        the tables are built in one pass, see "NetNodeTable" and "NetEdgeTable"
     
     Parameters
     ----------
     net : netwrokx.DiGraph
         bus network
+    
+    path : str, optional
+        write the tables to "path" (without extension), see "ExportNetTables"
+    
+    formats : tuple, optional
+        'csv' (Gephi), 'graphml', 'parquet'
 
     Returns
     -------
@@ -151,30 +143,16 @@ def BusNet2NodeEgesPd(net):
         DESCRIPTION.
 
     '''
+    node_pd = NetNodeTable(net, cols=['lat', 'lng', 'serv_no', 'serv_li'])
     
-    node_pd = pd.DataFrame(
-        columns = ['Id', 'lat', 'lng', 'serv_no', 'serv_li']
-    )
-    row = {}
-    for node in net.nodes:
-        row['Id'] = node
-        row['lat'] = net.nodes[node]['lat']
-        row['lng'] = net.nodes[node]['lng']
-        row['serv_no'] = net.nodes[node]['serv_no']
-        row['serv_li'] = net.nodes[node]['serv_li']
-        node_pd = node_pd.append(row, ignore_index=True)
+    edge_pd = NetEdgeTable(net, cols=['distance', 'serv_li'], sep=None)
+    edge_pd.rename(columns={'distance': 'Distance'}, inplace=True)
+    edge_pd['serv_no'] = edge_pd['serv_li'].map(len)
+    edge_pd['serv_li'] = edge_pd['serv_li'].str.join(',')
+    edge_pd = edge_pd[['Source', 'Target', 'Distance', 'serv_no', 'serv_li']]
     
-    edge_pd = pd.DataFrame(
-        columns = ['Source', 'Target', 'Distance', 'serv_no', 'serv_li']
-    )
-    row = {}
-    for (start, end) in net.edges:
-        row['Source'] = start
-        row['Target'] = end
-        row['Distance'] = net.edges[start, end]['distance']
-        row['serv_li'] = ','.join(net.edges[start, end]['serv_li'])
-        row['serv_no'] = len(net.edges[start, end]['serv_li'])
-        edge_pd = edge_pd.append(row, ignore_index=True)
+    if not (path is None):
+        ExportNetTables(node_pd, edge_pd, path, formats=formats, directed=net.is_directed())
     return node_pd, edge_pd
 # --------------------------------------------------------
 def NetProcessing(net):
@@ -254,14 +232,8 @@ def Route2Shp(route_data, bus_stop_loc):
     # drop stop without location info
     route_data.dropna(subset=['geometry'], axis=0, inplace=True)
 
-    # route shapfile, line layer
-    route_shp = gpd.GeoDataFrame(
-        columns = ['Operator', 'ServiceNo', 'Direction', 'StopSequence', 'Distance', 'geometry'],
-        crs = bus_stop_loc.crs
-    )
-    
-    row = {}
-    # one bus line group
+    # route shapfile, line layer, one row per bus line group
+    rows = []
     for group in route_data.groupby(by=['ServiceNo', 'Direction']):
         (_, group) = group
         # the number of stops in one bus line group
@@ -269,6 +241,7 @@ def Route2Shp(route_data, bus_stop_loc):
         group.reset_index(drop=True, inplace=True)
         group.sort_values(by='StopSequence', inplace=True)
 
+        row = {}
         row['Operator'] = group['Operator'][0]
         row['ServiceNo'] = group['ServiceNo'][0]
         row['Direction'] = group['Direction'][0]
@@ -276,7 +249,12 @@ def Route2Shp(route_data, bus_stop_loc):
         row['Distance'] = group['Distance'][n-1] - group['Distance'][0]
         row['geometry'] = LineString(group['geometry'].to_list())
 
-        route_shp = route_shp.append(row, ignore_index=True)
+        rows.append(row)
     
+    # built once
+    route_shp = gpd.GeoDataFrame(rows, 
+        columns = ['Operator', 'ServiceNo', 'Direction', 'StopSequence', 'Distance', 'geometry'],
+        geometry = 'geometry', crs = bus_stop_loc.crs
+    )
     return route_shp
 # =============================================================================
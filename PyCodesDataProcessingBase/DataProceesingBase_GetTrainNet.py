@@ -7,6 +7,8 @@ import networkx as nx
 
 from shapely.geometry import Point
 
+from .DataProcessingBase_NetExport import NetNodeTable, NetEdgeTable, ExportNetTables, EXPORT_FORMATS
+
 
 def ReadTrianStaLocShp(path):
     '''
@@ -309,13 +311,9 @@ def TrainNet2RouteShp(net):
         exd_cols = ['source', 'target', 'geometry']
         cols.extend(exd_cols)
         
-        route = pd.DataFrame(columns=cols)
-    
-        row = {}
-        for col in exd_cols:
-            cols.remove(col)
-        
+        rows = []
         for (source, target) in net.edges:
+            row = {}
             row['source'] = source
             row['target'] = target
             row['lne_c'] = ','.join(net.edges[source, target]['lne_c'])
@@ -327,9 +325,10 @@ def TrainNet2RouteShp(net):
             target_geo = Point(net.nodes[target]['lng'], net.nodes[target]['lat'])
             row['geometry'] = LineString([source_geo, target_geo])
             
-            route = route.append(row, ignore_index=True)
+            rows.append(row)
         
-        route = gpd.GeoDataFrame(route, geometry='geometry')
+        # built once
+        route = gpd.GeoDataFrame(pd.DataFrame(rows, columns=cols), geometry='geometry')
     # - - - - - - - - - - - - - - - - - - - - - 
     return route
 # -----------------------------------------------------------------------------------
@@ -386,8 +385,7 @@ def TrainNet2LineShp(net, route):
     
     from shapely.geometry import LineString, Point
     
-    line_shp = gpd.GeoDataFrame(
-        columns = ['sublne_c', 'lne_c', 'lne_n', 'stn_seq', 'geometry'])
+    rows = []
     
     # -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  
     def generate_row(sub_graph, whole_graph):
@@ -409,30 +407,37 @@ def TrainNet2LineShp(net, route):
             subgraph1 = nx.algorithms.cycles.find_cycle(graph)
             subgraph1 = graph.edge_subgraph(subgraph1)
             
-            row = generate_row(subgraph1, net)
-            line_shp = line_shp.append(row, ignore_index=True)
+            rows.append(generate_row(subgraph1, net))
             
             subgraph2 = graph.copy()
             subgraph2.remove_edges_from(subgraph1.edges)
             subgraph2.remove_nodes_from(list(nx.isolates(subgraph2)))
             
-            row = generate_row(subgraph2, net)
-            line_shp = line_shp.append(row, ignore_index=True)
+            rows.append(generate_row(subgraph2, net))
         else:
-            row = generate_row(graph, net)
-            line_shp = line_shp.append(row, ignore_index=True)
-            
+            rows.append(generate_row(graph, net))
+    
+    # built once
+    line_shp = gpd.GeoDataFrame(pd.DataFrame(rows, 
+        columns = ['sublne_c', 'lne_c', 'lne_n', 'stn_seq', 'geometry']), geometry='geometry')
     return line_shp
 # ------------------------------------------------------------------------------------------------
-def TrainNet2NodeEges(net):
+def TrainNet2NodeEges(net, path=None, formats=EXPORT_FORMATS):
     '''
     Transfer the bus network (netwrokx.DiGraph object) to nodes and edges (pandas.DataFram)
     to input Gephi.
+        the tables are built in one pass, see "NetNodeTable" and "NetEdgeTable"
     
     Parameters
     ----------
     net : netwrokx.DiGraph
         bus network
+    
+    path : str, optional
+        write the tables to "path" (without extension), see "ExportNetTables"
+    
+    formats : tuple, optional
+        'csv' (Gephi), 'graphml', 'parquet'
 
     Returns
     -------
@@ -442,40 +447,12 @@ def TrainNet2NodeEges(net):
         DESCRIPTION.
 
     '''
-    cols = ['Id', 'stn_c', 'stn_n', 'lne_c', 'lne_n', 'lne_num', 'sublne_c', 'sublne_num', 'lng', 'lat']
-    node_pd = pd.DataFrame(columns = cols)
-    
-    cols.remove('Id')
-    row = {}
-    for node in net.nodes:
-        row['Id'] = node
-        for col in cols:
-            e = net.nodes[node][col]
-            if isinstance(e, list):
-                row[col] = ','.join(e)
-            else:
-                row[col] = e
-
-        node_pd = node_pd.append(row, ignore_index=True)
-    
+    node_pd = NetNodeTable(net, 
+        cols=['stn_c', 'stn_n', 'lne_c', 'lne_n', 'lne_num', 'sublne_c', 'sublne_num', 'lng', 'lat'])
     
-    cols = ['Source', 'Target', 'sublne_c', 'lne_c', 'lne_n', 'lne_num']
-    edge_pd = pd.DataFrame(columns = cols)
+    edge_pd = NetEdgeTable(net, cols=['sublne_c', 'lne_c', 'lne_n', 'lne_num'])
     
-    cols.remove('Source')
-    cols.remove('Target')
-    row = {}
-    for (start, end) in net.edges:
-        row['Source'] = start
-        row['Target'] = end
-
-        for col in cols:
-            e = net.edges[start, end][col]
-            if isinstance(e, list):
-                row[col] = ','.join(e)
-            else:
-                row[col] = e
-        
-        edge_pd = edge_pd.append(row, ignore_index=True)
+    if not (path is None):
+        ExportNetTables(node_pd, edge_pd, path, formats=formats, directed=net.is_directed())
     return node_pd, edge_pd
 # ======================================================================================
\ No newline at end of file
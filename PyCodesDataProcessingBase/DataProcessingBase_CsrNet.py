@@ -0,0 +1,454 @@
+import os
+import json
+
+import numpy as np
+import networkx as nx
+
+
+# the attribute holding the services (bus) / lines (train) of an edge or a node,
+# the first one found is used, see "CsrNet.FromNetworkx"
+SERV_ATTRS = ['serv_li', 'serv', 'lne_c']
+
+
+def _AttrKind(values):
+    '''
+    the storage kind of the attribute values (None: missing)
+        'num'  : numbers, a float64 / int64 array
+        'str'  : strings, codes of a label table
+        'list' : lists of strings, coded, with the offsets of each element
+    '''
+    kinds = set()
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, (list, tuple, set)):
+            kinds.add('list')
+        elif isinstance(v, (bool, int, float, np.integer, np.floating)):
+            kinds.add('num')
+        else:
+            kinds.add('str')
+
+    if len(kinds) == 0:
+        return None
+    if 'list' in kinds:
+        return 'list'
+    if 'str' in kinds:
+        return 'str'
+    return 'num'
+# ----------------------------------------------------------------------------
+def _EncodeAttr(values, kind, order):
+    '''
+    encode the attribute values of the elements (in the order "order")
+
+    Returns
+    -------
+    arrays : dict
+        'data' (num), 'codes' + 'labels' (str), 'ptr' + 'codes' + 'labels' (list)
+    '''
+    values = [values[i] for i in order]
+
+    if kind == 'num':
+        is_int = all(isinstance(v, (bool, int, np.integer)) for v in values)
+        data = np.array([v for v in values], dtype='int64') if is_int else \
+               np.array([np.nan if v is None else v for v in values], dtype='float64')
+        return {'data': data}
+
+    if kind == 'str':
+        labels = sorted(set(str(v) for v in values if v is not None))
+        lookup = {s: i for i, s in enumerate(labels)}
+        codes = np.array([-1 if v is None else lookup[str(v)] for v in values], dtype='int32')
+        return {'codes': codes, 'labels': np.array(labels, dtype='U')}
+
+    # list: keep the order of each list
+    lists = [[] if v is None else [str(x) for x in (v if isinstance(v, (list, tuple, set)) else [v])]
+             for v in values]
+    labels = sorted(set(x for l in lists for x in l))
+    lookup = {s: i for i, s in enumerate(labels)}
+
+    ptr = np.zeros(len(lists) + 1, dtype='int64')
+    ptr[1:] = np.cumsum([len(l) for l in lists])
+    codes = np.array([lookup[x] for l in lists for x in l], dtype='int32')
+    return {'ptr': ptr, 'codes': codes, 'labels': np.array(labels, dtype='U')}
+# ----------------------------------------------------------------------------
+def MinArcMatrix(src, dst, data, n):
+    '''
+    the sparse adjacency matrix of the arcs, the parallel arcs keep the
+    lowest weight
+
+    Parameters
+    ----------
+    src, dst : numpy.ndarray
+        the integer ids of the source and target nodes.
+    data : numpy.ndarray
+        the weights.
+    n : int
+        the number of nodes.
+
+    Returns
+    -------
+    mat : scipy.sparse.csr_matrix
+        DESCRIPTION.
+
+    '''
+    from scipy.sparse import csr_matrix
+
+    order = np.lexsort((dst, src))
+    src, dst, data = src[order], dst[order], np.asarray(data, dtype='float64')[order]
+
+    if src.shape[0] > 0:
+        first = np.ones(src.shape[0], dtype=bool)
+        first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        starts = np.flatnonzero(first)
+        src, dst, data = src[starts], dst[starts], np.minimum.reduceat(data, starts)
+
+    return csr_matrix((data, (src, dst)), shape=(n, n))
+# ============================================================================
+
+
+
+
+class CsrNet():
+    '''
+    Array-backed (CSR) graph of the bus / train networks
+
+    The nodes are the integers 0, ..., n-1 ("labels" gives the bus stop codes
+    or station ids). The arcs of node i are "indices[indptr[i]:indptr[i+1]]",
+    an undirected edge is stored as two arcs, and the parallel edges of a
+    multigraph as parallel arcs.
+
+    The node and edge attributes are arrays, aligned with the nodes and the
+    arcs: numbers as float / int arrays, strings as integer codes of a label
+    table, and lists of strings (e.g. "serv_li", "lne_c") as the codes of
+    each element with their offsets ('ptr'). The service (line) lists are
+    one of these coded lists, see "ServiceMask".
+
+    "Save" writes one .npy file per array, "Load" maps them in memory.
+
+    Example
+    -------
+    net = BusStopRoute2Net(stop, route)
+    csr = CsrNet.FromNetworkx(net)
+    csr.Save('bus_net_csr')
+    csr = CsrNet.Load('bus_net_csr')
+    '''
+    def __init__(self, arrays, meta):
+        '''
+
+        Parameters
+        ----------
+        arrays : dict
+            name -> numpy.ndarray, see "FromNetworkx".
+        meta : dict
+            'directed', 'multigraph', 'serv_attr',
+            'node_attrs' / 'edge_attrs' (name -> kind).
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.arrays = arrays
+        self.meta = meta
+
+        self._index = None
+        return None
+    # ------------------------------------------------------------------------
+    @property
+    def labels(self):
+        return self.arrays['labels']
+    # ------------------------------------------------------------------------
+    @property
+    def indptr(self):
+        return self.arrays['indptr']
+    # ------------------------------------------------------------------------
+    @property
+    def indices(self):
+        return self.arrays['indices']
+    # ------------------------------------------------------------------------
+    @property
+    def n_nodes(self):
+        return self.indptr.shape[0] - 1
+    # ------------------------------------------------------------------------
+    @property
+    def n_arcs(self):
+        return self.indices.shape[0]
+    # ------------------------------------------------------------------------
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+    # ------------------------------------------------------------------------
+    @classmethod
+    def FromNetworkx(cls, net, serv_attr=None):
+        '''
+        convert a networkx graph (e.g. from "BusStopRoute2Net" or
+        "TrainRoute2Net") into a CSR graph, all the node and edge attributes
+        are kept
+
+        Parameters
+        ----------
+        net : networkx.Graph, DiGraph, MultiGraph or MultiDiGraph
+            DESCRIPTION.
+        serv_attr : str, optional
+            the edge attribute of the services. The default is None, the
+            first of "SERV_ATTRS" found, else the multigraph keys.
+
+        Returns
+        -------
+        csr : CsrNet
+            DESCRIPTION.
+
+        '''
+        directed = net.is_directed()
+        multigraph = net.is_multigraph()
+
+        labels = list(net.nodes)
+        lookup = {n: i for i, n in enumerate(labels)}
+
+        # arcs: (source, target, key, attributes)
+        if multigraph:
+            edges = list(net.edges(keys=True, data=True))
+        else:
+            edges = [(u, v, None, d) for u, v, d in net.edges(data=True)]
+
+        if not directed:
+            # both directions, a self loop once
+            edges = edges + [(v, u, k, d) for u, v, k, d in edges if u != v]
+
+        src = np.array([lookup[e[0]] for e in edges], dtype='int64')
+        dst = np.array([lookup[e[1]] for e in edges], dtype='int64')
+
+        order = np.lexsort((dst, src))
+
+        indptr = np.zeros(len(labels) + 1, dtype='int64')
+        indptr[1:] = np.cumsum(np.bincount(src, minlength=len(labels)))
+
+        arrays = {'labels'  : np.array([str(n) for n in labels], dtype='U'),
+                  'indptr'  : indptr,
+                  'indices' : dst[order].astype('int32')}
+
+        meta = {'directed'   : directed,
+                'multigraph' : multigraph,
+                'label_type' : 'int' if all(isinstance(n, (int, np.integer)) for n in labels) else 'str',
+                'node_attrs' : {},
+                'edge_attrs' : {}}
+
+        # node attributes
+        node_data = [net.nodes[n] for n in labels]
+        for name in sorted(set(k for d in node_data for k in d.keys())):
+            values = [d.get(name) for d in node_data]
+            kind = _AttrKind(values)
+            if kind is None:
+                continue
+            meta['node_attrs'][name] = kind
+            for k, a in _EncodeAttr(values, kind, np.arange(len(values))).items():
+                arrays['node.{0}.{1}'.format(name, k)] = a
+
+        # edge attributes, and the multigraph keys
+        edge_data = [e[3] for e in edges]
+        if multigraph:
+            edge_data = [dict(d, __key__=e[2]) for d, e in zip(edge_data, edges)]
+
+        for name in sorted(set(k for d in edge_data for k in d.keys())):
+            values = [d.get(name) for d in edge_data]
+            kind = _AttrKind(values)
+            if kind is None:
+                continue
+            meta['edge_attrs'][name] = kind
+            for k, a in _EncodeAttr(values, kind, order).items():
+                arrays['edge.{0}.{1}'.format(name, k)] = a
+
+        if serv_attr is None:
+            # else the keys of a multigraph, e.g. the line codes of "TrainRoute2Net"
+            serv_attr = next((a for a in SERV_ATTRS if a in meta['edge_attrs']),
+                             '__key__' if multigraph else None)
+        meta['serv_attr'] = serv_attr
+
+        return cls(arrays, meta)
+    # ------------------------------------------------------------------------
+    def _Decode(self, prefix, name):
+        '''
+        the python values of an attribute (numbers, strings or lists)
+        '''
+        kind = self.meta[prefix + '_attrs'][name]
+        key = '{0}.{1}.'.format(prefix, name)
+
+        if kind == 'num':
+            data = np.asarray(self.arrays[key + 'data'])
+            return [None if (isinstance(v, float) and np.isnan(v)) else v for v in data.tolist()]
+
+        labels = np.asarray(self.arrays[key + 'labels']).tolist()
+        codes = np.asarray(self.arrays[key + 'codes'])
+
+        if kind == 'str':
+            return [None if c < 0 else labels[c] for c in codes.tolist()]
+
+        ptr = np.asarray(self.arrays[key + 'ptr'])
+        codes = codes.tolist()
+        return [[labels[c] for c in codes[ptr[i]:ptr[i+1]]] for i in range(ptr.shape[0] - 1)]
+    # ------------------------------------------------------------------------
+    def ToNetworkx(self):
+        '''
+        convert back to the networkx graph of "FromNetworkx"
+
+        Returns
+        -------
+        net : networkx.Graph, DiGraph, MultiGraph or MultiDiGraph
+            DESCRIPTION.
+
+        '''
+        if self.meta['multigraph']:
+            net = nx.MultiDiGraph() if self.meta['directed'] else nx.MultiGraph()
+        else:
+            net = nx.DiGraph() if self.meta['directed'] else nx.Graph()
+
+        labels = self.labels.tolist()
+        if self.meta['label_type'] == 'int':
+            labels = [int(n) for n in labels]
+
+        node_attrs = {name: self._Decode('node', name) for name in self.meta['node_attrs']}
+        net.add_nodes_from(
+            (n, {name: values[i] for name, values in node_attrs.items() if not (values[i] is None)})
+            for i, n in enumerate(labels)
+        )
+
+        src = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        dst = np.asarray(self.indices)
+
+        # the arcs of an undirected edge: one of the two directions
+        arcs = np.arange(self.n_arcs)
+        if not self.meta['directed']:
+            arcs = arcs[src <= dst]
+
+        edge_attrs = {name: self._Decode('edge', name) for name in self.meta['edge_attrs']}
+
+        for e in arcs.tolist():
+            d = {name: values[e] for name, values in edge_attrs.items() if not (values[e] is None)}
+            u, v = labels[src[e]], labels[dst[e]]
+            if self.meta['multigraph']:
+                net.add_edge(u, v, d.pop('__key__', None), **d)
+            else:
+                net.add_edge(u, v, **d)
+        return net
+    # ------------------------------------------------------------------------
+    def NodeIndex(self, label):
+        '''
+        the integer id of the node "label" (bus stop code, station id)
+        '''
+        if self._index is None:
+            self._index = {n: i for i, n in enumerate(self.labels.tolist())}
+        return self._index[str(label)]
+    # ------------------------------------------------------------------------
+    def Neighbors(self, i):
+        '''
+        the integer ids of the successors of the node "i"
+        '''
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+    # ------------------------------------------------------------------------
+    def EdgeAttr(self, name):
+        '''
+        the values of an edge attribute for every arc: an array of numbers,
+        an array of strings, or the (codes, ptr, labels) of the lists
+        '''
+        kind = self.meta['edge_attrs'][name]
+        key = 'edge.{0}.'.format(name)
+
+        if kind == 'num':
+            return self.arrays[key + 'data']
+        if kind == 'str':
+            labels = np.append(self.arrays[key + 'labels'], '')
+            return labels[self.arrays[key + 'codes']]
+        return self.arrays[key + 'codes'], self.arrays[key + 'ptr'], self.arrays[key + 'labels']
+    # ------------------------------------------------------------------------
+    def ServiceMask(self, serv, prefix='edge'):
+        '''
+        the arcs (or nodes) served by the service "serv" (bus service number
+        or train line code)
+
+        Parameters
+        ----------
+        serv : str
+            DESCRIPTION.
+        prefix : str, optional
+            'edge' or 'node'. The default is 'edge'.
+
+        Returns
+        -------
+        mask : numpy.ndarray (bool)
+            one value per arc (or node).
+
+        '''
+        name = self.meta['serv_attr'] if prefix == 'edge' else \
+               next(a for a in SERV_ATTRS if a in self.meta['node_attrs'])
+        key = '{0}.{1}.'.format(prefix, name)
+
+        labels = self.arrays[key + 'labels']
+        n = self.n_arcs if prefix == 'edge' else self.n_nodes
+
+        code = np.searchsorted(labels, str(serv))
+        if code >= labels.shape[0] or labels[code] != str(serv):
+            return np.zeros(n, dtype=bool)
+
+        if self.meta[prefix + '_attrs'][name] == 'str':
+            return np.asarray(self.arrays[key + 'codes']) == code
+
+        ptr = self.arrays[key + 'ptr']
+        # the element of every code
+        owner = np.repeat(np.arange(n), np.diff(ptr))
+        return np.bincount(owner[np.asarray(self.arrays[key + 'codes']) == code], minlength=n) > 0
+    # ------------------------------------------------------------------------
+    def ToScipy(self, weight=None, mask=None):
+        '''
+        the sparse adjacency matrix, the parallel arcs keep the lowest weight
+
+        Parameters
+        ----------
+        weight : str, optional
+            a numeric edge attribute, e.g. 'dist'. The default is None, 1 per arc.
+        mask : numpy.ndarray (bool), optional
+            the arcs to keep, e.g. "ServiceMask". The default is None, all.
+
+        Returns
+        -------
+        mat : scipy.sparse.csr_matrix
+            DESCRIPTION.
+
+        '''
+        src = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        dst = np.asarray(self.indices)
+        data = np.ones(self.n_arcs) if weight is None else \
+               np.asarray(self.EdgeAttr(weight), dtype='float64')
+
+        if not (mask is None):
+            src, dst, data = src[mask], dst[mask], data[mask]
+
+        return MinArcMatrix(src, dst, data, self.n_nodes)
+    # ------------------------------------------------------------------------
+    def Save(self, path):
+        '''
+        write the arrays (one .npy file each) and "meta.json" to the folder "path"
+        '''
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        for name, a in self.arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.asarray(a))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        return None
+    # ------------------------------------------------------------------------
+    @classmethod
+    def Load(cls, path, mmap=True):
+        '''
+        read a CSR graph written by "Save", the arrays are memory-mapped
+        (read only) if "mmap"
+        '''
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        arrays = {}
+        for fn in os.listdir(path):
+            if fn.endswith('.npy'):
+                arrays[fn[:-4]] = np.load(os.path.join(path, fn), mmap_mode='r' if mmap else None)
+        return cls(arrays, meta)
+# ============================================================================
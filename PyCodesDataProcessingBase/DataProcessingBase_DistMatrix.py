@@ -0,0 +1,369 @@
+import os
+import json
+import time
+import functools
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .DataProcessingBase_CsrNet import MinArcMatrix
+
+
+# the mean radius of the earth, km (the unit of the "dist" of the bus routes)
+EARTH_RADIUS_KM = 6371.0088
+
+# the sources of one Dijkstra run of a worker
+SOURCE_BLOCK = 128
+
+# the adjacency matrix of the workers, set by "_InitWorker"
+_WORKER_MAT = None
+
+
+def Haversine(lng1, lat1, lng2, lat2):
+    '''
+    the great-circle distance (km) between the points (vectorized)
+    '''
+    lng1, lat1, lng2, lat2 = map(np.radians, (lng1, lat1, lng2, lat2))
+
+    a = np.sin((lat2 - lat1) / 2.) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2.) ** 2
+    return 2. * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+# ----------------------------------------------------------------------------
+def LngLat2XY(lng, lat, lat0=1.35):
+    '''
+    the local planar coordinates (km) of the points, around the latitude
+    "lat0" (Singapore), for the walking distances
+    '''
+    x = np.radians(np.asarray(lng, dtype='float64')) * EARTH_RADIUS_KM * np.cos(np.radians(lat0))
+    y = np.radians(np.asarray(lat, dtype='float64')) * EARTH_RADIUS_KM
+    return np.column_stack([x, y])
+# ----------------------------------------------------------------------------
+def _NodeLngLat(csr, crs):
+    '''
+    the longitudes and latitudes (EPSG:4326) of the nodes of a "CsrNet",
+    whose "lng" / "lat" attributes are the x / y of the CRS "crs"
+    '''
+    if crs is None:
+        raise ValueError('the CRS of the node coordinates is required, e.g. "epsg:3414"')
+
+    x = np.asarray(csr.arrays['node.lng.data'], dtype='float64')
+    y = np.asarray(csr.arrays['node.lat.data'], dtype='float64')
+
+    import geopandas as gpd
+    pts = gpd.GeoSeries(gpd.points_from_xy(x, y), crs=crs).to_crs(4326)
+    return pts.x.values, pts.y.values
+# ----------------------------------------------------------------------------
+def _CsrArcs(csr):
+    '''
+    the (source, target) integer ids of the arcs of a "CsrNet"
+    '''
+    src = np.repeat(np.arange(csr.n_nodes), np.diff(csr.indptr))
+    return src, np.asarray(csr.indices, dtype='int64')
+# ============================================================================
+
+
+
+
+def BusDistGraph(bus_csr, weight='dist'):
+    '''
+    the weighted adjacency matrix of the bus network
+
+    Parameters
+    ----------
+    bus_csr : CsrNet
+        from "CsrNet.FromNetworkx(BusStopRoute2Net(...))".
+    weight : str, optional
+        the edge distance (km). The default is 'dist'.
+
+    Returns
+    -------
+    mat : scipy.sparse.csr_matrix
+        DESCRIPTION.
+    labels : numpy.ndarray
+        the bus stop codes of the rows / columns.
+
+    '''
+    return bus_csr.ToScipy(weight), np.asarray(bus_csr.labels)
+# ----------------------------------------------------------------------------
+def BusTrainDistGraph(bus_csr, train_csr, crs='epsg:3414', weight='dist', walk_km=0.3,
+                      walk_factor=1., train_prefix='STN_'):
+    '''
+    the weighted adjacency matrix of the bus and train networks, linked by
+    the walks between the stations and the bus stops within "walk_km"
+
+    The train edges have no distance in "TrainRoute2Net", the great-circle
+    distance between the stations is used. The node coordinates are those
+    of the stop / station layers, projected to EPSG:4326 first.
+
+    Parameters
+    ----------
+    bus_csr : CsrNet
+        from "CsrNet.FromNetworkx(BusStopRoute2Net(...))".
+    train_csr : CsrNet
+        from "CsrNet.FromNetworkx(TrainRoute2Net(...))".
+    crs : str, optional
+        the CRS of the "lng" / "lat" node attributes of both networks. The
+        default is 'epsg:3414' (the layers of "ReadBusStopLocShp" and
+        "ReadTrianStaLocShp"), 'epsg:4326' for longitudes / latitudes.
+    weight : str, optional
+        the edge distance of the bus network (km). The default is 'dist'.
+    walk_km : float, optional
+        the longest walk (km). The default is 0.3.
+    walk_factor : float, optional
+        the weight of a walked km. The default is 1.
+    train_prefix : str, optional
+        the prefix of the station labels, they do not clash with the bus
+        stop codes. The default is 'STN_'.
+
+    Returns
+    -------
+    mat : scipy.sparse.csr_matrix
+        the bus stops first, then the stations.
+    labels : numpy.ndarray
+        the bus stop codes and the prefixed station ids.
+
+    '''
+    from scipy.spatial import cKDTree
+
+    n_bus, n_train = bus_csr.n_nodes, train_csr.n_nodes
+
+    # bus arcs
+    bus_src, bus_dst = _CsrArcs(bus_csr)
+    bus_w = np.asarray(bus_csr.EdgeAttr(weight), dtype='float64')
+
+    bus_lng, bus_lat = _NodeLngLat(bus_csr, crs)
+    lng, lat = _NodeLngLat(train_csr, crs)
+
+    # train arcs, with the distance between the stations
+    train_src, train_dst = _CsrArcs(train_csr)
+    train_w = Haversine(lng[train_src], lat[train_src], lng[train_dst], lat[train_dst])
+
+    # walks, both directions
+    walk = cKDTree(LngLat2XY(lng, lat)).sparse_distance_matrix(
+        cKDTree(LngLat2XY(bus_lng, bus_lat)), walk_km, output_type='coo_matrix')
+    walk_stn, walk_stop, walk_w = walk.row + n_bus, walk.col, walk.data * walk_factor
+
+    src = np.concatenate([bus_src, train_src + n_bus, walk_stn, walk_stop])
+    dst = np.concatenate([bus_dst, train_dst + n_bus, walk_stop, walk_stn])
+    data = np.concatenate([bus_w, train_w, walk_w, walk_w])
+
+    labels = np.concatenate([np.asarray(bus_csr.labels),
+                             np.char.add(train_prefix, np.asarray(train_csr.labels))])
+
+    return MinArcMatrix(src, dst, data, n_bus + n_train), labels
+# ============================================================================
+
+
+
+
+def _InitWorker(mat):
+    global _WORKER_MAT
+    _WORKER_MAT = mat
+    return None
+# ----------------------------------------------------------------------------
+def _DijkstraBlock(sources, path=None, row0=0, directed=True, limit=np.inf, dtype='float32'):
+    '''
+    the distances from "sources" (one multi-source Dijkstra), written to the
+    rows "row0, ..." of the .npy "path", or returned
+    '''
+    from scipy.sparse.csgraph import dijkstra
+
+    dist = dijkstra(_WORKER_MAT, directed=directed, indices=sources, limit=limit).astype(dtype)
+
+    if path is None:
+        return dist
+
+    out = np.load(path, mmap_mode='r+')
+    out[row0:row0 + len(sources)] = dist
+    out.flush()
+    del out
+    return None
+# ----------------------------------------------------------------------------
+def DistMatrix(mat, labels, path=None, sources=None, directed=True, limit=np.inf,
+               n_jobs=None, block=SOURCE_BLOCK, dtype='float32', progress=False):
+    '''
+    the network distances between all the nodes (or from "sources"),
+    Dijkstra by blocks of sources on a process pool
+
+    With "path", the matrix is written to the memory-mapped "<path>.npy"
+    by the workers, with its labels in "<path>.json", see "DistLookup".
+
+    Parameters
+    ----------
+    mat : scipy.sparse.csr_matrix
+        from "BusDistGraph" or "BusTrainDistGraph".
+    labels : numpy.ndarray
+        the nodes of the rows / columns of "mat".
+    path : str, optional
+        the file (without extension). The default is None, in memory.
+    sources : list, optional
+        the labels of the rows. The default is None, all the nodes.
+    directed : bool, optional
+        The default is True.
+    limit : float, optional
+        the longest distance searched, the others are inf. The default is inf.
+    n_jobs : int, optional
+        the processes. The default is None, the number of CPUs.
+    block : int, optional
+        the sources of one Dijkstra run. The default is SOURCE_BLOCK.
+    dtype : str, optional
+        The default is 'float32'.
+    progress : bool, optional
+        print the finished blocks. The default is False.
+
+    Returns
+    -------
+    dist : numpy.ndarray or numpy.memmap
+        (sources, nodes), inf if not reachable.
+
+    '''
+    labels = np.asarray(labels).astype('U')
+    lookup = {n: i for i, n in enumerate(labels.tolist())}
+
+    src_ix = np.arange(len(labels)) if sources is None else \
+             np.array([lookup[str(s)] for s in sources], dtype='int64')
+    src_labels = labels[src_ix]
+
+    if not (path is None):
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        # the header and the size of the file, the rows are written by the workers
+        np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=dtype,
+                                  shape=(len(src_ix), len(labels))).flush()
+
+        with open(path + '.json', 'w') as f:
+            json.dump({'sources': src_labels.tolist(), 'targets': labels.tolist()}, f)
+
+    starts = list(range(0, len(src_ix), block))
+    func = functools.partial(_DijkstraBlock, path=None if path is None else path + '.npy',
+                             directed=directed, limit=limit, dtype=dtype)
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_InitWorker, initargs=(mat,)) as executor:
+        futures = [executor.submit(func, src_ix[s:s + block], row0=s) for s in starts]
+
+        blocks = []
+        for i, future in enumerate(futures):
+            blocks.append(future.result())
+            if progress:
+                print('[ {0} ] {1}/{2} blocks'.format(time.ctime(), i + 1, len(futures)), flush=True)
+
+    if path is None:
+        if len(blocks) == 0:
+            return np.zeros((0, len(labels)), dtype=dtype)
+        return np.vstack(blocks)
+
+    return np.load(path + '.npy', mmap_mode='r')
+# ============================================================================
+
+
+
+
+class DistLookup():
+    '''
+    Stop-to-stop network distances of a matrix written by "DistMatrix"
+
+    The matrix is memory-mapped, only the rows looked up are read.
+
+    Example
+    -------
+    mat, labels = BusDistGraph(CsrNet.FromNetworkx(BusStopRoute2Net(stop, route)))
+    DistMatrix(mat, labels, path='bus_dist')
+    lookup = DistLookup.Open('bus_dist')
+    odtrip = lookup.JoinODTrip(GetODTrip(path))
+    '''
+    def __init__(self, path):
+        '''
+
+        Parameters
+        ----------
+        path : str
+            the file of "DistMatrix" (without extension).
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.path = path
+        self.dist = np.load(path + '.npy', mmap_mode='r')
+
+        with open(path + '.json', 'r') as f:
+            meta = json.load(f)
+
+        self.src_index = pd.Index(meta['sources'])
+        self.dst_index = pd.Index(meta['targets'])
+        return None
+    # ------------------------------------------------------------------------
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def Open(cls, path):
+        '''
+        the lookup of "path", opened once per process
+        '''
+        return cls(path)
+    # ------------------------------------------------------------------------
+    @functools.lru_cache(maxsize=2**16)
+    def Dist(self, o, d):
+        '''
+        the network distance from the stop "o" to the stop "d", nan if one
+        is not in the matrix, inf if not reachable
+        '''
+        i, j = self.src_index.get_indexer([str(o)])[0], self.dst_index.get_indexer([str(d)])[0]
+        if i < 0 or j < 0:
+            return np.nan
+        return float(self.dist[i, j])
+    # ------------------------------------------------------------------------
+    def Lookup(self, o, d):
+        '''
+        the network distances of the stops "o" to the stops "d" (vectorized)
+
+        Parameters
+        ----------
+        o, d : list-like
+            the labels, e.g. the bus stop codes.
+
+        Returns
+        -------
+        dist : numpy.ndarray (float64)
+            nan if a stop is not in the matrix, inf if not reachable.
+
+        '''
+        i = self.src_index.get_indexer(pd.Index(o).astype(str))
+        j = self.dst_index.get_indexer(pd.Index(d).astype(str))
+        found = (i >= 0) & (j >= 0)
+
+        dist = np.full(len(i), np.nan)
+        if found.any():
+            # read the rows in order
+            order = np.lexsort((j[found], i[found]))
+            rows = np.flatnonzero(found)[order]
+            dist[rows] = self.dist[i[rows], j[rows]]
+        return dist
+    # ------------------------------------------------------------------------
+    def JoinODTrip(self, odtrip, col='dist', o_col='O_BusStopCode', d_col='D_BusStopCode'):
+        '''
+        add the network distance of the OD pairs of "GetODTrip"
+
+        Parameters
+        ----------
+        odtrip : pandas.DataFrame
+            DESCRIPTION.
+        col : str, optional
+            the new column. The default is 'dist'.
+        o_col, d_col : str, optional
+            the stop columns. The default is 'O_BusStopCode', 'D_BusStopCode'.
+
+        Returns
+        -------
+        odtrip : pandas.DataFrame
+            DESCRIPTION.
+
+        '''
+        odtrip = odtrip.copy()
+        odtrip[col] = self.Lookup(odtrip[o_col].values, odtrip[d_col].values)
+        return odtrip
+# ============================================================================
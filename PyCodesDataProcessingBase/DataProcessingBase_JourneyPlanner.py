@@ -0,0 +1,558 @@
+import numpy as np
+import pandas as pd
+
+from .DataProcessingBase_DistMatrix import Haversine, LngLat2XY
+
+
+# the speeds (km/h) and the waiting time at boarding (min) of the modes
+SPEED_KMH = {'bus': 20., 'train': 40., 'walk': 4.8}
+WAIT_MIN = {'bus': 5., 'train': 3.}
+
+# the "infinite" segment offset of the prefix minimum along the routes (min)
+_SEG_OFFSET = 1e6
+
+# the ways a stop is reached in a round, see "JourneyPlanner._Rounds"
+_SRC_NONE, _SRC_RIDE, _SRC_WALK, _SRC_ORIGIN = 0, 1, 2, 3
+
+
+def _SegArgMin(values, starts):
+    '''
+    the minimum of the column groups starting at "starts" (axis 1), and the
+    column of each minimum
+    '''
+    vmin = np.minimum.reduceat(values, starts, axis=1)
+
+    counts = np.diff(np.append(starts, values.shape[1]))
+    is_min = values == np.repeat(vmin, counts, axis=1)
+
+    cols = np.where(is_min, np.arange(values.shape[1]), -1)
+    return vmin, np.maximum.reduceat(cols, starts, axis=1)
+# ----------------------------------------------------------------------------
+def _BusPatterns(stop, route):
+    '''
+    the stop sequences of the bus routes, one per (ServiceNo, Direction)
+
+    Returns
+    -------
+    pattern : pandas.DataFrame
+        columns: 'name', 'mode', 'stop', 'dist' (cumulative, km), sorted by
+        pattern and sequence
+    '''
+    route = route[route['BusStopCode'].isin(stop['BusStopCode'])]
+    route = route.sort_values(by=['ServiceNo', 'Direction', 'StopSequence'], kind='stable')
+
+    name = route['ServiceNo'].astype(str) + '_' + route['Direction'].astype(str)
+
+    # a missing distance takes the former one, the distance never decreases
+    dist = route['Distance'].astype(float).groupby(name.values).transform(
+        lambda x: x.ffill().fillna(0.).cummax())
+
+    return pd.DataFrame({'name': name.values, 'mode': 'bus',
+                         'stop': route['BusStopCode'].astype(str).values,
+                         'dist': dist.values - dist.groupby(name.values).transform('min').values})
+# ----------------------------------------------------------------------------
+def _TrainPatterns(stn, route, train_prefix):
+    '''
+    the station sequences of the train sublines, both directions, with the
+    great-circle distances between the stations
+    '''
+    route = route.merge(right=stn[['stn_n', 'id', 'lng', 'lat']], on='stn_n', how='inner')
+    route = route.sort_values(by=['sublne_c', 'sublne_seq'], kind='stable')
+
+    pattern_li = []
+    for sublne_c, group in route.groupby('sublne_c', sort=True):
+        for direc, group in [('1', group), ('2', group.iloc[::-1])]:
+            lng, lat = group['lng'].values, group['lat'].values
+            dist = np.concatenate([[0.], np.cumsum(Haversine(lng[:-1], lat[:-1], lng[1:], lat[1:]))])
+
+            pattern_li.append(pd.DataFrame({'name': '{0}_{1}'.format(sublne_c, direc), 'mode': 'train',
+                                            'stop': train_prefix + group['id'].astype(str).values,
+                                            'dist': dist}))
+    return pd.concat(pattern_li, ignore_index=True)
+# ============================================================================
+
+
+
+
+class JourneyPlanner():
+    '''
+    Journey planner over the bus and train routes (RAPTOR, by rounds)
+
+    The routes (bus service directions and train sublines) are flat arrays of
+    stops with their cumulative in-vehicle times. The stops within walking
+    distance (bus stops and stations) are linked through a KD-tree. Round k
+    gives the shortest journeys of k rides (k - 1 transfers): every route is
+    scanned at once by a prefix minimum along its stops, for a batch of
+    origins, then one walk is added.
+
+    There are no timetables, a boarding costs the waiting time of its mode
+    ("WAIT_MIN") plus "transfer_min" after the first ride, and a ride its
+    distance over the speed of its mode ("SPEED_KMH"). The fastest journey is
+    the best of the rounds, the least-transfer one the first round reaching
+    the destination.
+
+    The stops are the bus stop codes, and the station ids prefixed by
+    "train_prefix" (e.g. 'STN_00012').
+
+    Example
+    -------
+    planner = JourneyPlanner.FromRoutes(bus_stop, bus_route, train_stn, train_route)
+    planner.Query('01012', '17009')
+    planner.QueryMany(odtrip['O_BusStopCode'], odtrip['D_BusStopCode'])
+    seg_vol, walk_vol = planner.AssignODTrip(odtrip, 'WD_total')
+    '''
+    def __init__(self, labels, pat_ptr, pat_name, pat_mode, entry_stop, entry_time,
+                 walk_src, walk_dst, walk_time, max_rides=4, transfer_min=2.):
+        '''
+
+        Parameters
+        ----------
+        labels : numpy.ndarray
+            the stops.
+        pat_ptr : numpy.ndarray
+            the first entry of each route, and the number of entries.
+        pat_name, pat_mode : numpy.ndarray
+            the name ('<service>_<direction>') and the mode of each route.
+        entry_stop, entry_time : numpy.ndarray
+            the stop and the cumulative in-vehicle time (min) of each entry.
+        walk_src, walk_dst, walk_time : numpy.ndarray
+            the walking links (min).
+        max_rides : int, optional
+            the most rides of a journey. The default is 4.
+        transfer_min : float, optional
+            the penalty of a transfer (min). The default is 2.
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.labels = np.asarray(labels).astype('U')
+        self.index = pd.Index(self.labels)
+        self.max_rides = max_rides
+        self.transfer_min = transfer_min
+
+        self.pat_ptr = np.asarray(pat_ptr, dtype='int64')
+        self.pat_name = np.asarray(pat_name)
+        self.pat_mode = np.asarray(pat_mode)
+        self.entry_stop = np.asarray(entry_stop, dtype='int64')
+        self.entry_time = np.asarray(entry_time, dtype='float64')
+
+        n_entry = self.entry_stop.shape[0]
+        self.entry_pat = np.repeat(np.arange(len(self.pat_name)), np.diff(self.pat_ptr))
+        self.entry_wait = np.array([WAIT_MIN[m] for m in self.pat_mode])[self.entry_pat]
+        # the later routes have the lower offsets, the prefix minimum restarts at each route
+        self.entry_offset = (len(self.pat_name) - self.entry_pat) * _SEG_OFFSET
+
+        # the entries grouped by stop
+        self.stop_order = np.argsort(self.entry_stop, kind='stable')
+        stop_sorted = self.entry_stop[self.stop_order]
+        self.stop_starts = np.flatnonzero(np.r_[True, stop_sorted[1:] != stop_sorted[:-1]]) \
+                           if n_entry > 0 else np.zeros(0, dtype='int64')
+        self.stop_served = stop_sorted[self.stop_starts]
+
+        # the walking links grouped by target stop
+        order = np.lexsort((walk_src, walk_dst))
+        self.walk_src = np.asarray(walk_src, dtype='int64')[order]
+        self.walk_dst = np.asarray(walk_dst, dtype='int64')[order]
+        self.walk_time = np.asarray(walk_time, dtype='float64')[order]
+        self.walk_starts = np.flatnonzero(np.r_[True, self.walk_dst[1:] != self.walk_dst[:-1]]) \
+                           if len(order) > 0 else np.zeros(0, dtype='int64')
+        self.walk_reached = self.walk_dst[self.walk_starts]
+        return None
+    # ------------------------------------------------------------------------
+    @classmethod
+    def FromRoutes(cls, bus_stop, bus_route, train_stn=None, train_route=None, walk_km=0.4,
+                   train_prefix='STN_', **kwargs):
+        '''
+        build the planner from the tables of "BusStopRoute2Net" and
+        "TrainRoute2Net"
+
+        Parameters
+        ----------
+        bus_stop : geopandas.GeoDataFrame
+            'BusStopCode', 'geometry'.
+        bus_route : pandas.DataFrame
+            'ServiceNo', 'Direction', 'BusStopCode', 'StopSequence', 'Distance'.
+        train_stn : geopandas.GeoDataFrame, optional
+            'stn_n', 'id', 'geometry', from "ReadTrianStaLocShp". The default is None.
+        train_route : pandas.DataFrame, optional
+            from "ReadTrainRouteCsv". The default is None.
+        walk_km : float, optional
+            the longest walking transfer (km). The default is 0.4.
+        train_prefix : str, optional
+            the prefix of the station ids. The default is 'STN_'.
+        **kwargs :
+            "max_rides", "transfer_min".
+
+        Returns
+        -------
+        planner : JourneyPlanner
+            DESCRIPTION.
+
+        '''
+        from scipy.spatial import cKDTree
+
+        bus_stop = bus_stop.to_crs(4326) if not (bus_stop.crs is None) else bus_stop
+        stop = pd.DataFrame({'stop' : bus_stop['BusStopCode'].astype(str).values,
+                             'lng'  : bus_stop.geometry.x.values,
+                             'lat'  : bus_stop.geometry.y.values})
+        pattern = _BusPatterns(bus_stop, bus_route)
+
+        if not (train_stn is None):
+            train_stn = train_stn.to_crs(4326) if not (train_stn.crs is None) else train_stn
+            train_stn = pd.DataFrame({'stn_n' : train_stn['stn_n'].values,
+                                      'id'    : train_stn['id'].astype(str).values,
+                                      'lng'   : train_stn.geometry.x.values,
+                                      'lat'   : train_stn.geometry.y.values})
+
+            stop = pd.concat([stop, pd.DataFrame({'stop' : train_prefix + train_stn['id'].values,
+                                                  'lng'  : train_stn['lng'].values,
+                                                  'lat'  : train_stn['lat'].values})],
+                             ignore_index=True)
+            pattern = pd.concat([pattern, _TrainPatterns(train_stn, train_route, train_prefix)],
+                                ignore_index=True)
+
+        stop = stop.drop_duplicates(subset='stop', ignore_index=True)
+        index = pd.Index(stop['stop'])
+
+        # the routes, in order of appearance
+        pat_code, pat_name = pd.factorize(pattern['name'])
+        pat_ptr = np.zeros(len(pat_name) + 1, dtype='int64')
+        pat_ptr[1:] = np.cumsum(np.bincount(pat_code, minlength=len(pat_name)))
+        pat_mode = pattern.groupby(pat_code, sort=True)['mode'].first().values
+
+        speed = pattern['mode'].map(SPEED_KMH).values
+        entry_time = pattern['dist'].values / speed * 60.
+
+        # the walking links, both directions
+        pairs = cKDTree(LngLat2XY(stop['lng'], stop['lat'])).query_pairs(walk_km, output_type='ndarray')
+        walk_dist = Haversine(stop['lng'].values[pairs[:, 0]], stop['lat'].values[pairs[:, 0]],
+                              stop['lng'].values[pairs[:, 1]], stop['lat'].values[pairs[:, 1]])
+        walk_time = walk_dist / SPEED_KMH['walk'] * 60.
+
+        return cls(stop['stop'].values, pat_ptr, np.asarray(pat_name), pat_mode,
+                   index.get_indexer(pattern['stop']), entry_time,
+                   np.r_[pairs[:, 0], pairs[:, 1]], np.r_[pairs[:, 1], pairs[:, 0]],
+                   np.r_[walk_time, walk_time], **kwargs)
+    # ------------------------------------------------------------------------
+    def _Walk(self, tau_from):
+        '''
+        one walk from the labels "tau_from": the best label of the reached
+        stops, and the walking link of it
+        '''
+        n_q, n = tau_from.shape
+        tau = np.full((n_q, n), np.inf)
+        arc = np.full((n_q, n), -1, dtype='int64')
+
+        if len(self.walk_src) > 0:
+            cand = tau_from[:, self.walk_src] + self.walk_time
+            tau[:, self.walk_reached], arc[:, self.walk_reached] = _SegArgMin(cand, self.walk_starts)
+        return tau, arc
+    # ------------------------------------------------------------------------
+    def _Rounds(self, origins):
+        '''
+        the RAPTOR rounds from the stops "origins" (integer ids)
+
+        Returns
+        -------
+        tau : numpy.ndarray
+            (origins, rounds, stops) the best time with at most k rides.
+        trace : dict
+            (origins, rounds, stops) arrays: 'src' how the stop is reached,
+            'board' / 'alight' the entries of the ride, 'walk' the walking link.
+        '''
+        n_q, n, n_round = len(origins), len(self.labels), self.max_rides + 1
+        rows = np.arange(n_q)
+
+        tau = np.full((n_q, n_round, n), np.inf)
+        trace = {'src'    : np.zeros((n_q, n_round, n), dtype='int8'),
+                 'board'  : np.full((n_q, n_round, n), -1, dtype='int32'),
+                 'alight' : np.full((n_q, n_round, n), -1, dtype='int32'),
+                 'walk'   : np.full((n_q, n_round, n), -1, dtype='int32')}
+
+        # round 0: the origins and their walks
+        arrived = np.full((n_q, n), np.inf)
+        arrived[rows, origins] = 0.
+        trace['src'][rows, 0, origins] = _SRC_ORIGIN
+
+        for k in range(n_round):
+            if k > 0:
+                # board at the best stop before along each route, alight at every stop
+                penalty = self.entry_wait + (self.transfer_min if k > 1 else 0.)
+                board = tau[:, k - 1, self.entry_stop] + penalty - self.entry_time + self.entry_offset
+
+                best = np.minimum.accumulate(board, axis=1)
+                board_ix = np.maximum.accumulate(
+                    np.where(board == best, np.arange(board.shape[1]), 0), axis=1)
+
+                # alight after the boarding entry
+                best = np.column_stack([np.full(n_q, np.inf), best[:, :-1]])
+                board_ix = np.column_stack([np.zeros(n_q, dtype='int64'), board_ix[:, :-1]])
+
+                ride = best - self.entry_offset + self.entry_time
+                # the minimum of a former route: not boarded on this route yet
+                ride[best - self.entry_offset >= _SEG_OFFSET / 2.] = np.inf
+
+                arrived = np.full((n_q, n), np.inf)
+                stop_best, stop_pos = _SegArgMin(ride[:, self.stop_order], self.stop_starts)
+                arrived[:, self.stop_served] = stop_best
+
+                alight = self.stop_order[np.maximum(stop_pos, 0)]
+                trace['alight'][:, k, self.stop_served] = alight
+                trace['board'][:, k, self.stop_served] = np.take_along_axis(board_ix, alight, axis=1)
+
+                tau[:, k] = tau[:, k - 1]
+                better = arrived < tau[:, k]
+                tau[:, k][better] = arrived[better]
+                trace['src'][:, k][better] = _SRC_RIDE
+            else:
+                tau[:, 0] = arrived
+
+            # one walk after the ride (or from the origin)
+            walked, arc = self._Walk(arrived)
+            better = walked < tau[:, k]
+            tau[:, k][better] = walked[better]
+            trace['src'][:, k][better] = _SRC_WALK
+            trace['walk'][:, k][better] = arc[better]
+        return tau, trace
+    # ------------------------------------------------------------------------
+    @staticmethod
+    def _Choose(tau_od, criterion):
+        '''
+        the round of each journey: the fastest, or the least transfers
+        (then the fastest), -1 if not reachable
+        '''
+        reached = np.isfinite(tau_od)
+        if criterion == 'fastest':
+            k = np.argmin(tau_od, axis=1)
+        elif criterion == 'transfers':
+            k = np.argmax(reached, axis=1)
+        else:
+            raise ValueError('Unknown criterion: {0}'.format(criterion))
+
+        k[~reached.any(axis=1)] = -1
+        return k
+    # ------------------------------------------------------------------------
+    def _Backtrack(self, trace, q, d, k):
+        '''
+        the legs of the journeys (batch rows "q", destinations "d", rounds "k")
+
+        Returns
+        -------
+        rides : numpy.ndarray
+            (journey, board entry, alight entry, step)
+        walks : numpy.ndarray
+            (journey, walking link, step)
+
+        The steps count the legs from the destination.
+        '''
+        journey = np.arange(len(q))
+        alive = k >= 0
+        journey, q, cur, k = journey[alive], q[alive], d[alive], k[alive]
+        after_walk = np.zeros(len(q), dtype=bool)
+
+        rides, walks, step = [], [], 0
+        while len(journey) > 0:
+            src = trace['src'][q, k, cur]
+            # at the arrival of a ride before a walk
+            src[after_walk] = _SRC_RIDE
+
+            is_ride = (src == _SRC_RIDE) & (k > 0)
+            is_walk = src == _SRC_WALK
+            is_none = src == _SRC_NONE
+
+            if is_ride.any():
+                b = trace['board'][q[is_ride], k[is_ride], cur[is_ride]]
+                a = trace['alight'][q[is_ride], k[is_ride], cur[is_ride]]
+                rides.append(np.column_stack([journey[is_ride], b, a, np.full(len(b), step)]))
+
+            if is_walk.any():
+                w = trace['walk'][q[is_walk], k[is_walk], cur[is_walk]]
+                walks.append(np.column_stack([journey[is_walk], w, np.full(len(w), step)]))
+
+            # the next state
+            cur = cur.copy()
+            if is_ride.any():
+                cur[is_ride] = self.entry_stop[b]
+            if is_walk.any():
+                cur[is_walk] = self.walk_src[w]
+
+            k = k - (is_ride | is_none)
+            after_walk = is_walk & (k > 0)
+
+            # done: at the origin, or walked from it
+            alive = (is_ride | is_none | after_walk) & (k >= 0)
+            journey, q, cur, k, after_walk = journey[alive], q[alive], cur[alive], k[alive], after_walk[alive]
+            step = step + 1
+
+        rides = np.vstack(rides) if len(rides) > 0 else np.zeros((0, 4), dtype='int64')
+        walks = np.vstack(walks) if len(walks) > 0 else np.zeros((0, 3), dtype='int64')
+        return rides, walks
+    # ------------------------------------------------------------------------
+    def _Batches(self, o, d, batch):
+        '''
+        the OD pairs grouped by origin, "batch" origins at a time
+
+        Yields
+        ------
+        (pair ids, origin rows in the batch, destinations, origin stops)
+        '''
+        o_ix = self.index.get_indexer(pd.Index(o).astype(str))
+        d_ix = self.index.get_indexer(pd.Index(d).astype(str))
+
+        pair = np.flatnonzero((o_ix >= 0) & (d_ix >= 0))
+        origins, o_row = np.unique(o_ix[pair], return_inverse=True)
+
+        for s in range(0, len(origins), batch):
+            sel = (o_row >= s) & (o_row < s + batch)
+            yield pair[sel], o_row[sel] - s, d_ix[pair[sel]], origins[s:s + batch]
+    # ------------------------------------------------------------------------
+    def Query(self, o, d, criterion='fastest'):
+        '''
+        the journey from the stop "o" to the stop "d"
+
+        Parameters
+        ----------
+        o, d : str
+            the bus stop codes or station ids (with the prefix).
+        criterion : str, optional
+            'fastest' or 'transfers'. The default is 'fastest'.
+
+        Returns
+        -------
+        journey : dict
+            'time' (min), 'transfers', 'legs' [{'mode', 'name', 'from', 'to', 'time'}, ...],
+            None if not reachable.
+
+        '''
+        o_ix, d_ix = self.index.get_loc(str(o)), self.index.get_loc(str(d))
+
+        tau, trace = self._Rounds(np.array([o_ix]))
+        k = self._Choose(tau[:, :, d_ix], criterion)
+        if k[0] < 0:
+            return None
+
+        rides, walks = self._Backtrack(trace, np.array([0]), np.array([d_ix]), k)
+
+        legs = []
+        for _, b, a, step in rides:
+            p = self.entry_pat[b]
+            legs.append((step, {'mode' : str(self.pat_mode[p]), 'name' : str(self.pat_name[p]),
+                                'from' : str(self.labels[self.entry_stop[b]]),
+                                'to'   : str(self.labels[self.entry_stop[a]]),
+                                'time' : float(self.entry_time[a] - self.entry_time[b])}))
+        for _, w, step in walks:
+            legs.append((step, {'mode' : 'walk', 'name' : None,
+                                'from' : str(self.labels[self.walk_src[w]]),
+                                'to'   : str(self.labels[self.walk_dst[w]]),
+                                'time' : float(self.walk_time[w])}))
+
+        # the legs are traced from the destination
+        return {'time'      : float(tau[0, k[0], d_ix]),
+                'transfers' : max(0, len(rides) - 1),
+                'legs'      : [leg for _, leg in sorted(legs, key=lambda x: -x[0])]}
+    # ------------------------------------------------------------------------
+    def QueryMany(self, o, d, criterion='fastest', batch=64):
+        '''
+        the journey times and transfers of the OD pairs, e.g. the pairs of
+        "GetODTrip", by batches of origins
+
+        Parameters
+        ----------
+        o, d : list-like
+            the stops.
+        criterion : str, optional
+            'fastest' or 'transfers'. The default is 'fastest'.
+        batch : int, optional
+            the origins of one run. The default is 64.
+
+        Returns
+        -------
+        result : pandas.DataFrame
+            'time' (min, nan if not reachable), 'transfers' (-1 if not reachable).
+
+        '''
+        time = np.full(len(o), np.nan)
+        transfers = np.full(len(o), -1, dtype='int64')
+
+        for pair, q, d_ix, origins in self._Batches(o, d, batch):
+            tau, _ = self._Rounds(origins)
+            tau_od = tau[q, :, d_ix]
+            k = self._Choose(tau_od, criterion)
+
+            found = k >= 0
+            time[pair[found]] = tau_od[found, k[found]]
+            # the rides of round k, the origin itself has no ride
+            transfers[pair[found]] = np.maximum(k[found] - 1, 0)
+
+        return pd.DataFrame({'time': time, 'transfers': transfers})
+    # ------------------------------------------------------------------------
+    def AssignODTrip(self, odtrip, vol_col, criterion='fastest', batch=64,
+                     o_col='O_BusStopCode', d_col='D_BusStopCode'):
+        '''
+        assign the volumes of the OD pairs (e.g. from "GetODTrip") to the
+        route segments and the walking links of their journeys
+
+        Parameters
+        ----------
+        odtrip : pandas.DataFrame
+            DESCRIPTION.
+        vol_col : str
+            the volume, e.g. 'WD_total'.
+        criterion : str, optional
+            'fastest' or 'transfers'. The default is 'fastest'.
+        batch : int, optional
+            the origins of one run. The default is 64.
+        o_col, d_col : str, optional
+            The default is 'O_BusStopCode', 'D_BusStopCode'.
+
+        Returns
+        -------
+        seg_vol : pandas.DataFrame
+            one row per route segment: 'name', 'mode', 'from', 'to', 'vol',
+            'board' (at "from"), 'alight' (at "to").
+        walk_vol : pandas.DataFrame
+            one row per used walking link: 'from', 'to', 'vol'.
+
+        '''
+        vol = odtrip[vol_col].fillna(0.).values.astype(float)
+        n_entry = len(self.entry_stop)
+
+        # on board between the entries: +vol at the boarding, -vol at the alighting
+        on_board = np.zeros(n_entry + 1)
+        board = np.zeros(n_entry)
+        alight = np.zeros(n_entry)
+        walk = np.zeros(len(self.walk_src))
+
+        for pair, q, d_ix, origins in self._Batches(odtrip[o_col].values, odtrip[d_col].values, batch):
+            tau, trace = self._Rounds(origins)
+            k = self._Choose(tau[q, :, d_ix], criterion)
+
+            rides, walks = self._Backtrack(trace, q, d_ix, k)
+            v_ride, v_walk = vol[pair[rides[:, 0]]], vol[pair[walks[:, 0]]]
+
+            np.add.at(on_board, rides[:, 1], v_ride)
+            np.add.at(on_board, rides[:, 2], -v_ride)
+            np.add.at(board, rides[:, 1], v_ride)
+            np.add.at(alight, rides[:, 2], v_ride)
+            np.add.at(walk, walks[:, 1], v_walk)
+
+        on_board = np.cumsum(on_board)[:n_entry]
+
+        # the segments: an entry and the next one of the same route
+        seg = np.flatnonzero(self.entry_pat[1:] == self.entry_pat[:-1])
+        seg_vol = pd.DataFrame({'name'   : self.pat_name[self.entry_pat[seg]],
+                                'mode'   : self.pat_mode[self.entry_pat[seg]],
+                                'from'   : self.labels[self.entry_stop[seg]],
+                                'to'     : self.labels[self.entry_stop[seg + 1]],
+                                'vol'    : on_board[seg],
+                                'board'  : board[seg],
+                                'alight' : alight[seg + 1]})
+
+        used = np.flatnonzero(walk > 0)
+        walk_vol = pd.DataFrame({'from' : self.labels[self.walk_src[used]],
+                                 'to'   : self.labels[self.walk_dst[used]],
+                                 'vol'  : walk[used]})
+        return seg_vol, walk_vol
+# ============================================================================
@@ -0,0 +1,244 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+# the files written by "ExportNetTables"
+EXPORT_FORMATS = ('csv', 'graphml', 'parquet')
+
+
+def _AttrCols(data_li):
+    '''
+    the attribute names of the elements, in order of appearance
+    '''
+    cols = {}
+    for d in data_li:
+        for k in d.keys():
+            cols[k] = None
+    return list(cols.keys())
+# ----------------------------------------------------------------------------
+def _Column(data_li, col, sep):
+    '''
+    the values of the attribute "col", the lists joined by "sep"
+    (kept as lists if "sep" is None), None if missing
+    '''
+    values = [d.get(col) for d in data_li]
+    if sep is None:
+        return values
+    return [sep.join(map(str, v)) if isinstance(v, (list, tuple, set)) else v for v in values]
+# ----------------------------------------------------------------------------
+def NetNodeTable(net, cols=None, id_col='Id', sep=','):
+    '''
+    the node table of a network, built in one pass
+
+    Parameters
+    ----------
+    net : networkx.Graph
+        DESCRIPTION.
+    cols : list, optional
+        the node attributes. The default is None, all of them.
+    id_col : str, optional
+        The default is 'Id' (Gephi).
+    sep : str, optional
+        the separator of the list values, None keeps the lists. The default is ','.
+
+    Returns
+    -------
+    node_pd : pandas.DataFrame
+        DESCRIPTION.
+
+    '''
+    node_li = list(net.nodes)
+    data_li = [net.nodes[n] for n in node_li]
+    cols = _AttrCols(data_li) if cols is None else list(cols)
+
+    table = {id_col: node_li}
+    for col in cols:
+        table[col] = _Column(data_li, col, sep)
+    return pd.DataFrame(table, columns=[id_col] + cols)
+# ----------------------------------------------------------------------------
+def NetEdgeTable(net, cols=None, source_col='Source', target_col='Target', key_col='Key', sep=','):
+    '''
+    the edge table of a network, built in one pass
+
+    Parameters
+    ----------
+    net : networkx.Graph
+        DESCRIPTION.
+    cols : list, optional
+        the edge attributes. The default is None, all of them.
+    source_col, target_col : str, optional
+        The default is 'Source', 'Target' (Gephi).
+    key_col : str, optional
+        the edge keys of a multigraph. The default is 'Key'.
+    sep : str, optional
+        the separator of the list values, None keeps the lists. The default is ','.
+
+    Returns
+    -------
+    edge_pd : pandas.DataFrame
+        DESCRIPTION.
+
+    '''
+    if net.is_multigraph():
+        edge_li = list(net.edges(keys=True, data=True))
+        table = {source_col : [e[0] for e in edge_li],
+                 target_col : [e[1] for e in edge_li],
+                 key_col    : [e[2] for e in edge_li]}
+        data_li = [e[3] for e in edge_li]
+    else:
+        edge_li = list(net.edges(data=True))
+        table = {source_col : [e[0] for e in edge_li],
+                 target_col : [e[1] for e in edge_li]}
+        data_li = [e[2] for e in edge_li]
+
+    cols = _AttrCols(data_li) if cols is None else list(cols)
+
+    id_cols = list(table.keys())
+    for col in cols:
+        table[col] = _Column(data_li, col, sep)
+    return pd.DataFrame(table, columns=id_cols + cols)
+# ============================================================================
+
+
+
+
+def _GraphmlType(series):
+    '''
+    the GraphML type of a column
+    '''
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(series):
+        return 'long'
+    if pd.api.types.is_float_dtype(series):
+        return 'double'
+    return 'string'
+# ----------------------------------------------------------------------------
+def _GraphmlData(table, cols, keys):
+    '''
+    the <data> elements of every row of "table", the missing values are skipped
+    '''
+    parts = []
+    for col in cols:
+        values = table[col]
+        missing = values.isna().values
+
+        if keys[col][1] == 'boolean':
+            text = np.where(values.values, 'true', 'false')
+        else:
+            text = values.astype(str).map(escape).values
+
+        parts.append(np.where(missing, '',
+                              np.char.add(np.char.add('<data key="{0}">'.format(keys[col][0]),
+                                                      text.astype('U')), '</data>')))
+
+    if len(parts) == 0:
+        return np.full(len(table), '', dtype='U1')
+
+    data = parts[0]
+    for p in parts[1:]:
+        data = np.char.add(data, p)
+    return data
+# ----------------------------------------------------------------------------
+def WriteGraphml(node_pd, edge_pd, path, directed=True, id_col='Id',
+                 source_col='Source', target_col='Target'):
+    '''
+    write the node and edge tables as a GraphML file, in one pass
+        the list values have to be joined first (see "NetNodeTable")
+
+    Parameters
+    ----------
+    node_pd : pandas.DataFrame
+        DESCRIPTION.
+    edge_pd : pandas.DataFrame
+        DESCRIPTION.
+    path : str
+        DESCRIPTION.
+    directed : bool, optional
+        The default is True.
+
+    Returns
+    -------
+    None.
+
+    '''
+    node_cols = [c for c in node_pd.columns if c != id_col]
+    edge_cols = [c for c in edge_pd.columns if not (c in [source_col, target_col])]
+
+    # attribute -> (key id, type)
+    node_keys = {c: ('n{0}'.format(i), _GraphmlType(node_pd[c])) for i, c in enumerate(node_cols)}
+    edge_keys = {c: ('e{0}'.format(i), _GraphmlType(edge_pd[c])) for i, c in enumerate(edge_cols)}
+
+    node_ids = node_pd[id_col].astype(str).map(quoteattr).values.astype('U')
+    node_lines = np.char.add(np.char.add(np.char.add('<node id=', node_ids), '>'),
+                             _GraphmlData(node_pd, node_cols, node_keys))
+
+    source = edge_pd[source_col].astype(str).map(quoteattr).values.astype('U')
+    target = edge_pd[target_col].astype(str).map(quoteattr).values.astype('U')
+    edge_lines = np.char.add(np.char.add(np.char.add(np.char.add('<edge source=', source), ' target='),
+                                         target), '>')
+    edge_lines = np.char.add(edge_lines, _GraphmlData(edge_pd, edge_cols, edge_keys))
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+
+        for for_, keys in [('node', node_keys), ('edge', edge_keys)]:
+            for col, (key, type_) in keys.items():
+                f.write('<key id="{0}" for="{1}" attr.name={2} attr.type="{3}" />\n'.format(
+                        key, for_, quoteattr(str(col)), type_))
+
+        f.write('<graph edgedefault="{0}">\n'.format('directed' if directed else 'undirected'))
+        f.write('</node>\n'.join(node_lines.tolist()) + ('</node>\n' if len(node_lines) > 0 else ''))
+        f.write('</edge>\n'.join(edge_lines.tolist()) + ('</edge>\n' if len(edge_lines) > 0 else ''))
+        f.write('</graph>\n</graphml>\n')
+    return None
+# ----------------------------------------------------------------------------
+def ExportNetTables(node_pd, edge_pd, path, formats=EXPORT_FORMATS, directed=True):
+    '''
+    write the node and edge tables of a network
+        'csv'     : "<path>_nodes.csv", "<path>_edges.csv" (Gephi spreadsheet import)
+        'graphml' : "<path>.graphml"
+        'parquet' : "<path>_nodes.parquet", "<path>_edges.parquet"
+
+    Parameters
+    ----------
+    node_pd : pandas.DataFrame
+        from "NetNodeTable", the first column is the node id.
+    edge_pd : pandas.DataFrame
+        from "NetEdgeTable", the first two columns are the source and target.
+    path : str
+        the path without extension, e.g. 'output/bus_net'.
+    formats : tuple, optional
+        The default is EXPORT_FORMATS.
+    directed : bool, optional
+        The default is True.
+
+    Returns
+    -------
+    None.
+
+    '''
+    folder_path = os.path.dirname(path)
+    if folder_path and not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    for fmt in formats:
+        if fmt == 'csv':
+            node_pd.to_csv(path + '_nodes.csv', index=False)
+            edge_pd.to_csv(path + '_edges.csv', index=False)
+        elif fmt == 'graphml':
+            WriteGraphml(node_pd, edge_pd, path + '.graphml', directed=directed,
+                         id_col=node_pd.columns[0],
+                         source_col=edge_pd.columns[0], target_col=edge_pd.columns[1])
+        elif fmt == 'parquet':
+            node_pd.to_parquet(path + '_nodes.parquet', index=False)
+            edge_pd.to_parquet(path + '_edges.parquet', index=False)
+        else:
+            raise ValueError('Unknown format: {0}'.format(fmt))
+    return None
+# ============================================================================